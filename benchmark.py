@@ -0,0 +1,274 @@
+"""
+Benchmark da camada de banco (database.py) com dados sintéticos.
+
+Gera usuários, categorias, descrições e datas realistas a partir de uma semente fixa
+(tamanho por usuário com distribuição enviesada: poucos usuários concentram a maior parte
+das transações) e mede as funções públicas de database.py. O relatório sai em JSON.
+
+Uso:
+    python benchmark.py --linhas 100000 --usuarios 200 --saida bench.json
+    python benchmark.py --linhas 10000000 --database-url sqlite:////tmp/bench.db
+"""
+import os
+import sys
+import json
+import contextlib
+import time
+import random
+import argparse
+import tempfile
+import platform
+from datetime import datetime, timedelta, timezone
+
+# Descrições típicas por categoria; o gerador sorteia uma e às vezes acrescenta um complemento.
+DESCRICOES_POR_CATEGORIA = {
+    "alimentação": ["iFood", "Padaria", "Mercado Extra", "Restaurante", "Almoço", "Café", "Lanche", "Pão de Açúcar", "Açougue", "Feira"],
+    "transporte": ["Uber", "99", "Gasolina", "Estacionamento", "Metrô", "Ônibus", "Pedágio"],
+    "lazer": ["Cinema", "Netflix", "Spotify", "Show", "Bar", "Viagem"],
+    "moradia": ["Aluguel", "Condomínio", "IPTU", "Conta de luz", "Conta de água", "Internet"],
+    "saúde": ["Farmácia", "Drogasil", "Consulta", "Plano de saúde", "Academia"],
+    "educação": ["Curso online", "Livro", "Mensalidade faculdade", "Material escolar"],
+    "compras": ["Amazon", "Mercado Livre", "Roupas", "Shopee", "Eletrônicos"],
+    "contas": ["Celular", "Cartão de crédito", "Seguro"],
+}
+# Peso de cada categoria entre as saídas.
+PESOS_CATEGORIAS = {"alimentação": 35, "transporte": 20, "lazer": 10, "moradia": 8, "saúde": 7, "educação": 4, "compras": 10, "contas": 6}
+# Faixa de valor (mínimo, máximo) por categoria.
+FAIXAS_VALOR = {"alimentação": (8, 180), "transporte": (6, 250), "lazer": (15, 400), "moradia": (80, 3000), "saúde": (20, 600), "educação": (30, 1500), "compras": (20, 1200), "contas": (40, 500)}
+DESCRICOES_ENTRADA = {"salário": ["Salário", "Adiantamento salarial"], "presente": ["Presente", "Pix da família"], "investimentos": ["Rendimento CDB", "Dividendos"], "outros": ["Freela", "Reembolso", "Venda"]}
+PESOS_ENTRADA = {"salário": 60, "presente": 10, "investimentos": 15, "outros": 15}
+COMPLEMENTOS = ["", "", "", " centro", " shopping", " SP", " online", " 24h"]
+
+
+class GeradorSintetico:
+    """Gera transações sintéticas reprodutíveis a partir de `semente`."""
+
+    def __init__(self, semente: int, usuarios: int, anos: float, agora: datetime):
+        self.random = random.Random(semente)
+        self.agora = agora
+        self.inicio = agora - timedelta(days=365 * anos)
+        self.usuarios = [f"bench_{i:06d}" for i in range(usuarios)]
+        # Lei de Zipf: o usuário de posição k recebe peso 1/k^1.1.
+        self.pesos_usuarios = [1 / (k ** 1.1) for k in range(1, usuarios + 1)]
+        self.categorias = list(PESOS_CATEGORIAS)
+        self.pesos_categorias = list(PESOS_CATEGORIAS.values())
+        self.categorias_entrada = list(PESOS_ENTRADA)
+        self.pesos_entrada = list(PESOS_ENTRADA.values())
+
+    def _data_hora(self) -> datetime:
+        # Mais transações no passado recente: a raiz quadrada enviesa o sorteio para perto de `agora`.
+        fracao = self.random.random() ** 0.5
+        data = self.inicio + (self.agora - self.inicio) * fracao
+        return data.replace(hour=self.random.choice((8, 9, 12, 13, 18, 19, 20, 21)), minute=self.random.randrange(60), second=0, microsecond=0)
+
+    def transacao(self) -> dict:
+        if self.random.random() < 0.12:
+            categoria = self.random.choices(self.categorias_entrada, self.pesos_entrada)[0]
+            valor = self.random.uniform(1500, 12000) if categoria == "salário" else self.random.uniform(20, 2000)
+            return {"tipo": "entrada", "valor": round(valor, 2), "categoria": categoria,
+                    "descricao": self.random.choice(DESCRICOES_ENTRADA[categoria]), "data_hora": self._data_hora()}
+        categoria = self.random.choices(self.categorias, self.pesos_categorias)[0]
+        minimo, maximo = FAIXAS_VALOR[categoria]
+        # Valores com cauda longa: a maioria perto do mínimo, alguns perto do máximo.
+        valor = minimo + (maximo - minimo) * self.random.random() ** 3
+        descricao = self.random.choice(DESCRICOES_POR_CATEGORIA[categoria]) + self.random.choice(COMPLEMENTOS)
+        return {"tipo": "saída", "valor": round(valor, 2), "categoria": categoria, "descricao": descricao, "data_hora": self._data_hora()}
+
+    def lotes(self, linhas: int, tamanho_lote: int):
+        """Gera (usuario_id, [transações]) em lotes, sem manter o conjunto inteiro em memória."""
+        geradas = 0
+        while geradas < linhas:
+            quantidade = min(tamanho_lote, linhas - geradas)
+            por_usuario = {}
+            for usuario_id in self.random.choices(self.usuarios, self.pesos_usuarios, k=quantidade):
+                por_usuario.setdefault(usuario_id, []).append(self.transacao())
+            yield from por_usuario.items()
+            geradas += quantidade
+
+
+def _percentil(amostras_ordenadas: list[float], p: float) -> float:
+    indice = min(len(amostras_ordenadas) - 1, max(0, round(p / 100 * len(amostras_ordenadas) + 0.5) - 1))
+    return amostras_ordenadas[indice]
+
+def _resumir(tempos: list[float], linhas_por_chamada: list[int] | None = None) -> dict:
+    ordenados = sorted(tempos)
+    total = sum(tempos)
+    resumo = {
+        "n": len(tempos),
+        "p50_ms": round(_percentil(ordenados, 50) * 1000, 3),
+        "p95_ms": round(_percentil(ordenados, 95) * 1000, 3),
+        "p99_ms": round(_percentil(ordenados, 99) * 1000, 3),
+        "media_ms": round(total / len(tempos) * 1000, 3),
+        "ops_por_s": round(len(tempos) / total, 1) if total else None,
+    }
+    if linhas_por_chamada is not None:
+        resumo["linhas_por_s"] = round(sum(linhas_por_chamada) / total, 1) if total else None
+    return resumo
+
+def _medir(funcao, repeticoes: int, contar_linhas=None) -> dict:
+    tempos, linhas = [], []
+    for _ in range(repeticoes):
+        inicio = time.perf_counter()
+        resultado = funcao()
+        tempos.append(time.perf_counter() - inicio)
+        if contar_linhas:
+            linhas.append(contar_linhas(resultado))
+    return _resumir(tempos, linhas if contar_linhas else None)
+
+
+def cenarios_de_consulta(agora: datetime) -> dict:
+    """Dicionários `params` representativos do que o LLM costuma devolver no /estatisticas."""
+    inicio_mes = agora.replace(day=1, hour=0, minute=0, second=0, microsecond=0)
+    inicio_ano = inicio_mes.replace(month=1)
+    ultimos_30 = (agora - timedelta(days=30)).replace(hour=0, minute=0, second=0, microsecond=0)
+    return {
+        "soma_saidas_mes_atual": {"operacao": "soma_valor", "tipo_transacao": "saída", "data_inicio": inicio_mes.isoformat(), "data_fim": agora.isoformat()},
+        "soma_alimentacao_ano": {"operacao": "soma_valor", "tipo_transacao": "saída", "categorias": ["alimentação"], "data_inicio": inicio_ano.isoformat(), "data_fim": agora.isoformat()},
+        "soma_entradas_total": {"operacao": "soma_valor", "tipo_transacao": "entrada"},
+        "contar_ultimos_30_dias": {"operacao": "contar_transacoes", "data_inicio": ultimos_30.isoformat(), "data_fim": agora.isoformat()},
+        "media_transporte_ano": {"operacao": "media_valor", "tipo_transacao": "saída", "categorias": ["transporte"], "data_inicio": inicio_ano.isoformat(), "data_fim": agora.isoformat()},
+        "soma_descricao_uber": {"operacao": "soma_valor", "tipo_transacao": "saída", "descricao_contem": ["uber"]},
+        "listar_maiores_5_ano": {"operacao": "listar_transacoes", "tipo_transacao": "saída", "data_inicio": inicio_ano.isoformat(), "data_fim": agora.isoformat(), "ordenar_por": "valor", "ordem": "desc", "limite_resultados": 5},
+        "listar_mes_atual": {"operacao": "listar_transacoes", "data_inicio": inicio_mes.isoformat(), "data_fim": agora.isoformat()},
+        "listar_saidas_ano": {"operacao": "listar_transacoes", "tipo_transacao": "saída", "data_inicio": inicio_ano.isoformat(), "data_fim": agora.isoformat()},
+        "agrupar_categorias_ano": {"operacao": "agrupar_por_categoria", "tipo_transacao": "saída", "data_inicio": inicio_ano.isoformat(), "data_fim": agora.isoformat()},
+        "serie_mensal_total": {"operacao": "serie_mensal"},
+        "serie_diaria_mes_atual": {"operacao": "serie_diaria", "data_inicio": inicio_mes.isoformat(), "data_fim": agora.isoformat()},
+    }
+
+
+def _contar_linhas_resultado(resultado) -> int:
+    if isinstance(resultado, dict) and "transacoes" in resultado:
+        return len(resultado["transacoes"])
+    if isinstance(resultado, dict) and "grupos" in resultado:
+        return len(resultado["grupos"])
+    if isinstance(resultado, list):
+        return len(resultado)
+    return 1
+
+
+def executar(args) -> dict:
+    # database.py lê DATABASE_URL na importação, então a variável precisa ser definida antes.
+    os.environ["DATABASE_URL"] = args.database_url
+    import database
+
+    agora = datetime.now(timezone.utc)
+    gerador = GeradorSintetico(args.semente, args.usuarios, args.anos, agora)
+    relatorio = {
+        "config": {
+            "linhas": args.linhas, "usuarios": args.usuarios, "anos": args.anos, "semente": args.semente,
+            "repeticoes": args.repeticoes, "database_url": args.database_url,
+            "python": platform.python_version(), "executado_em": agora.isoformat(),
+        },
+        "resultados": {},
+    }
+
+    database.init_db()
+
+    # Carga: add_transactions_bulk por usuário dentro de cada lote.
+    print(f"Gerando e inserindo {args.linhas} transações para {args.usuarios} usuários...", file=sys.stderr)
+    tempos_carga, linhas_carga = [], []
+    for usuario_id, transacoes in gerador.lotes(args.linhas, args.tamanho_lote):
+        inicio = time.perf_counter()
+        database.add_transactions_bulk(database.SessionLocal(), usuario_id, transacoes)
+        tempos_carga.append(time.perf_counter() - inicio)
+        linhas_carga.append(len(transacoes))
+    relatorio["carga"] = {"segundos": round(sum(tempos_carga), 3), **_resumir(tempos_carga, linhas_carga)}
+
+    with database.engine.connect() as conn:
+        contagens = conn.execute(
+            database.select(database.Transacao.usuario_id, database.func.count())
+            .where(database.Transacao.usuario_id.like("bench_%"))
+            .group_by(database.Transacao.usuario_id)
+            .order_by(database.func.count().desc())
+        ).all()
+    # Usuário mais pesado e usuário mediano, para ver como o tempo escala com o histórico.
+    perfis = {"usuario_pesado": contagens[0], "usuario_mediano": contagens[len(contagens) // 2]}
+    relatorio["usuarios"] = {perfil: {"usuario_id": u, "transacoes": n} for perfil, (u, n) in perfis.items()}
+
+    resultados = relatorio["resultados"]
+    novas = [gerador.transacao() for _ in range(args.repeticoes)]
+    iterador_novas = iter(novas)
+
+    def inserir_uma():
+        t = next(iterador_novas)
+        database.add_transaction(database.SessionLocal(), perfis["usuario_mediano"][0], t["tipo"], t["valor"], t["categoria"], t["descricao"], t["data_hora"])
+    resultados["add_transaction"] = _medir(inserir_uma, args.repeticoes, lambda _: 1)
+
+    for perfil, (usuario_id, _) in perfis.items():
+        resultados[f"get_saldo.{perfil}"] = _medir(lambda: database.get_saldo(database.SessionLocal(), usuario_id), args.repeticoes)
+        for tipo in ("saída", "entrada"):
+            resultados[f"get_transacoes_por_tipo.{tipo}.{perfil}"] = _medir(
+                lambda: database.get_transacoes_por_tipo(database.SessionLocal(), usuario_id, tipo, limit=10),
+                args.repeticoes, _contar_linhas_resultado,
+            )
+            # Página funda: cursor a 90% do histórico, perto das transações mais antigas (deve custar o mesmo que a primeira página).
+            with database.engine.connect() as conn:
+                total = conn.execute(
+                    database.select(database.func.count()).select_from(database.Transacao)
+                    .where(database.Transacao.usuario_id == usuario_id, database.Transacao.tipo == tipo)
+                ).scalar()
+                ancora = conn.execute(
+                    database.select(database.Transacao.data_hora, database.Transacao.id)
+                    .where(database.Transacao.usuario_id == usuario_id, database.Transacao.tipo == tipo)
+                    .order_by(database.Transacao.data_hora.desc(), database.Transacao.id.desc())
+                    .offset(int(total * 0.9)).limit(1)
+                ).first()
+            if ancora:
+                cursor = (ancora.data_hora, ancora.id)
+                resultados[f"get_transacoes_por_tipo.pagina_funda.{tipo}.{perfil}"] = _medir(
+                    lambda: database.get_transacoes_por_tipo(database.SessionLocal(), usuario_id, tipo, limit=10, cursor=cursor),
+                    args.repeticoes, _contar_linhas_resultado,
+                )
+        for nome, params in cenarios_de_consulta(agora).items():
+            resultados[f"query_dynamic_transactions.{nome}.{perfil}"] = _medir(
+                lambda: database.query_dynamic_transactions(database.SessionLocal(), usuario_id, params),
+                args.repeticoes, _contar_linhas_resultado,
+            )
+            if params["operacao"] == "listar_transacoes":
+                # Modo usado pelo /estatisticas: COUNT(*) + 3 primeiras linhas como tuplas.
+                resultados[f"query_dynamic_transactions.{nome}.preview.{perfil}"] = _medir(
+                    lambda: database.query_dynamic_transactions(database.SessionLocal(), usuario_id, params, preview_limit=3),
+                    args.repeticoes, _contar_linhas_resultado,
+                )
+        print(f"Consultas medidas para {perfil} ({usuario_id}).", file=sys.stderr)
+
+    return relatorio
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Benchmark da camada de banco com dados sintéticos.")
+    parser.add_argument("--linhas", type=int, default=100_000, help="Transações sintéticas a gerar (1k a 10M).")
+    parser.add_argument("--usuarios", type=int, default=200, help="Quantidade de usuários sintéticos.")
+    parser.add_argument("--anos", type=float, default=3, help="Quantos anos de histórico as datas cobrem.")
+    parser.add_argument("--semente", type=int, default=42, help="Semente do gerador (mesma semente, mesmos dados).")
+    parser.add_argument("--repeticoes", type=int, default=100, help="Execuções medidas por função/cenário.")
+    parser.add_argument("--tamanho-lote", type=int, default=50_000, help="Transações geradas por lote durante a carga.")
+    parser.add_argument("--database-url", default=None, help="Banco usado no benchmark (padrão: SQLite temporário).")
+    parser.add_argument("--saida", default=None, help="Arquivo do relatório JSON (padrão: stdout).")
+    args = parser.parse_args()
+
+    diretorio_temporario = None
+    if args.database_url is None:
+        diretorio_temporario = tempfile.TemporaryDirectory()
+        args.database_url = f"sqlite:///{os.path.join(diretorio_temporario.name, 'bench.db')}"
+
+    try:
+        # Os avisos do database.py (migrações, erros) vão para o stderr: o stdout leva só o relatório.
+        with contextlib.redirect_stdout(sys.stderr):
+            relatorio = executar(args)
+    finally:
+        if diretorio_temporario:
+            diretorio_temporario.cleanup()
+
+    saida = json.dumps(relatorio, ensure_ascii=False, indent=2)
+    if args.saida:
+        with open(args.saida, "w", encoding="utf-8") as arquivo:
+            arquivo.write(saida + "\n")
+        print(f"Relatório salvo em {args.saida}", file=sys.stderr)
+    else:
+        print(saida)
+
+
+if __name__ == "__main__":
+    main()
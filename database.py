@@ -1,22 +1,52 @@
 import os
+import io
+import re
+import csv
+import json
 from datetime import datetime, timezone
-from sqlalchemy import create_engine, Column, Integer, REAL, DateTime, Text, func, desc, asc
+from sqlalchemy import create_engine, Column, Integer, REAL, DateTime, Text, Index, func, desc, asc, select, insert, update, delete, text, column, bindparam, or_, inspect
 from sqlalchemy.orm import sessionmaker, declarative_base
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
 from datetime import datetime, timedelta, timezone
 import calendar
 
 from dotenv import load_dotenv
 
+from metrics import medir_latencia
+
 load_dotenv()
 
 DATABASE_URL = os.getenv("DATABASE_URL", "sqlite:///transacoes.db")
+PENDING_CONFIRMATION_TTL_SECONDS = int(os.getenv("PENDING_CONFIRMATION_TTL_SECONDS", "86400"))
+EXPORT_YIELD_PER = int(os.getenv("EXPORT_YIELD_PER", "1000"))
+
+def _to_async_url(url: str) -> str:
+    """Converte a URL síncrona no driver assíncrono equivalente (ex: sqlite -> sqlite+aiosqlite)."""
+    if url.startswith("sqlite:"):
+        return url.replace("sqlite:", "sqlite+aiosqlite:", 1)
+    if url.startswith("postgresql:"):
+        return url.replace("postgresql:", "postgresql+asyncpg:", 1)
+    return url
+
+ASYNC_DATABASE_URL = os.getenv("ASYNC_DATABASE_URL", _to_async_url(DATABASE_URL))
 
 engine = create_engine(DATABASE_URL)
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+
+# Engine assíncrono usado pelos handlers do bot, para que o I/O do banco não bloqueie o event loop.
+async_engine = create_async_engine(ASYNC_DATABASE_URL)
+AsyncSessionLocal = async_sessionmaker(bind=async_engine, autoflush=False, expire_on_commit=False)
+
 Base = declarative_base()
 
 class Transacao(Base):
     __tablename__ = "transacoes"
+    __table_args__ = (
+        # Cobre get_saldo/get_transacoes_por_tipo e as consultas dinâmicas filtradas por tipo (valor incluso para SUM/AVG sem ler a tabela).
+        Index("ix_transacoes_usuario_tipo_data", "usuario_id", "tipo", "data_hora", "valor"),
+        # Consultas dinâmicas sem filtro de tipo, com intervalo de datas.
+        Index("ix_transacoes_usuario_data", "usuario_id", "data_hora"),
+    )
 
     id = Column(Integer, primary_key=True, index=True, autoincrement=True)
     usuario_id = Column(Text, nullable=False)
@@ -27,71 +57,993 @@ class Transacao(Base):
     data_hora = Column(DateTime, default=datetime.utcnow, nullable=False)
 
 
+class SaldoUsuario(Base):
+    """Totais acumulados de entradas e saídas por usuário, mantidos por add_transaction."""
+    __tablename__ = "saldos_usuarios"
+
+    usuario_id = Column(Text, primary_key=True)
+    total_entradas = Column(REAL, nullable=False, default=0.0)
+    total_saidas = Column(REAL, nullable=False, default=0.0)
+    atualizado_em = Column(DateTime, default=datetime.utcnow, nullable=False)
+    # Incrementada a cada gravação de transações do usuário; invalida caches derivados dos dados (ex: /grafico).
+    versao = Column(Integer, nullable=False, default=0, server_default="0")
+
+
+class ResumoMensal(Base):
+    """Soma e contagem de transações por usuário, mês (UTC), tipo e categoria, mantidas por add_transaction."""
+    __tablename__ = "resumos_mensais"
+
+    usuario_id = Column(Text, primary_key=True)
+    ano_mes = Column(Text, primary_key=True)  # "YYYY-MM"
+    tipo = Column(Text, primary_key=True)
+    categoria = Column(Text, primary_key=True)  # "" quando a transação não tem categoria
+    soma = Column(REAL, nullable=False, default=0.0)
+    contagem = Column(Integer, nullable=False, default=0)
+
+
+class ConfirmacaoPendente(Base):
+    """Transações extraídas de uma mensagem aguardando o clique em Salvar/Tentar Novamente."""
+    __tablename__ = "confirmacoes_pendentes"
+
+    usuario_id = Column(Text, primary_key=True)
+    mensagem_id = Column(Integer, primary_key=True)
+    dados = Column(Text, nullable=False)  # JSON com a lista de transações
+    expira_em = Column(DateTime, nullable=False, index=True)
+
+
+class UsoTokens(Base):
+    """Tokens do LLM consumidos por usuário, dia (UTC, "YYYY-MM-DD") e função do llm_client."""
+    __tablename__ = "uso_tokens"
+
+    usuario_id = Column(Text, primary_key=True)
+    dia = Column(Text, primary_key=True)
+    funcao = Column(Text, primary_key=True)
+    chamadas = Column(Integer, nullable=False, default=0)
+    prompt_tokens = Column(Integer, nullable=False, default=0)
+    completion_tokens = Column(Integer, nullable=False, default=0)
+
+    __table_args__ = (
+        Index("ix_uso_tokens_dia", "dia"),
+    )
+
+
+class SchemaMigration(Base):
+    __tablename__ = "schema_migrations"
+
+    versao = Column(Integer, primary_key=True)
+    descricao = Column(Text, nullable=False)
+    aplicada_em = Column(DateTime, default=datetime.utcnow, nullable=False)
+
+
+# --- Migrações de esquema ---
+# create_all só cria tabelas que ainda não existem; alterações em tabelas já existentes
+# (índices, colunas, backfills) devem ser registradas em MIGRATIONS com uma versão nova.
+# Cada migração recebe uma Connection dentro de uma transação e deve ser idempotente,
+# pois em bancos novos create_all já terá criado parte do que ela aplica.
+
+def _migracao_001_indices_transacoes(conn):
+    for index in Transacao.__table__.indexes:
+        index.create(bind=conn, checkfirst=True)
+
+def _migracao_002_saldos_usuarios(conn):
+    SaldoUsuario.__table__.create(bind=conn, checkfirst=True)
+    _rebuild_saldos(conn)
+
+def _migracao_003_resumos_mensais(conn):
+    ResumoMensal.__table__.create(bind=conn, checkfirst=True)
+    _rebuild_resumos_mensais(conn)
+
+# Índice de texto completo para buscas por palavra na descrição (descricao_contem).
+# Só existe no SQLite; "remove_diacritics 2" faz "padaria" casar com "pádaria" e o
+# tokenizador unicode61 já ignora maiúsculas ("ifood" / "iFood").
+_FTS_DDL = [
+    "CREATE VIRTUAL TABLE IF NOT EXISTS transacoes_fts USING fts5("
+    " descricao, categoria, content='transacoes', content_rowid='id',"
+    " tokenize='unicode61 remove_diacritics 2')",
+    "CREATE TRIGGER IF NOT EXISTS transacoes_fts_ai AFTER INSERT ON transacoes BEGIN"
+    " INSERT INTO transacoes_fts(rowid, descricao, categoria) VALUES (new.id, new.descricao, new.categoria);"
+    " END",
+    "CREATE TRIGGER IF NOT EXISTS transacoes_fts_ad AFTER DELETE ON transacoes BEGIN"
+    " INSERT INTO transacoes_fts(transacoes_fts, rowid, descricao, categoria) VALUES ('delete', old.id, old.descricao, old.categoria);"
+    " END",
+    "CREATE TRIGGER IF NOT EXISTS transacoes_fts_au AFTER UPDATE ON transacoes BEGIN"
+    " INSERT INTO transacoes_fts(transacoes_fts, rowid, descricao, categoria) VALUES ('delete', old.id, old.descricao, old.categoria);"
+    " INSERT INTO transacoes_fts(rowid, descricao, categoria) VALUES (new.id, new.descricao, new.categoria);"
+    " END",
+]
+
+def _migracao_004_transacoes_fts(conn):
+    if conn.dialect.name != "sqlite":
+        return
+    try:
+        conn.exec_driver_sql("CREATE VIRTUAL TABLE temp._teste_fts5 USING fts5(x)")
+        conn.exec_driver_sql("DROP TABLE temp._teste_fts5")
+    except Exception as e:
+        print(f"AVISO: SQLite sem suporte a FTS5 ({e}). Buscas por descrição continuarão usando LIKE.")
+        return
+    for ddl in _FTS_DDL:
+        conn.exec_driver_sql(ddl)
+    conn.exec_driver_sql("INSERT INTO transacoes_fts(transacoes_fts) VALUES ('rebuild')")
+
+def _migracao_005_uso_tokens(conn):
+    UsoTokens.__table__.create(bind=conn, checkfirst=True)
+
+def _migracao_006_versao_saldos(conn):
+    colunas = {coluna["name"] for coluna in inspect(conn).get_columns("saldos_usuarios")}
+    if "versao" not in colunas:
+        conn.exec_driver_sql("ALTER TABLE saldos_usuarios ADD COLUMN versao INTEGER NOT NULL DEFAULT 0")
+
+MIGRATIONS = [
+    (1, "Índices compostos em transacoes (usuario_id, tipo, data_hora) e (usuario_id, data_hora)", _migracao_001_indices_transacoes),
+    (2, "Tabela saldos_usuarios com totais acumulados por usuário", _migracao_002_saldos_usuarios),
+    (3, "Tabela resumos_mensais com soma/contagem por mês, tipo e categoria", _migracao_003_resumos_mensais),
+    (4, "Índice FTS5 transacoes_fts sobre descricao e categoria (somente SQLite)", _migracao_004_transacoes_fts),
+    (5, "Tabela uso_tokens com tokens do LLM por usuário, dia e função", _migracao_005_uso_tokens),
+    (6, "Coluna versao em saldos_usuarios, incrementada a cada gravação de transações", _migracao_006_versao_saldos),
+]
+
+def run_migrations(bind=None):
+    """
+    Aplica, em ordem, as migrações de MIGRATIONS ainda não registradas em schema_migrations.
+    Retorna a lista de versões aplicadas nesta execução.
+    """
+    bind = bind if bind is not None else engine
+    SchemaMigration.__table__.create(bind=bind, checkfirst=True)
+
+    with bind.connect() as conn:
+        aplicadas = set(conn.execute(select(SchemaMigration.versao)).scalars())
+
+    novas = []
+    for versao, descricao, migracao in MIGRATIONS:
+        if versao in aplicadas:
+            continue
+        print(f"Aplicando migração {versao}: {descricao}")
+        with bind.begin() as conn:
+            migracao(conn)
+            conn.execute(insert(SchemaMigration).values(versao=versao, descricao=descricao, aplicada_em=datetime.now(timezone.utc)))
+        novas.append(versao)
+    return novas
+
 def init_db():
     Base.metadata.create_all(bind=engine)
+    run_migrations(engine)
+
+# As funções com prefixo "_" contêm a lógica de acesso ao banco e recebem uma Session síncrona.
+# As versões públicas síncronas e as versões "_async" (via AsyncSession.run_sync) apenas as envolvem,
+# cuidando de rollback/fechamento da sessão.
 
+def _add_transaction(db_session, usuario_id: str, tipo: str, valor: float, categoria: str, descricao: str, data_hora: datetime):
+    if data_hora.tzinfo is None:
+        data_hora_utc = data_hora.replace(tzinfo=timezone.utc)
+    else:
+        data_hora_utc = data_hora.astimezone(timezone.utc)
+
+    transacao_db = Transacao(
+        usuario_id=str(usuario_id),
+        tipo=tipo,
+        valor=valor,
+        categoria=categoria,
+        descricao=descricao,
+        data_hora=data_hora_utc
+    )
+    db_session.add(transacao_db)
+    _atualizar_saldo(db_session, usuario_id, tipo, valor)
+    _atualizar_resumo_mensal(db_session, usuario_id, data_hora_utc.strftime("%Y-%m"), tipo, categoria, valor, 1)
+    db_session.commit()
+    db_session.refresh(transacao_db)
+    return transacao_db
+
+@medir_latencia("gastaai_db_seconds")
 def add_transaction(db_session, usuario_id: str, tipo: str, valor: float, categoria: str, descricao: str, data_hora: datetime):
     """
     Adiciona uma nova transação ao banco de dados.
     Garante que data_hora é um objeto datetime com timezone (UTC).
     """
-    if data_hora.tzinfo is None:
-        data_hora_utc = data_hora.replace(tzinfo=timezone.utc)
-    else:
-        data_hora_utc = data_hora.astimezone(timezone.utc)
+    try:
+        return _add_transaction(db_session, usuario_id, tipo, valor, categoria, descricao, data_hora)
+    except Exception as e:
+        db_session.rollback()
+        print(f"Erro ao adicionar transação ao banco: {e}")
+        raise
+    finally:
+        db_session.close()
+
+@medir_latencia("gastaai_db_seconds")
+async def add_transaction_async(db_session, usuario_id: str, tipo: str, valor: float, categoria: str, descricao: str, data_hora: datetime):
+    """
+    Versão assíncrona de add_transaction. db_session deve ser uma AsyncSession (ver AsyncSessionLocal).
+    """
+    try:
+        return await db_session.run_sync(_add_transaction, usuario_id, tipo, valor, categoria, descricao, data_hora)
+    except Exception as e:
+        await db_session.rollback()
+        print(f"Erro ao adicionar transação ao banco: {e}")
+        raise
+    finally:
+        await db_session.close()
+
+def _add_transactions_bulk(db_session, usuario_id: str, transacoes: list[dict]) -> int:
+    if not transacoes:
+        return 0
+
+    linhas = []
+    totais_por_tipo = {}
+    resumos = {}
+    for transacao in transacoes:
+        data_hora = transacao["data_hora"]
+        data_hora_utc = data_hora.replace(tzinfo=timezone.utc) if data_hora.tzinfo is None else data_hora.astimezone(timezone.utc)
+        linhas.append({
+            "usuario_id": str(usuario_id),
+            "tipo": transacao["tipo"],
+            "valor": transacao["valor"],
+            "categoria": transacao.get("categoria"),
+            "descricao": transacao.get("descricao"),
+            "data_hora": data_hora_utc,
+        })
+        totais_por_tipo[transacao["tipo"]] = totais_por_tipo.get(transacao["tipo"], 0.0) + transacao["valor"]
+        resumo = resumos.setdefault((data_hora_utc.strftime("%Y-%m"), transacao["tipo"], transacao.get("categoria") or ""), [0.0, 0])
+        resumo[0] += transacao["valor"]
+        resumo[1] += 1
+
+    # Um único INSERT executemany; saldo e resumos são atualizados uma vez por grupo, não por linha.
+    db_session.execute(insert(Transacao), linhas)
+    for tipo, total in totais_por_tipo.items():
+        _atualizar_saldo(db_session, usuario_id, tipo, total)
+    _atualizar_resumos_mensais_em_lote(db_session, usuario_id, resumos)
+    db_session.commit()
+    return len(linhas)
+
+@medir_latencia("gastaai_db_seconds")
+def add_transactions_bulk(db_session, usuario_id: str, transacoes: list[dict]) -> int:
+    """
+    Adiciona várias transações do mesmo usuário com um único INSERT e um único commit.
+    Cada item de `transacoes` tem as chaves tipo, valor, categoria, descricao e data_hora.
+    Retorna o número de transações inseridas.
+    """
+    try:
+        return _add_transactions_bulk(db_session, usuario_id, transacoes)
+    except Exception as e:
+        db_session.rollback()
+        print(f"Erro ao adicionar transações em lote ao banco: {e}")
+        raise
+    finally:
+        db_session.close()
+
+@medir_latencia("gastaai_db_seconds")
+async def add_transactions_bulk_async(db_session, usuario_id: str, transacoes: list[dict]) -> int:
+    """
+    Versão assíncrona de add_transactions_bulk. db_session deve ser uma AsyncSession.
+    """
+    try:
+        return await db_session.run_sync(_add_transactions_bulk, usuario_id, transacoes)
+    except Exception as e:
+        await db_session.rollback()
+        print(f"Erro ao adicionar transações em lote ao banco: {e}")
+        raise
+    finally:
+        await db_session.close()
+
+# --- Confirmações pendentes (confirmacoes_pendentes) ---
+
+def _save_pending_confirmation(db_session, usuario_id: str, mensagem_id: int, transacoes: list[dict], ttl_seconds: int = PENDING_CONFIRMATION_TTL_SECONDS):
+    dados = json.dumps(
+        [{**t, "data_hora": t["data_hora"].isoformat()} for t in transacoes],
+        ensure_ascii=False
+    )
+    db_session.merge(ConfirmacaoPendente(
+        usuario_id=str(usuario_id),
+        mensagem_id=mensagem_id,
+        dados=dados,
+        expira_em=datetime.now(timezone.utc) + timedelta(seconds=ttl_seconds)
+    ))
+    db_session.commit()
+
+def _pop_pending_confirmation(db_session, usuario_id: str, mensagem_id: int) -> list[dict] | None:
+    pendente = db_session.get(ConfirmacaoPendente, (str(usuario_id), mensagem_id))
+    if pendente is None:
+        return None
+    db_session.delete(pendente)
+    db_session.commit()
+
+    expira_em = pendente.expira_em if pendente.expira_em.tzinfo else pendente.expira_em.replace(tzinfo=timezone.utc)
+    if expira_em <= datetime.now(timezone.utc):
+        return None
+    return [{**t, "data_hora": datetime.fromisoformat(t["data_hora"])} for t in json.loads(pendente.dados)]
+
+def _purge_expired_confirmations(db_session) -> int:
+    result = db_session.execute(
+        delete(ConfirmacaoPendente)
+        .where(ConfirmacaoPendente.expira_em <= datetime.now(timezone.utc))
+        .execution_options(synchronize_session=False)
+    )
+    db_session.commit()
+    return result.rowcount
+
+@medir_latencia("gastaai_db_seconds")
+async def save_pending_confirmation_async(db_session, usuario_id: str, mensagem_id: int, transacoes: list[dict], ttl_seconds: int = PENDING_CONFIRMATION_TTL_SECONDS):
+    """
+    Guarda as transações aguardando confirmação, chaveadas por (usuario_id, mensagem_id), com expiração em ttl_seconds.
+    Sobrevive a reinícios do bot. db_session deve ser uma AsyncSession.
+    """
+    try:
+        await db_session.run_sync(_save_pending_confirmation, usuario_id, mensagem_id, transacoes, ttl_seconds)
+    except Exception as e:
+        await db_session.rollback()
+        print(f"Erro ao salvar confirmação pendente no banco: {e}")
+        raise
+    finally:
+        await db_session.close()
+
+@medir_latencia("gastaai_db_seconds")
+async def pop_pending_confirmation_async(db_session, usuario_id: str, mensagem_id: int) -> list[dict] | None:
+    """
+    Remove e retorna as transações pendentes da mensagem, ou None se não existirem ou já tiverem expirado.
+    """
+    try:
+        return await db_session.run_sync(_pop_pending_confirmation, usuario_id, mensagem_id)
+    except Exception as e:
+        await db_session.rollback()
+        print(f"Erro ao obter confirmação pendente do banco: {e}")
+        raise
+    finally:
+        await db_session.close()
+
+@medir_latencia("gastaai_db_seconds")
+async def purge_expired_confirmations_async(db_session) -> int:
+    """
+    Apaga as confirmações pendentes expiradas. Retorna quantas foram removidas.
+    """
+    try:
+        return await db_session.run_sync(_purge_expired_confirmations)
+    except Exception as e:
+        await db_session.rollback()
+        print(f"Erro ao limpar confirmações expiradas: {e}")
+        raise
+    finally:
+        await db_session.close()
+
+# --- Uso de tokens do LLM (uso_tokens) ---
+
+def _dia_utc(momento: datetime | None = None) -> str:
+    return (momento or datetime.now(timezone.utc)).astimezone(timezone.utc).strftime("%Y-%m-%d")
+
+def _registrar_uso_tokens(db_session, usuario_id: str, funcao: str, prompt_tokens: int, completion_tokens: int, dia: str | None = None):
+    dia = dia or _dia_utc()
+    result = db_session.execute(
+        update(UsoTokens)
+        .where(UsoTokens.usuario_id == str(usuario_id), UsoTokens.dia == dia, UsoTokens.funcao == funcao)
+        .values(
+            chamadas=UsoTokens.chamadas + 1,
+            prompt_tokens=UsoTokens.prompt_tokens + prompt_tokens,
+            completion_tokens=UsoTokens.completion_tokens + completion_tokens,
+        )
+        .execution_options(synchronize_session=False)
+    )
+    if result.rowcount == 0:
+        db_session.execute(insert(UsoTokens).values(
+            usuario_id=str(usuario_id), dia=dia, funcao=funcao,
+            chamadas=1, prompt_tokens=prompt_tokens, completion_tokens=completion_tokens,
+        ))
+    db_session.commit()
+
+def _get_tokens_do_dia(db_session, usuario_id: str, dia: str | None = None) -> int:
+    return db_session.execute(
+        select(func.coalesce(func.sum(UsoTokens.prompt_tokens + UsoTokens.completion_tokens), 0))
+        .where(UsoTokens.usuario_id == str(usuario_id), UsoTokens.dia == (dia or _dia_utc()))
+    ).scalar()
+
+def _get_maiores_consumidores(db_session, dias: int = 1, limite: int = 10) -> list[dict]:
+    dia_inicial = _dia_utc(datetime.now(timezone.utc) - timedelta(days=dias - 1))
+    total = (UsoTokens.prompt_tokens + UsoTokens.completion_tokens)
+    rows = db_session.execute(
+        select(
+            UsoTokens.usuario_id,
+            func.sum(UsoTokens.chamadas),
+            func.sum(UsoTokens.prompt_tokens),
+            func.sum(UsoTokens.completion_tokens),
+        )
+        .where(UsoTokens.dia >= dia_inicial)
+        .group_by(UsoTokens.usuario_id)
+        .order_by(func.sum(total).desc())
+        .limit(limite)
+    ).all()
+    return [
+        {"usuario_id": usuario_id, "chamadas": chamadas, "prompt_tokens": prompt_tokens, "completion_tokens": completion_tokens}
+        for usuario_id, chamadas, prompt_tokens, completion_tokens in rows
+    ]
+
+@medir_latencia("gastaai_db_seconds")
+async def registrar_uso_tokens_async(db_session, usuario_id: str, funcao: str, prompt_tokens: int, completion_tokens: int):
+    """
+    Soma os tokens de uma chamada ao LLM no registro (usuario_id, dia atual, funcao). db_session deve ser uma AsyncSession.
+    """
+    try:
+        await db_session.run_sync(_registrar_uso_tokens, usuario_id, funcao, prompt_tokens, completion_tokens)
+    except Exception as e:
+        await db_session.rollback()
+        print(f"Erro ao registrar uso de tokens no banco: {e}")
+        raise
+    finally:
+        await db_session.close()
+
+@medir_latencia("gastaai_db_seconds")
+async def get_tokens_do_dia_async(db_session, usuario_id: str) -> int:
+    """
+    Total de tokens (prompt + completion) que o usuário consumiu hoje (UTC).
+    """
+    try:
+        return await db_session.run_sync(_get_tokens_do_dia, usuario_id)
+    except Exception as e:
+        print(f"Erro ao obter uso de tokens do banco: {e}")
+        raise
+    finally:
+        await db_session.close()
+
+@medir_latencia("gastaai_db_seconds")
+async def get_maiores_consumidores_async(db_session, dias: int = 1, limite: int = 10) -> list[dict]:
+    """
+    Usuários que mais consumiram tokens nos últimos `dias` dias (incluindo hoje), do maior para o menor.
+    """
+    try:
+        return await db_session.run_sync(_get_maiores_consumidores, dias, limite)
+    except Exception as e:
+        print(f"Erro ao obter maiores consumidores de tokens do banco: {e}")
+        raise
+    finally:
+        await db_session.close()
+
+# --- Saldo materializado (saldos_usuarios) ---
+
+def _atualizar_saldo(db_session, usuario_id: str, tipo: str, valor: float):
+    """Soma o valor ao total do tipo no saldo do usuário e incrementa a versão, na mesma transação da inserção."""
+    coluna = SaldoUsuario.total_entradas if tipo == "entrada" else SaldoUsuario.total_saidas
+    result = db_session.execute(
+        update(SaldoUsuario)
+        .where(SaldoUsuario.usuario_id == str(usuario_id))
+        .values({coluna: coluna + valor, SaldoUsuario.versao: SaldoUsuario.versao + 1, SaldoUsuario.atualizado_em: datetime.now(timezone.utc)})
+        .execution_options(synchronize_session=False)
+    )
+    if result.rowcount == 0:
+        db_session.execute(insert(SaldoUsuario).values(
+            usuario_id=str(usuario_id),
+            total_entradas=valor if tipo == "entrada" else 0.0,
+            total_saidas=valor if tipo == "saída" else 0.0,
+            versao=1,
+            atualizado_em=datetime.now(timezone.utc)
+        ))
+
+def _calcular_totais(executor, usuario_id: str | None = None) -> dict:
+    """Recalcula {usuario_id: [entradas, saidas]} a partir de transacoes."""
+    stmt = select(Transacao.usuario_id, Transacao.tipo, func.sum(Transacao.valor)).group_by(Transacao.usuario_id, Transacao.tipo)
+    if usuario_id is not None:
+        stmt = stmt.where(Transacao.usuario_id == str(usuario_id))
+    totais = {}
+    for uid, tipo, soma in executor.execute(stmt):
+        par = totais.setdefault(uid, [0.0, 0.0])
+        if tipo == "entrada":
+            par[0] += soma or 0.0
+        elif tipo == "saída":
+            par[1] += soma or 0.0
+    return totais
+
+def _rebuild_saldos(executor, usuario_id: str | None = None) -> int:
+    """
+    Reconstrói saldos_usuarios a partir de transacoes (para um usuário ou para todos).
+    `executor` pode ser uma Session ou uma Connection; quem chama faz o commit.
+    """
+    totais = _calcular_totais(executor, usuario_id)
+    stmt_versoes = select(SaldoUsuario.usuario_id, SaldoUsuario.versao)
+    stmt_delete = delete(SaldoUsuario)
+    if usuario_id is not None:
+        stmt_versoes = stmt_versoes.where(SaldoUsuario.usuario_id == str(usuario_id))
+        stmt_delete = stmt_delete.where(SaldoUsuario.usuario_id == str(usuario_id))
+    # A versão continua subindo: um saldo reconstruído nunca reaproveita uma versão já usada em cache.
+    versoes = dict(executor.execute(stmt_versoes).all())
+    executor.execute(stmt_delete)
+    agora = datetime.now(timezone.utc)
+    linhas = [
+        {"usuario_id": uid, "total_entradas": entradas, "total_saidas": saidas, "versao": (versoes.get(uid) or 0) + 1, "atualizado_em": agora}
+        for uid, (entradas, saidas) in totais.items()
+    ]
+    if linhas:
+        executor.execute(insert(SaldoUsuario), linhas)
+    return len(linhas)
+
+def _verify_saldos(executor, usuario_id: str | None = None, tolerancia: float = 0.005) -> list[dict]:
+    totais = _calcular_totais(executor, usuario_id)
+    stmt = select(SaldoUsuario.usuario_id, SaldoUsuario.total_entradas, SaldoUsuario.total_saidas)
+    if usuario_id is not None:
+        stmt = stmt.where(SaldoUsuario.usuario_id == str(usuario_id))
+    registrados = {uid: (entradas, saidas) for uid, entradas, saidas in executor.execute(stmt)}
+
+    divergencias = []
+    for uid in set(totais) | set(registrados):
+        esperado = totais.get(uid, [0.0, 0.0])
+        atual = registrados.get(uid, (0.0, 0.0))
+        if abs(esperado[0] - atual[0]) > tolerancia or abs(esperado[1] - atual[1]) > tolerancia:
+            divergencias.append({
+                "usuario_id": uid,
+                "entradas_esperadas": esperado[0], "entradas_registradas": atual[0],
+                "saidas_esperadas": esperado[1], "saidas_registradas": atual[1],
+            })
+    return divergencias
+
+def rebuild_saldos(db_session, usuario_id: str | None = None) -> int:
+    """
+    Recalcula os saldos materializados a partir de transacoes e faz o commit.
+    Retorna o número de usuários reconstruídos.
+    """
+    try:
+        reconstruidos = _rebuild_saldos(db_session, usuario_id)
+        db_session.commit()
+        return reconstruidos
+    except Exception as e:
+        db_session.rollback()
+        print(f"Erro ao reconstruir saldos: {e}")
+        raise
+    finally:
+        db_session.close()
 
+def verify_saldos(db_session, usuario_id: str | None = None) -> list[dict]:
+    """
+    Compara saldos_usuarios com a soma das transações. Retorna a lista de divergências (vazia se tudo bate).
+    """
     try:
-        transacao_db = Transacao(
+        return _verify_saldos(db_session, usuario_id)
+    finally:
+        db_session.close()
+
+# --- Resumo mensal por categoria (resumos_mensais) ---
+
+def _atualizar_resumo_mensal(db_session, usuario_id: str, ano_mes: str, tipo: str, categoria: str | None, soma: float, contagem: int):
+    chave = (
+        ResumoMensal.usuario_id == str(usuario_id),
+        ResumoMensal.ano_mes == ano_mes,
+        ResumoMensal.tipo == tipo,
+        ResumoMensal.categoria == (categoria or ""),
+    )
+    result = db_session.execute(
+        update(ResumoMensal)
+        .where(*chave)
+        .values(soma=ResumoMensal.soma + soma, contagem=ResumoMensal.contagem + contagem)
+        .execution_options(synchronize_session=False)
+    )
+    if result.rowcount == 0:
+        db_session.execute(insert(ResumoMensal).values(
             usuario_id=str(usuario_id),
+            ano_mes=ano_mes,
             tipo=tipo,
-            valor=valor,
-            categoria=categoria,
-            descricao=descricao,
-            data_hora=data_hora_utc
+            categoria=categoria or "",
+            soma=soma,
+            contagem=contagem
+        ))
+
+def _atualizar_resumos_mensais_em_lote(db_session, usuario_id: str, resumos: dict):
+    """
+    Mesmo efeito de chamar _atualizar_resumo_mensal para cada item de `resumos`
+    ({(ano_mes, tipo, categoria): (soma, contagem)}), mas com um SELECT das chaves existentes
+    e um UPDATE e um INSERT executemany, em vez de dois comandos por grupo.
+    """
+    tabela = ResumoMensal.__table__
+    existentes = set(db_session.execute(
+        select(ResumoMensal.ano_mes, ResumoMensal.tipo, ResumoMensal.categoria).where(
+            ResumoMensal.usuario_id == str(usuario_id),
+            ResumoMensal.ano_mes.in_({ano_mes for ano_mes, _, _ in resumos}),
         )
-        db_session.add(transacao_db)
+    ).tuples())
+
+    atualizacoes, insercoes = [], []
+    for (ano_mes, tipo, categoria), (soma, contagem) in resumos.items():
+        if (ano_mes, tipo, categoria or "") in existentes:
+            atualizacoes.append({"b_ano_mes": ano_mes, "b_tipo": tipo, "b_categoria": categoria or "", "b_soma": soma, "b_contagem": contagem})
+        else:
+            insercoes.append({"usuario_id": str(usuario_id), "ano_mes": ano_mes, "tipo": tipo, "categoria": categoria or "", "soma": soma, "contagem": contagem})
+
+    if atualizacoes:
+        db_session.execute(
+            update(tabela)
+            .where(
+                tabela.c.usuario_id == str(usuario_id),
+                tabela.c.ano_mes == bindparam("b_ano_mes"),
+                tabela.c.tipo == bindparam("b_tipo"),
+                tabela.c.categoria == bindparam("b_categoria"),
+            )
+            .values(soma=tabela.c.soma + bindparam("b_soma"), contagem=tabela.c.contagem + bindparam("b_contagem")),
+            atualizacoes,
+        )
+    if insercoes:
+        db_session.execute(insert(tabela), insercoes)
+
+def _rebuild_resumos_mensais(executor, usuario_id: str | None = None) -> int:
+    """
+    Reconstrói resumos_mensais a partir de transacoes, lendo as linhas em lotes (yield_per).
+    `executor` pode ser uma Session ou uma Connection; quem chama faz o commit.
+    """
+    stmt = select(Transacao.usuario_id, Transacao.tipo, Transacao.categoria, Transacao.data_hora, Transacao.valor)
+    stmt_delete = delete(ResumoMensal)
+    if usuario_id is not None:
+        stmt = stmt.where(Transacao.usuario_id == str(usuario_id))
+        stmt_delete = stmt_delete.where(ResumoMensal.usuario_id == str(usuario_id))
+
+    grupos = {}
+    for uid, tipo, categoria, data_hora, valor in executor.execute(stmt.execution_options(yield_per=5000)):
+        chave = (uid, data_hora.strftime("%Y-%m"), tipo, categoria or "")
+        grupo = grupos.setdefault(chave, [0.0, 0])
+        grupo[0] += valor
+        grupo[1] += 1
+
+    executor.execute(stmt_delete)
+    linhas = [
+        {"usuario_id": uid, "ano_mes": ano_mes, "tipo": tipo, "categoria": categoria, "soma": soma, "contagem": contagem}
+        for (uid, ano_mes, tipo, categoria), (soma, contagem) in grupos.items()
+    ]
+    if linhas:
+        executor.execute(insert(ResumoMensal), linhas)
+    return len(linhas)
+
+def rebuild_resumos_mensais(db_session, usuario_id: str | None = None) -> int:
+    """
+    Recalcula os resumos mensais a partir de transacoes e faz o commit.
+    Retorna o número de grupos (usuário, mês, tipo, categoria) gravados.
+    """
+    try:
+        grupos = _rebuild_resumos_mensais(db_session, usuario_id)
         db_session.commit()
-        db_session.refresh(transacao_db)
-        return transacao_db
+        return grupos
     except Exception as e:
         db_session.rollback()
-        print(f"Erro ao adicionar transação ao banco: {e}")
+        print(f"Erro ao reconstruir resumos mensais: {e}")
         raise
     finally:
         db_session.close()
 
+def _inicio_do_mes(dt: datetime) -> datetime:
+    return dt.replace(day=1, hour=0, minute=0, second=0, microsecond=0)
+
+def _inicio_do_proximo_mes(dt: datetime) -> datetime:
+    return (_inicio_do_mes(dt) + timedelta(days=32)).replace(day=1)
+
+def _agregar_com_resumo_mensal(db_session, query_base, usuario_id: str, params: dict, data_inicio_dt: datetime | None, data_fim_dt: datetime | None):
+    """
+    Calcula (soma, contagem) usando resumos_mensais para os meses inteiros do período
+    e as transações brutas (query_base, já filtrada por usuário/tipo/categorias) só para as bordas parciais.
+    Um fim de período no último segundo do mês (ex: 23:59:59 do dia 31) conta como mês inteiro.
+    Retorna None se o período não cobrir nenhum mês inteiro, para que a consulta bruta seja usada.
+    """
+    if data_inicio_dt is not None and data_fim_dt is not None and data_inicio_dt > data_fim_dt:
+        return None
+
+    if data_inicio_dt is None or data_inicio_dt == _inicio_do_mes(data_inicio_dt):
+        primeiro_mes = data_inicio_dt
+    else:
+        primeiro_mes = _inicio_do_proximo_mes(data_inicio_dt)
+
+    if data_fim_dt is None:
+        fim_meses = None
+    elif data_fim_dt >= _inicio_do_proximo_mes(data_fim_dt) - timedelta(seconds=1):
+        fim_meses = _inicio_do_proximo_mes(data_fim_dt)
+    else:
+        fim_meses = _inicio_do_mes(data_fim_dt)
+
+    if primeiro_mes is not None and fim_meses is not None and primeiro_mes >= fim_meses:
+        return None
+
+    stmt = select(func.sum(ResumoMensal.soma), func.sum(ResumoMensal.contagem)).where(ResumoMensal.usuario_id == str(usuario_id))
+    if params.get("tipo_transacao"):
+        stmt = stmt.where(ResumoMensal.tipo == params["tipo_transacao"])
+    categorias_list = params.get("categorias")
+    if isinstance(categorias_list, list) and categorias_list:
+        stmt = stmt.where(ResumoMensal.categoria.in_(categorias_list))
+    if primeiro_mes is not None:
+        stmt = stmt.where(ResumoMensal.ano_mes >= primeiro_mes.strftime("%Y-%m"))
+    if fim_meses is not None:
+        stmt = stmt.where(ResumoMensal.ano_mes < fim_meses.strftime("%Y-%m"))
+    soma, contagem = db_session.execute(stmt).one()
+    soma, contagem = soma or 0.0, contagem or 0
+
+    bordas = []
+    if data_inicio_dt is not None and primeiro_mes != data_inicio_dt:
+        bordas.append(query_base.filter(Transacao.data_hora >= data_inicio_dt, Transacao.data_hora < primeiro_mes))
+    if data_fim_dt is not None and fim_meses == _inicio_do_mes(data_fim_dt):
+        bordas.append(query_base.filter(Transacao.data_hora >= fim_meses, Transacao.data_hora <= data_fim_dt))
+    for borda in bordas:
+        soma_borda, contagem_borda = borda.with_entities(func.sum(Transacao.valor), func.count(Transacao.id)).one()
+        soma += soma_borda or 0.0
+        contagem += contagem_borda or 0
+
+    return soma, contagem
+
 # Funções para os comandos extras (opcional)
+def _get_saldo(db_session, usuario_id: str):
+    saldo = db_session.get(SaldoUsuario, str(usuario_id))
+    if saldo is None:
+        return 0.0
+    return saldo.total_entradas - saldo.total_saidas
+
+@medir_latencia("gastaai_db_seconds")
 def get_saldo(db_session, usuario_id: str):
     try:
-        entradas = db_session.query(func.sum(Transacao.valor)).filter(Transacao.usuario_id == str(usuario_id), Transacao.tipo == "entrada").scalar() or 0.0
-        saidas = db_session.query(func.sum(Transacao.valor)).filter(Transacao.usuario_id == str(usuario_id), Transacao.tipo == "saída").scalar() or 0.0
-        return entradas - saidas
+        return _get_saldo(db_session, usuario_id)
     except Exception as e:
         print(f"Erro ao obter saldo do banco: {e}")
         raise
     finally:
         db_session.close()
 
+@medir_latencia("gastaai_db_seconds")
+async def get_saldo_async(db_session, usuario_id: str):
+    try:
+        return await db_session.run_sync(_get_saldo, usuario_id)
+    except Exception as e:
+        print(f"Erro ao obter saldo do banco: {e}")
+        raise
+    finally:
+        await db_session.close()
+
+
+def _get_versao_dados(db_session, usuario_id: str) -> int:
+    """Versão dos dados do usuário: muda a cada transação gravada. 0 se ele ainda não tem transações."""
+    versao = db_session.execute(
+        select(SaldoUsuario.versao).where(SaldoUsuario.usuario_id == str(usuario_id))
+    ).scalar()
+    return versao or 0
+
+@medir_latencia("gastaai_db_seconds")
+def get_versao_dados(db_session, usuario_id: str) -> int:
+    try:
+        return _get_versao_dados(db_session, usuario_id)
+    except Exception as e:
+        print(f"Erro ao obter versão dos dados do banco: {e}")
+        raise
+    finally:
+        db_session.close()
+
+@medir_latencia("gastaai_db_seconds")
+async def get_versao_dados_async(db_session, usuario_id: str) -> int:
+    try:
+        return await db_session.run_sync(_get_versao_dados, usuario_id)
+    except Exception as e:
+        print(f"Erro ao obter versão dos dados do banco: {e}")
+        raise
+    finally:
+        await db_session.close()
+
+
+def _get_transacoes_por_tipo(db_session, usuario_id: str, tipo_transacao: str, limit: int = 10,
+                             cursor: tuple[datetime, int] | None = None, mais_recentes: bool = False):
+    """
+    Página de até `limit` transações do tipo, da mais recente para a mais antiga.
+    Paginação por chave (keyset) em (data_hora, id): `cursor` é o (data_hora, id) de uma transação já exibida
+    e a página traz as imediatamente mais antigas que ela (ou, com `mais_recentes`, as imediatamente mais novas).
+    Cada página é uma busca no índice a partir do cursor, sem OFFSET, então a página 500 custa o mesmo que a primeira.
+    """
+    query = db_session.query(Transacao).filter(
+        Transacao.usuario_id == str(usuario_id),
+        Transacao.tipo == tipo_transacao
+    )
+    if cursor is not None:
+        data_hora, transacao_id = cursor
+        if mais_recentes:
+            query = query.filter(Transacao.data_hora >= data_hora, or_(Transacao.data_hora > data_hora, Transacao.id > transacao_id))
+        else:
+            query = query.filter(Transacao.data_hora <= data_hora, or_(Transacao.data_hora < data_hora, Transacao.id < transacao_id))
+
+    if mais_recentes:
+        # Busca subindo a partir do cursor e devolve na ordem de exibição (mais recente primeiro).
+        transacoes = query.order_by(Transacao.data_hora.asc(), Transacao.id.asc()).limit(limit).all()
+        return transacoes[::-1]
+    return query.order_by(Transacao.data_hora.desc(), Transacao.id.desc()).limit(limit).all()
+
+@medir_latencia("gastaai_db_seconds")
+def get_transacoes_por_tipo(db_session, usuario_id: str, tipo_transacao: str, limit: int = 10,
+                            cursor: tuple[datetime, int] | None = None, mais_recentes: bool = False):
+    try:
+        return _get_transacoes_por_tipo(db_session, usuario_id, tipo_transacao, limit, cursor, mais_recentes)
+    except Exception as e:
+        print(f"Erro ao obter transações por tipo do banco: {e}")
+        raise
+    finally:
+        db_session.close()
 
-def get_transacoes_por_tipo(db_session, usuario_id: str, tipo_transacao: str, limit: int = 10):
+@medir_latencia("gastaai_db_seconds")
+async def get_transacoes_por_tipo_async(db_session, usuario_id: str, tipo_transacao: str, limit: int = 10,
+                                        cursor: tuple[datetime, int] | None = None, mais_recentes: bool = False):
     try:
-        transacoes = db_session.query(Transacao).filter(
-            Transacao.usuario_id == str(usuario_id),
-            Transacao.tipo == tipo_transacao
-        ).order_by(Transacao.data_hora.desc()).limit(limit).all()
-        return transacoes
+        return await db_session.run_sync(_get_transacoes_por_tipo, usuario_id, tipo_transacao, limit, cursor, mais_recentes)
     except Exception as e:
         print(f"Erro ao obter transações por tipo do banco: {e}")
         raise
+    finally:
+        await db_session.close()
+
+# --- Exportação (/exportar) ---
+
+COLUNAS_EXPORTACAO = ("data_hora", "tipo", "valor", "categoria", "descricao")
+
+def _export_transactions(db_session, usuario_id: str, arquivo, formato: str = "csv") -> int:
+    """
+    Escreve as transações do usuário em `arquivo` (binário), em CSV ou JSON Lines.
+    As linhas são lidas em lotes de EXPORT_YIELD_PER com cursor no servidor (stream_results),
+    como tuplas de colunas em vez de objetos ORM, então a memória não cresce com o histórico.
+    """
+    stmt = (
+        select(Transacao.data_hora, Transacao.tipo, Transacao.valor, Transacao.categoria, Transacao.descricao)
+        .where(Transacao.usuario_id == str(usuario_id))
+        .order_by(Transacao.data_hora, Transacao.id)
+        .execution_options(stream_results=True, yield_per=EXPORT_YIELD_PER)
+    )
+
+    buffer = io.StringIO()
+    escritor = csv.writer(buffer, delimiter=";", lineterminator="\n") if formato == "csv" else None
+    if escritor:
+        # Mesmo layout aceito pelo /importar: separador ";" e vírgula decimal.
+        escritor.writerow(("data", "tipo", "valor", "categoria", "descricao"))
+
+    total = 0
+    for particao in db_session.execute(stmt).partitions():
+        for data_hora, tipo, valor, categoria, descricao in particao:
+            data_hora_iso = data_hora.replace(tzinfo=timezone.utc).isoformat() if data_hora.tzinfo is None else data_hora.isoformat()
+            if escritor:
+                escritor.writerow((data_hora_iso, tipo, f"{valor:.2f}".replace(".", ","), categoria or "", descricao or ""))
+            else:
+                linha = dict(zip(COLUNAS_EXPORTACAO, (data_hora_iso, tipo, valor, categoria, descricao)))
+                buffer.write(json.dumps(linha, ensure_ascii=False) + "\n")
+        total += len(particao)
+        arquivo.write(buffer.getvalue().encode("utf-8"))
+        buffer.seek(0)
+        buffer.truncate()
+
+    arquivo.write(buffer.getvalue().encode("utf-8"))
+    return total
+
+@medir_latencia("gastaai_db_seconds")
+def export_transactions(db_session, usuario_id: str, arquivo, formato: str = "csv") -> int:
+    """
+    Exporta todas as transações do usuário para `arquivo` (aberto em modo binário).
+    formato: "csv" ou "jsonl". Retorna o número de transações exportadas.
+    """
+    try:
+        return _export_transactions(db_session, usuario_id, arquivo, formato)
+    except Exception as e:
+        print(f"Erro ao exportar transações do banco: {e}")
+        raise
     finally:
         db_session.close()
 
-def query_dynamic_transactions(db_session, usuario_id: str, params: dict):
+@medir_latencia("gastaai_db_seconds")
+async def export_transactions_async(db_session, usuario_id: str, arquivo, formato: str = "csv") -> int:
+    """
+    Versão assíncrona de export_transactions. db_session deve ser uma AsyncSession.
+    """
+    try:
+        return await db_session.run_sync(_export_transactions, usuario_id, arquivo, formato)
+    except Exception as e:
+        print(f"Erro ao exportar transações do banco: {e}")
+        raise
+    finally:
+        await db_session.close()
+
+# --- Busca por palavras na descrição ---
+
+_fts_disponivel_cache = {}
+
+def _fts_disponivel(db_session) -> bool:
+    """True se o banco é SQLite e a tabela transacoes_fts existe (resultado guardado por engine)."""
+    bind = db_session.get_bind()
+    if bind.dialect.name != "sqlite":
+        return False
+    chave = str(bind.url)
+    if chave not in _fts_disponivel_cache:
+        _fts_disponivel_cache[chave] = db_session.execute(
+            text("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'transacoes_fts'")
+        ).first() is not None
+    return _fts_disponivel_cache[chave]
+
+def _termo_fts(palavra: str) -> str | None:
+    """
+    "mercado livre" -> 'descricao : "mercado livre"*': frase com prefixo no último termo, restrita à coluna
+    descricao (o índice também tem categoria, que não deve casar com descricao_contem).
+    Retorna None se a palavra não tiver letras nem dígitos.
+    """
+    tokens = re.findall(r"\w+", str(palavra))
+    if not tokens:
+        return None
+    return 'descricao : "' + " ".join(tokens) + '"*'
+
+def _filtrar_por_descricao(db_session, query, palavras: list[str]):
+    """
+    Mantém as transações cuja descrição contém todas as palavras.
+    No SQLite com FTS5 a busca é por início de palavra ("ube" encontra "Uber", "ber" não), diferente do
+    ILIKE '%palavra%' usado nos outros bancos, que casa em qualquer posição. É uma troca deliberada: buscar
+    trechos no meio das palavras exigiria ler todas as descrições. Palavras sem letras nem dígitos (ex: "R$")
+    continuam no ILIKE.
+    """
+    usar_fts = _fts_disponivel(db_session)
+    termos_fts = []
+    for palavra in palavras:
+        termo = _termo_fts(palavra) if usar_fts else None
+        if termo:
+            termos_fts.append(termo)
+        else:
+            query = query.filter(Transacao.descricao.ilike(f"%{palavra}%"))
+    if termos_fts:
+        ids_fts = text("SELECT rowid FROM transacoes_fts WHERE transacoes_fts MATCH :consulta").bindparams(consulta=" AND ".join(termos_fts))
+        query = query.filter(Transacao.id.in_(ids_fts.columns(column("rowid"))))
+    return query
+
+# Operações respondidas com GROUP BY: soma e contagem por categoria, por mês ou por dia.
+OPERACOES_AGRUPADAS = ("agrupar_por_categoria", "serie_mensal", "serie_diaria")
+
+def _expressao_periodo(db_session, granularidade: str):
+    """data_hora (UTC) como texto "YYYY-MM" (granularidade "mes") ou "YYYY-MM-DD" ("dia"), na sintaxe do banco em uso."""
+    formato = "%Y-%m" if granularidade == "mes" else "%Y-%m-%d"
+    dialeto = db_session.get_bind().dialect.name
+    if dialeto == "sqlite":
+        return func.strftime(formato, Transacao.data_hora)
+    if dialeto == "postgresql":
+        return func.to_char(Transacao.data_hora, "YYYY-MM" if granularidade == "mes" else "YYYY-MM-DD")
+    if dialeto in ("mysql", "mariadb"):
+        return func.date_format(Transacao.data_hora, formato)
+    raise ValueError(f"Séries por período não suportadas no banco '{dialeto}'.")
+
+def _agrupar_transacoes(db_session, query, operacao: str, params: dict, limite: int | None = None) -> list[dict]:
+    """
+    Soma e contagem por categoria (maior total primeiro) ou por mês/dia (em ordem cronológica), numa única consulta GROUP BY.
+    Sem tipo_transacao nos filtros, entradas e saídas ficam em grupos separados.
+    Retorna [{"chave": categoria ou período, "tipo": ..., "total": ..., "contagem": ...}].
+    """
+    if operacao == "agrupar_por_categoria":
+        chave = Transacao.categoria
+    else:
+        chave = _expressao_periodo(db_session, "mes" if operacao == "serie_mensal" else "dia")
+    agrupar_tipo = not params.get("tipo_transacao")
+    chaves = [chave, Transacao.tipo] if agrupar_tipo else [chave]
+    total = func.sum(Transacao.valor)
+
+    query = query.with_entities(*chaves, total, func.count(Transacao.id)).group_by(*chaves)
+    if operacao == "agrupar_por_categoria":
+        query = query.order_by(desc(total))
+        if limite:
+            query = query.limit(limite)
+    else:
+        query = query.order_by(*chaves)
+
+    grupos = []
+    for linha in query.all():
+        grupos.append({
+            "chave": linha[0],
+            "tipo": linha[1] if agrupar_tipo else params["tipo_transacao"],
+            "total": linha[-2] or 0.0,
+            "contagem": linha[-1] or 0,
+        })
+    return grupos
+
+@medir_latencia("gastaai_db_seconds")
+def query_dynamic_transactions(db_session, usuario_id: str, params: dict, preview_limit: int | None = None):
     """
     Executa uma consulta dinâmica baseada nos parâmetros extraídos pelo LLM.
     params: dicionário contendo 'operacao', 'tipo_transacao', 'categorias', etc.
     data_inicio e data_fim são esperados como strings ISO 8601 ou null.
+    Com `preview_limit`, listar_transacoes retorna {"contagem": n, "transacoes": [...]} com só as
+    primeiras `preview_limit` linhas, como tuplas de colunas (tipo, valor, categoria, descricao, data_hora).
+    As operações de OPERACOES_AGRUPADAS retornam {"grupos": [...]} (veja _agrupar_transacoes).
     """
+    try:
+        return _query_dynamic_transactions(db_session, usuario_id, params, preview_limit)
+    finally:
+        db_session.close()
+
+@medir_latencia("gastaai_db_seconds")
+async def query_dynamic_transactions_async(db_session, usuario_id: str, params: dict, preview_limit: int | None = None):
+    """
+    Versão assíncrona de query_dynamic_transactions. db_session deve ser uma AsyncSession.
+    """
+    try:
+        return await db_session.run_sync(_query_dynamic_transactions, usuario_id, params, preview_limit)
+    finally:
+        await db_session.close()
+
+def _query_dynamic_transactions(db_session, usuario_id: str, params: dict, preview_limit: int | None = None):
     query = db_session.query(Transacao).filter(Transacao.usuario_id == str(usuario_id))
 
     if params.get("tipo_transacao"):
@@ -105,8 +1057,7 @@ def query_dynamic_transactions(db_session, usuario_id: str, params: dict):
     if params.get("descricao_contem"):
         desc_list = params["descricao_contem"]
         if isinstance(desc_list, list) and desc_list:
-            for palavra in desc_list:
-                query = query.filter(Transacao.descricao.ilike(f"%{palavra}%"))
+            query = _filtrar_por_descricao(db_session, query, desc_list)
 
     # --- Processamento de período - AGORA PARSANDO STRINGS ISO 8601 DO LLM ---
     data_inicio_dt = None
@@ -141,27 +1092,42 @@ def query_dynamic_transactions(db_session, usuario_id: str, params: dict):
              print(f"AVISO: Erro inesperado ao parsear data_fim '{params['data_fim']}': {e}. Ignorando filtro de data de fim.")
              data_fim_dt = None
 
+    operacao = params.get("operacao", "listar_transacoes")
+
+    # Agregações sem filtro de descrição são respondidas pelos resumos mensais (bordas parciais vêm das transações).
+    if operacao in ("soma_valor", "contar_transacoes", "media_valor") and not params.get("descricao_contem"):
+        agregado = _agregar_com_resumo_mensal(db_session, query, usuario_id, params, data_inicio_dt, data_fim_dt)
+        if agregado is not None:
+            soma, contagem = agregado
+            if operacao == "soma_valor":
+                return {"total": soma}
+            elif operacao == "contar_transacoes":
+                return {"contagem": contagem}
+            return {"media": soma / contagem if contagem else 0.0}
+
     if data_inicio_dt:
         query = query.filter(Transacao.data_hora >= data_inicio_dt)
     if data_fim_dt:
         query = query.filter(Transacao.data_hora <= data_fim_dt)
 
-    operacao = params.get("operacao", "listar_transacoes")
+    if operacao in OPERACOES_AGRUPADAS:
+        try:
+            limite = int(params.get("limite_resultados") or 0)
+        except (TypeError, ValueError):
+            limite = 0
+        return {"grupos": _agrupar_transacoes(db_session, query, operacao, params, limite if limite > 0 else None)}
 
     if operacao == "soma_valor":
         query_sum = query.with_entities(func.sum(Transacao.valor).label("total"))
         result = query_sum.scalar() or 0.0
-        db_session.close()
         return {"total": result}
     elif operacao == "contar_transacoes":
         query_count = query.with_entities(func.count(Transacao.id).label("contagem"))
         result = query_count.scalar() or 0
-        db_session.close()
         return {"contagem": result}
     elif operacao == "media_valor":
         query_avg = query.with_entities(func.avg(Transacao.valor).label("media"))
         result = query_avg.scalar() or 0.0
-        db_session.close()
         return {"media": result}
     else: 
         order_by_field = params.get("ordenar_por", "data_hora")
@@ -178,22 +1144,33 @@ def query_dynamic_transactions(db_session, usuario_id: str, params: dict):
             query = query.order_by(desc(Transacao.data_hora))
 
 
+        limite = None
         if params.get("limite_resultados"):
             try:
                 limite = int(params["limite_resultados"])
-                if limite > 0:
-                     query = query.limit(limite)
-                else:
+                if limite <= 0:
                     print(f"AVISO: Limite de resultados inválido '{params['limite_resultados']}'. Ignorando limite.")
+                    limite = None
             except ValueError:
                 print(f"AVISO: Limite de resultados não numérico '{params['limite_resultados']}'. Ignorando limite.")
                 pass
             except Exception as e:
                 print(f"AVISO: Erro inesperado ao processar limite de resultados '{params.get('limite_resultados')}': {e}. Ignorando limite.")
+                limite = None
 
+        if preview_limit is not None:
+            # Contagem no banco e só as primeiras linhas, como tuplas: nada de hidratar o histórico inteiro em objetos ORM.
+            # Com limite_resultados, a contagem para no limite (COUNT sobre a subconsulta com LIMIT).
+            ids = query.order_by(None).with_entities(Transacao.id).limit(limite).subquery()
+            contagem = db_session.query(func.count()).select_from(ids).scalar() or 0
+            transacoes = query.with_entities(
+                Transacao.tipo, Transacao.valor, Transacao.categoria, Transacao.descricao, Transacao.data_hora
+            ).limit(min(preview_limit, limite or preview_limit)).all()
+            return {"contagem": contagem, "transacoes": transacoes}
 
+        if limite:
+            query = query.limit(limite)
         transacoes = query.all()
-        db_session.close() 
         return {"transacoes": transacoes}
 
 
@@ -259,6 +1236,15 @@ if __name__ == "__main__":
         results_contar_dia15 = query_dynamic_transactions(SessionLocal(), "test_user_stats", params_exemplo_contar_dia15)
         print(f"Resultado: {results_contar_dia15}")
 
+        # Busca por descrição: "alimentação" só aparece como categoria, então não deve casar com descricao_contem.
+        params_exemplo_descricao = {"operacao": "contar_transacoes", "descricao_contem": ["alimentação"]}
+        results_descricao = query_dynamic_transactions(SessionLocal(), "test_user_stats", params_exemplo_descricao)
+        assert results_descricao == {"contagem": 0}, results_descricao
+        params_exemplo_descricao["descricao_contem"] = ["restaurante"]
+        results_descricao = query_dynamic_transactions(SessionLocal(), "test_user_stats", params_exemplo_descricao)
+        assert results_descricao["contagem"] >= 1, results_descricao
+        print(f"\nBusca por descrição ignora a categoria: OK")
+
 
     except Exception as e:
         print(f"Erro durante os testes locais: {e}")
@@ -0,0 +1,281 @@
+import os
+import re
+import time
+import logging
+import unicodedata
+from datetime import datetime, timezone, timedelta
+
+from dotenv import load_dotenv
+
+from utils import parse_periodo_descricao
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+FAST_PATH_ENABLED = os.getenv("FAST_PATH_ENABLED", "true").lower() in ("1", "true", "yes", "sim")
+FAST_PATH_MIN_CONFIDENCE = float(os.getenv("FAST_PATH_MIN_CONFIDENCE", "0.8"))
+
+# Léxicos (sem acento, em minúsculas) usados para identificar o tipo da transação.
+VERBOS_SAIDA = {
+    "gastei", "gasto", "gastos", "paguei", "pago", "pagar", "comprei", "compra", "despesa", "torrei",
+    "desembolsei", "debito", "debitou", "saiu", "perdi",
+}
+VERBOS_ENTRADA = {
+    "recebi", "receber", "recebido", "ganhei", "ganho", "entrou", "caiu", "receita", "vendi", "rendeu",
+    "recebimento", "faturei",
+}
+
+# Palavra-chave (sem acento) -> categoria. Expressões com mais de uma palavra são procuradas no texto inteiro.
+CATEGORIAS_POR_PALAVRA = {
+    "alimentação": [
+        "mercado", "supermercado", "padaria", "lanche", "almoco", "jantar", "cafe", "restaurante", "ifood",
+        "pizza", "mc donalds", "mcdonalds", "burger", "hamburguer", "acougue", "feira", "sorvete", "marmita",
+        "comida", "hortifruti", "delivery",
+    ],
+    "transporte": [
+        "uber", "99", "taxi", "gasolina", "combustivel", "onibus", "metro", "estacionamento", "pedagio",
+        "passagem", "etanol", "posto", "bilhete unico",
+    ],
+    "lazer": ["cinema", "show", "bar", "cerveja", "balada", "jogo", "ingresso", "viagem", "netflix", "spotify", "poker"],
+    "moradia": ["aluguel", "condominio", "iptu", "reforma"],
+    "contas": ["luz", "energia", "agua", "internet", "telefone", "celular", "gas", "boleto", "fatura"],
+    "saúde": ["farmacia", "remedio", "medico", "consulta", "dentista", "exame", "plano de saude", "academia", "hospital"],
+    "educação": ["curso", "faculdade", "escola", "livro", "mensalidade", "apostila"],
+    "salário": ["salario", "pagamento do trabalho", "holerite", "adiantamento"],
+    "investimentos": ["dividendos", "rendimento", "rendimentos", "cdb", "tesouro", "acoes", "investimento"],
+    "presente": ["presente", "aniversario"],
+    "compras": ["roupa", "roupas", "sapato", "tenis", "shopping", "amazon", "loja", "mercado livre", "shopee"],
+}
+
+# Categorias que, sem verbo explícito, indicam entrada.
+CATEGORIAS_DE_ENTRADA = {"salário", "investimentos"}
+
+PALAVRAS_MOEDA = {"r$", "reais", "real", "conto", "contos", "pila", "pilas", "brl"}
+PALAVRAS_DATA_SUPORTADAS = {"hoje", "ontem", "anteontem"}
+PALAVRAS_VAZIAS = {
+    "no", "na", "nos", "nas", "em", "de", "do", "da", "dos", "das", "com", "pro", "pra", "para", "um", "uma",
+    "o", "a", "os", "as", "e", "por", "meu", "minha", "eu", "hj",
+}
+
+# Referências temporais que o parser local não resolve: a mensagem vai para o LLM.
+_DATA_NAO_SUPORTADA_RE = re.compile(
+    r"\d{1,2}/\d{1,2}|\bdia\s+\d|\b\d{1,2}\s*h\b|\b\d{1,2}:\d{2}\b|\bas\s+\d|amanha|semana|mes passado|ano passado"
+    r"|segunda|terca|quarta|quinta|sexta|sabado|domingo|manha|tarde|noite|janeiro|fevereiro|marco|abril|maio"
+    r"|junho|julho|agosto|setembro|outubro|novembro|dezembro"
+)
+
+_VALOR_RE = re.compile(
+    r"(?<![\w.,])(?:r\$\s*)?(\d{1,3}(?:\.\d{3})+(?:,\d{1,2})?|\d+(?:[.,]\d{1,2})?)(?:\s*(?:k|mil))?(?![\w.,]*\d)",
+)
+
+_stats = {"hits": 0, "misses": 0, "tempo_total_ms": 0.0}
+
+
+def _normalizar(texto: str) -> str:
+    """Minúsculas e sem acentos, para comparar com os léxicos."""
+    sem_acento = unicodedata.normalize("NFKD", texto.lower())
+    return "".join(c for c in sem_acento if not unicodedata.combining(c))
+
+def parse_valor_brl(texto: str) -> float | None:
+    """
+    Converte um valor em reais escrito à mão em float: "R$ 33,50" -> 33.5, "1.200" -> 1200.0, "23,90" -> 23.9.
+    Retorna None se o texto não for um valor.
+    """
+    texto = texto.strip().lower().replace("r$", "").strip()
+    multiplicador = 1.0
+    if texto.endswith("mil"):
+        multiplicador, texto = 1000.0, texto[:-3].strip()
+    elif texto.endswith("k"):
+        multiplicador, texto = 1000.0, texto[:-1].strip()
+
+    if re.fullmatch(r"\d{1,3}(?:\.\d{3})+(?:,\d{1,2})?", texto):
+        texto = texto.replace(".", "").replace(",", ".")
+    elif re.fullmatch(r"\d+,\d{1,2}", texto):
+        texto = texto.replace(",", ".")
+    elif not re.fullmatch(r"\d+(?:\.\d{1,2})?", texto):
+        return None
+
+    try:
+        return float(texto) * multiplicador
+    except ValueError:
+        return None
+
+def _encontrar_categoria(texto_normalizado: str, tokens: list[str]) -> tuple[str | None, str | None]:
+    """Retorna (categoria, palavra-chave) da palavra-chave que aparece primeiro no texto, ou (None, None)."""
+    melhor = (None, None)
+    melhor_posicao = len(texto_normalizado) + 1
+    for categoria, palavras in CATEGORIAS_POR_PALAVRA.items():
+        for palavra in palavras:
+            if " " in palavra:
+                posicao = texto_normalizado.find(palavra)
+            elif palavra in tokens:
+                posicao = re.search(rf"(?<![\w-]){re.escape(palavra)}(?![\w-])", texto_normalizado).start()
+            else:
+                continue
+            if 0 <= posicao < melhor_posicao:
+                melhor, melhor_posicao = (categoria, palavra), posicao
+    return melhor
+
+def categorizar_descricao(descricao: str) -> str | None:
+    """Categoria pelo mapa de palavras-chave (ex: "UBER *TRIP" -> "transporte"), ou None se nenhuma palavra bater."""
+    texto_normalizado = _normalizar(descricao)
+    categoria, _ = _encontrar_categoria(texto_normalizado, re.findall(r"[\w$-]+", texto_normalizado))
+    return categoria
+
+def _inferir_data_hora(tokens: list[str], current_time_utc: datetime) -> str | None:
+    """Resolve hoje/ontem/anteontem no mesmo formato de data_hora_inferida do LLM (12:00 para datas sem hora)."""
+    if "anteontem" in tokens:
+        dia = current_time_utc - timedelta(days=2)
+        return dia.replace(hour=12, minute=0, second=0, microsecond=0).strftime("%Y-%m-%dT%H:%M:%S")
+    if "ontem" in tokens:
+        inicio, _ = parse_periodo_descricao("ontem", current_time_utc)
+        if inicio:
+            return inicio.replace(hour=12).strftime("%Y-%m-%dT%H:%M:%S")
+    return None
+
+def _remover_valor(text_message: str, match) -> str:
+    # O texto normalizado tem o mesmo comprimento do original para caracteres latinos comuns; se não tiver, mantém o original.
+    if len(_normalizar(text_message)) != len(text_message):
+        return text_message
+    return text_message[:match.start()] + " " + text_message[match.end():]
+
+def analisar_mensagem(text_message: str, current_time_utc: datetime | None = None, tipo_padrao: str | None = None) -> tuple[dict | None, float]:
+    """
+    Extrai tipo, valor, categoria, descrição e data de mensagens simples ("gastei 50 no mercado", "uber 23,90").
+    Retorna (dados de uma transação no formato de get_financial_details_from_llm, confiança entre 0 e 1).
+    Os dados são None quando não há exatamente um valor na mensagem.
+    `tipo_padrao` é usado quando o trecho não tem verbo (ex: "uber 18" em "gastei 35 no almoço, uber 18").
+    """
+    current_time_utc = current_time_utc or datetime.now(timezone.utc)
+    texto_normalizado = _normalizar(text_message).strip()
+
+    valores = list(_VALOR_RE.finditer(texto_normalizado))
+    if len(valores) != 1:
+        return None, 0.0
+    valor = parse_valor_brl(valores[0].group(0))
+    if valor is None or valor <= 0:
+        return None, 0.0
+
+    texto_sem_valor = (texto_normalizado[:valores[0].start()] + " " + texto_normalizado[valores[0].end():])
+    tokens = re.findall(r"[\w$-]+", texto_sem_valor)
+
+    confianca = 0.4  # um único valor bem formado
+    tipo = None
+    if any(t in VERBOS_SAIDA for t in tokens):
+        tipo = "saída"
+        confianca += 0.3
+    if any(t in VERBOS_ENTRADA for t in tokens):
+        if tipo is not None:
+            return None, 0.0  # verbos contraditórios
+        tipo = "entrada"
+        confianca += 0.3
+
+    if tipo is None and tipo_padrao is not None:
+        tipo = tipo_padrao
+        confianca += 0.3
+
+    categoria, palavra_categoria = _encontrar_categoria(texto_sem_valor, tokens)
+    if categoria:
+        confianca += 0.3
+        if tipo is None:
+            # Sem verbo, só confia no tipo implícito em mensagens curtas como "uber 23,90".
+            tipo = "entrada" if categoria in CATEGORIAS_DE_ENTRADA else "saída"
+            if len(tokens) <= 3:
+                confianca += 0.2
+    if tipo is None:
+        return None, 0.0
+
+    if _DATA_NAO_SUPORTADA_RE.search(texto_sem_valor):
+        confianca -= 0.5
+
+    palavras_descricao = [
+        t for t in re.findall(r"\S+", _remover_valor(text_message, valores[0]))
+        if _normalizar(t).strip(".,!?;:") not in VERBOS_SAIDA | VERBOS_ENTRADA | PALAVRAS_MOEDA | PALAVRAS_DATA_SUPORTADAS
+    ]
+    while palavras_descricao and _normalizar(palavras_descricao[0]).strip(".,!?;:") in PALAVRAS_VAZIAS:
+        palavras_descricao.pop(0)
+    while palavras_descricao and _normalizar(palavras_descricao[-1]).strip(".,!?;:") in PALAVRAS_VAZIAS:
+        palavras_descricao.pop()
+    descricao = " ".join(palavras_descricao).strip(" .,!?;:") or palavra_categoria or categoria or "N/A"
+
+    dados = {
+        "tipo": tipo,
+        "valor": round(valor, 2),
+        "categoria": categoria or "outros",
+        "descricao": descricao,
+        "data_hora_inferida": _inferir_data_hora(tokens, current_time_utc),
+    }
+    return dados, max(0.0, min(confianca, 1.0))
+
+_SEPARADOR_RE = re.compile(r"\s*(?:;|\n|,(?!\d)|\s+e\s+)\s*", re.IGNORECASE)
+
+def analisar_mensagem_multipla(text_message: str, current_time_utc: datetime | None = None) -> tuple[list[dict] | None, float]:
+    """
+    Divide mensagens como "almoço 35, uber 18 e café 9" em trechos com um valor cada e analisa cada trecho.
+    Retorna (lista de transações, menor confiança entre os trechos). Se algum trecho não tiver exatamente
+    um valor, a mensagem é analisada inteira como uma única transação.
+    """
+    current_time_utc = current_time_utc or datetime.now(timezone.utc)
+    trechos = [t for t in _SEPARADOR_RE.split(text_message.strip()) if t]
+    if len(trechos) > 1 and all(len(_VALOR_RE.findall(_normalizar(t))) == 1 for t in trechos):
+        # Verbo e data mencionados uma vez valem para os trechos seguintes/todos ("... e café 9 ontem").
+        data_hora_mensagem = _inferir_data_hora(re.findall(r"[\w$-]+", _normalizar(text_message)), current_time_utc)
+        transacoes, confiancas, tipo_padrao = [], [], None
+        for trecho in trechos:
+            dados, confianca = analisar_mensagem(trecho, current_time_utc, tipo_padrao)
+            if dados is None:
+                return None, 0.0
+            dados["data_hora_inferida"] = dados["data_hora_inferida"] or data_hora_mensagem
+            tipo_padrao = dados["tipo"]
+            transacoes.append(dados)
+            confiancas.append(confianca)
+        return transacoes, min(confiancas)
+
+    dados, confianca = analisar_mensagem(text_message, current_time_utc)
+    return ([dados] if dados is not None else None), confianca
+
+def parse_transaction_message(text_message: str, current_time_utc: datetime | None = None) -> list[dict] | None:
+    """
+    Caminho rápido antes do LLM: retorna a lista de transações da mensagem se a confiança for >= FAST_PATH_MIN_CONFIDENCE,
+    ou None para que a mensagem siga para o Gemini. Atualiza os contadores de acerto/erro.
+    """
+    if not FAST_PATH_ENABLED:
+        return None
+
+    inicio = time.perf_counter()
+    transacoes, confianca = analisar_mensagem_multipla(text_message, current_time_utc)
+    _stats["tempo_total_ms"] += (time.perf_counter() - inicio) * 1000
+
+    if transacoes and confianca >= FAST_PATH_MIN_CONFIDENCE:
+        _stats["hits"] += 1
+        logger.info(f"Caminho rápido resolveu a mensagem sem LLM ({len(transacoes)} transação(ões), confiança {confianca:.2f}).")
+        return transacoes
+
+    _stats["misses"] += 1
+    return None
+
+def get_fast_path_stats() -> dict:
+    """Contadores do caminho rápido: hits são chamadas ao LLM evitadas."""
+    total = _stats["hits"] + _stats["misses"]
+    return {
+        "hits": _stats["hits"],
+        "misses": _stats["misses"],
+        "hit_rate": _stats["hits"] / total if total else 0.0,
+        "tempo_medio_ms": _stats["tempo_total_ms"] / total if total else 0.0,
+    }
+
+
+if __name__ == "__main__":
+    exemplos = [
+        "gastei 50 no mercado", "recebi 1000 de salário", "uber 23,90", "Gastei R$ 33,50 em um lanche na padaria",
+        "paguei 1.200 de aluguel", "ontem gastei 40 reais na farmácia", "Paguei a conta de luz do dia 5 às 14h",
+        "Comprei um livro por R$35,50 na terça-feira passada", "oi, tudo bem?", "almoço 35, uber 18 e café 9",
+        "gastei 35 no almoço, 18 de uber e 9,50 de café ontem",
+    ]
+    for exemplo in exemplos:
+        dados, confianca = analisar_mensagem_multipla(exemplo)
+        print(f"{exemplo!r} -> {dados} (confiança {confianca:.2f})")
+    for exemplo in exemplos:
+        parse_transaction_message(exemplo)
+    print(get_fast_path_stats())
@@ -0,0 +1,206 @@
+import os
+import io
+import math
+import asyncio
+import hashlib
+import threading
+import multiprocessing
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+
+from dotenv import load_dotenv
+
+import metrics
+
+load_dotenv()
+
+# Pasta das imagens geradas pelo /grafico e o tamanho máximo dela; acima disso as menos acessadas são apagadas.
+GRAFICO_CACHE_DIR = os.getenv("GRAFICO_CACHE_DIR", "graficos_cache")
+GRAFICO_CACHE_MAX_BYTES = int(os.getenv("GRAFICO_CACHE_MAX_BYTES", str(50 * 1024 * 1024)))
+# Processos que desenham os gráficos, fora do event loop (o matplotlib segura o GIL enquanto desenha).
+GRAFICO_PROCESS_WORKERS = int(os.getenv("GRAFICO_PROCESS_WORKERS", "2"))
+
+# Tipo do /grafico -> operação agrupada de query_dynamic_transactions, tipo de transação (None = ambos), período padrão e título.
+TIPOS_GRAFICO = {
+    "categorias": {"operacao": "agrupar_por_categoria", "tipo_transacao": "saída", "periodo_padrao": "este mês", "titulo": "Gastos por categoria"},
+    "mensal": {"operacao": "serie_mensal", "tipo_transacao": None, "periodo_padrao": "este ano", "titulo": "Entradas e saídas por mês"},
+    "diario": {"operacao": "serie_diaria", "tipo_transacao": "saída", "periodo_padrao": "este mês", "titulo": "Gastos por dia"},
+}
+
+_CORES = {"saída": "#d9534f", "entrada": "#5cb85c"}
+_MAX_ROTULOS_EIXO = 24
+
+
+def parametros_grafico(tipo: str, inicio: datetime, fim: datetime) -> dict:
+    """Parâmetros de query_dynamic_transactions para o gráfico: a agregação fica no banco (GROUP BY)."""
+    config = TIPOS_GRAFICO[tipo]
+    params = {"operacao": config["operacao"], "data_inicio": inicio.isoformat(), "data_fim": fim.isoformat()}
+    if config["tipo_transacao"]:
+        params["tipo_transacao"] = config["tipo_transacao"]
+    return params
+
+def chave_grafico(usuario_id: str, tipo: str, inicio: datetime, fim: datetime, versao: int) -> str:
+    """
+    Chave do cache: usuário, tipo, período já resolvido em datas e versão dos dados do usuário.
+    Usar as datas (e não o texto "este mês") faz o gráfico do mês anterior não ser servido depois da virada.
+    """
+    texto = f"{usuario_id}|{tipo}|{inicio.isoformat()}|{fim.isoformat()}|{versao}"
+    return hashlib.sha1(texto.encode("utf-8")).hexdigest()
+
+
+def renderizar_grafico(tipo: str, grupos: list[dict], titulo: str) -> bytes:
+    """
+    Desenha o gráfico em PNG a partir dos grupos de _agrupar_transacoes. Roda nos processos do
+    ProcessPoolExecutor, por isso é uma função de módulo e importa o matplotlib só aqui.
+    """
+    from matplotlib.figure import Figure
+
+    figura = Figure(figsize=(8, 5), dpi=100, layout="constrained")
+    eixo = figura.add_subplot()
+    if tipo == "categorias":
+        grupos = sorted(grupos, key=lambda g: g["total"])  # maior barra no topo
+        eixo.barh([g["chave"] or "sem categoria" for g in grupos], [g["total"] for g in grupos], color=_CORES["saída"])
+        eixo.set_xlabel("R$")
+    else:
+        chaves = sorted({g["chave"] for g in grupos})
+        rotulos = ["/".join(reversed(chave.split("-"))) for chave in chaves]  # "2024-05" -> "05/2024"
+        if tipo == "diario":
+            rotulos = [rotulo[:5] for rotulo in rotulos]  # "03/05/2024" -> "03/05"
+        tipos = [t for t in ("saída", "entrada") if any(g["tipo"] == t for g in grupos)]
+        largura = 0.8 / len(tipos)
+        for i, tipo_transacao in enumerate(tipos):
+            totais = {g["chave"]: g["total"] for g in grupos if g["tipo"] == tipo_transacao}
+            posicoes = [x + (i - (len(tipos) - 1) / 2) * largura for x in range(len(chaves))]
+            eixo.bar(posicoes, [totais.get(chave, 0.0) for chave in chaves], width=largura,
+                     color=_CORES[tipo_transacao], label="Saídas" if tipo_transacao == "saída" else "Entradas")
+        passo = math.ceil(len(chaves) / _MAX_ROTULOS_EIXO)  # séries longas (ex: diário de um ano) mostram só parte das datas
+        eixo.set_xticks(range(0, len(chaves), passo), rotulos[::passo], rotation=45 if len(chaves) > 12 else 0, ha="right" if len(chaves) > 12 else "center")
+        eixo.set_ylabel("R$")
+        if len(tipos) > 1:
+            eixo.legend()
+    eixo.set_title(titulo)
+    eixo.grid(axis="x" if tipo == "categorias" else "y", alpha=0.3)
+
+    buffer = io.BytesIO()
+    figura.savefig(buffer, format="png")
+    return buffer.getvalue()
+
+def _aquecer_processo() -> None:
+    import matplotlib.figure  # noqa: F401 - só carrega o matplotlib no processo
+
+
+class CacheGraficos:
+    """
+    Cache LRU em disco das imagens do /grafico, limitado a `max_bytes`. A ordem de uso é a data de
+    modificação dos arquivos (atualizada a cada acerto), então sobrevive a reinícios do bot.
+    """
+
+    def __init__(self, diretorio: str = GRAFICO_CACHE_DIR, max_bytes: int = GRAFICO_CACHE_MAX_BYTES):
+        self.diretorio = diretorio
+        self.max_bytes = max_bytes
+        self._arquivos = OrderedDict()  # chave -> tamanho em bytes, do menos para o mais recente
+        self._total_bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        os.makedirs(diretorio, exist_ok=True)
+        existentes = []
+        for entrada in os.scandir(diretorio):
+            if entrada.is_file() and entrada.name.endswith(".png"):
+                info = entrada.stat()
+                existentes.append((info.st_mtime, entrada.name[:-4], info.st_size))
+        for _, chave, tamanho in sorted(existentes):
+            self._arquivos[chave] = tamanho
+            self._total_bytes += tamanho
+
+    def _caminho(self, chave: str) -> str:
+        return os.path.join(self.diretorio, f"{chave}.png")
+
+    def get(self, chave: str) -> bytes | None:
+        with self._lock:
+            if chave not in self._arquivos:
+                self.misses += 1
+                metrics.inc("gastaai_grafico_cache_total", resultado="miss")
+                return None
+            try:
+                with open(self._caminho(chave), "rb") as arquivo:
+                    dados = arquivo.read()
+                os.utime(self._caminho(chave))
+            except FileNotFoundError:
+                self._total_bytes -= self._arquivos.pop(chave)
+                self.misses += 1
+                metrics.inc("gastaai_grafico_cache_total", resultado="miss")
+                return None
+            self._arquivos.move_to_end(chave)
+            self.hits += 1
+            metrics.inc("gastaai_grafico_cache_total", resultado="hit")
+            return dados
+
+    def set(self, chave: str, dados: bytes) -> None:
+        with self._lock:
+            temporario = f"{self._caminho(chave)}.{os.getpid()}.tmp"
+            with open(temporario, "wb") as arquivo:
+                arquivo.write(dados)
+            os.replace(temporario, self._caminho(chave))
+            self._total_bytes += len(dados) - self._arquivos.pop(chave, 0)
+            self._arquivos[chave] = len(dados)
+            while self._total_bytes > self.max_bytes and len(self._arquivos) > 1:
+                antiga, tamanho = self._arquivos.popitem(last=False)
+                self._total_bytes -= tamanho
+                self.evictions += 1
+                try:
+                    os.remove(self._caminho(antiga))
+                except FileNotFoundError:
+                    pass
+            metrics.set_gauge("gastaai_grafico_cache_bytes", self._total_bytes)
+
+    def __len__(self) -> int:
+        return len(self._arquivos)
+
+    def stats(self) -> dict:
+        total = self.hits + self.misses
+        return {
+            "arquivos": len(self),
+            "bytes": self._total_bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / total if total else 0.0,
+            "evictions": self.evictions,
+        }
+
+
+_executor = None
+_executor_lock = threading.Lock()
+
+def _obter_executor() -> ProcessPoolExecutor:
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            # fork copiaria o processo do bot com threads em andamento (aiosqlite, to_thread) e algum lock
+            # poderia ficar preso no filho. O forkserver cria os processos a partir de um servidor limpo, sem
+            # essas threads, com este módulo e o matplotlib já carregados. Como no spawn, cada processo importa
+            # o main.py, que por isso só inicia o bot dentro de `if __name__ == "__main__"`.
+            contexto = multiprocessing.get_context("forkserver")
+            contexto.set_forkserver_preload(["graficos", "matplotlib.figure"])
+            _executor = ProcessPoolExecutor(max_workers=GRAFICO_PROCESS_WORKERS, mp_context=contexto)
+        return _executor
+
+def aquecer_processos() -> None:
+    """Sobe os processos de desenho e carrega o matplotlib neles, para o primeiro /grafico não pagar essa espera."""
+    executor = _obter_executor()
+    for _ in range(GRAFICO_PROCESS_WORKERS):
+        executor.submit(_aquecer_processo)
+
+def encerrar_processos() -> None:
+    global _executor
+    with _executor_lock:
+        if _executor is not None:
+            _executor.shutdown(wait=False, cancel_futures=True)
+            _executor = None
+
+async def renderizar_grafico_async(tipo: str, grupos: list[dict], titulo: str) -> bytes:
+    """Desenha o gráfico num dos processos de GRAFICO_PROCESS_WORKERS sem bloquear o event loop."""
+    with metrics.medir("gastaai_grafico_render_seconds", tipo=tipo):
+        return await asyncio.get_running_loop().run_in_executor(_obter_executor(), renderizar_grafico, tipo, grupos, titulo)
@@ -0,0 +1,275 @@
+import os
+import re
+import csv
+import asyncio
+import logging
+import unicodedata
+from datetime import datetime, timezone
+
+from dotenv import load_dotenv
+
+from database import AsyncSessionLocal, add_transactions_bulk_async
+from fast_parser import categorizar_descricao, parse_valor_brl
+from llm_client import classify_categories_async, is_token_budget_exhausted_async
+from llm_scheduler import FilaCheiaError
+from llm_resiliencia import LLMIndisponivelError
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+# Quantas linhas vão em cada INSERT executemany / commit.
+IMPORT_CHUNK_SIZE = int(os.getenv("IMPORT_CHUNK_SIZE", "5000"))
+# Quantas descrições distintas vão em cada chamada de classificação ao LLM.
+IMPORT_LLM_BATCH_SIZE = int(os.getenv("IMPORT_LLM_BATCH_SIZE", "100"))
+# Quantos lotes de classificação de uma mesma importação ficam na fila do LLM ao mesmo tempo
+# (manter abaixo de LLM_MAX_FILA_POR_USUARIO).
+IMPORT_LLM_PARALLEL_BATCHES = int(os.getenv("IMPORT_LLM_PARALLEL_BATCHES", "4"))
+# Desligue para importar sem chamar o LLM (o que as regras locais não reconhecem vira "outros").
+IMPORT_LLM_CATEGORIZATION = os.getenv("IMPORT_LLM_CATEGORIZATION", "true").lower() in ("1", "true", "yes", "sim")
+
+EXTENSOES_CSV = (".csv", ".txt")
+EXTENSOES_OFX = (".ofx", ".qfx")
+
+# Nomes de coluna aceitos no CSV, já normalizados (minúsculas, sem acentos).
+COLUNAS_DATA = ("data", "date", "data lancamento", "data do lancamento", "data da transacao", "dt")
+COLUNAS_DESCRICAO = ("descricao", "historico", "description", "memo", "lancamento", "estabelecimento", "titulo")
+COLUNAS_VALOR = ("valor", "amount", "value", "valor (r$)", "valor r$", "quantia")
+COLUNAS_TIPO = ("tipo", "type", "natureza", "d/c")
+COLUNAS_CATEGORIA = ("categoria", "category")
+
+FORMATOS_DATA = ("%d/%m/%Y", "%Y-%m-%d", "%d/%m/%y", "%d-%m-%Y", "%Y/%m/%d")
+FORMATOS_DATA_HORA = ("%d/%m/%Y %H:%M:%S", "%d/%m/%Y %H:%M", "%d-%m-%Y %H:%M:%S", "%d-%m-%Y %H:%M")
+
+_OFX_TAG_RE = re.compile(r"<(/?)(\w+)>([^<\r\n]*)")
+
+
+class ErroImportacao(Exception):
+    """Arquivo em formato não reconhecido ou sem as colunas mínimas (data, descrição e valor)."""
+
+
+def _normalizar_coluna(nome: str) -> str:
+    texto = unicodedata.normalize("NFKD", (nome or "").strip().casefold())
+    return "".join(c for c in texto if not unicodedata.combining(c))
+
+def _encontrar_coluna(colunas: dict, candidatas: tuple) -> str | None:
+    for candidata in candidatas:
+        if candidata in colunas:
+            return colunas[candidata]
+    return None
+
+def _parse_data(texto: str) -> datetime | None:
+    texto = (texto or "").strip()
+    if len(texto) > 10:
+        # Com horário (ex: o data_hora ISO do /exportar): mantém a hora e converte para UTC.
+        data_hora = _parse_data_hora(texto)
+        if data_hora:
+            return data_hora
+    texto = texto[:10]
+    for formato in FORMATOS_DATA:
+        try:
+            # Extratos só trazem o dia; meio-dia evita que o fuso empurre a data para o dia anterior.
+            return datetime.strptime(texto, formato).replace(hour=12, tzinfo=timezone.utc)
+        except ValueError:
+            continue
+    return None
+
+def _parse_data_hora(texto: str) -> datetime | None:
+    try:
+        data_hora = datetime.fromisoformat(texto)
+    except ValueError:
+        data_hora = None
+        for formato in FORMATOS_DATA_HORA:
+            try:
+                data_hora = datetime.strptime(texto, formato)
+                break
+            except ValueError:
+                continue
+    if data_hora is None:
+        return None
+    if data_hora.tzinfo is None:
+        return data_hora.replace(tzinfo=timezone.utc)
+    return data_hora.astimezone(timezone.utc)
+
+def _parse_valor_com_sinal(texto: str) -> float | None:
+    """'-1.234,56' -> -1234.56; '89,90 D' -> -89.9; '100.00' -> 100.0."""
+    texto = (texto or "").strip().replace("R$", "").replace(" ", "")
+    if not texto:
+        return None
+    negativo = texto.startswith("-") or texto.endswith("-") or texto.upper().endswith("D") or (texto.startswith("(") and texto.endswith(")"))
+    texto = texto.strip("-()").rstrip("DCdc")
+    valor = parse_valor_brl(texto)
+    if valor is None:
+        return None
+    return -valor if negativo else valor
+
+def _tipo_pela_coluna(texto: str | None) -> str | None:
+    texto = _normalizar_coluna(texto or "")
+    if texto in ("d", "debito", "saida", "despesa", "debit"):
+        return "saída"
+    if texto in ("c", "credito", "entrada", "receita", "credit"):
+        return "entrada"
+    return None
+
+def _montar_transacao(data_hora: datetime | None, descricao: str, valor: float | None, tipo: str | None = None, categoria: str | None = None) -> dict | None:
+    if data_hora is None or valor is None or valor == 0:
+        return None
+    return {
+        "tipo": tipo or ("saída" if valor < 0 else "entrada"),
+        "valor": round(abs(valor), 2),
+        "categoria": categoria or None,
+        "descricao": " ".join((descricao or "").split()) or None,
+        "data_hora": data_hora,
+    }
+
+
+def iter_transacoes_csv(arquivo):
+    """
+    Lê um CSV de extrato linha a linha e gera dicionários no formato de add_transactions_bulk.
+    O separador (vírgula ou ponto e vírgula) é detectado pelo cabeçalho. Linhas inválidas geram None.
+    """
+    cabecalho = arquivo.readline()
+    delimitador = ";" if cabecalho.count(";") > cabecalho.count(",") else ","
+    nomes = next(csv.reader([cabecalho], delimiter=delimitador))
+    colunas = {_normalizar_coluna(nome): nome for nome in nomes}
+
+    coluna_data = _encontrar_coluna(colunas, COLUNAS_DATA)
+    coluna_descricao = _encontrar_coluna(colunas, COLUNAS_DESCRICAO)
+    coluna_valor = _encontrar_coluna(colunas, COLUNAS_VALOR)
+    coluna_tipo = _encontrar_coluna(colunas, COLUNAS_TIPO)
+    coluna_categoria = _encontrar_coluna(colunas, COLUNAS_CATEGORIA)
+    if not (coluna_data and coluna_descricao and coluna_valor):
+        raise ErroImportacao("O CSV precisa das colunas de data, descrição e valor.")
+
+    for linha in csv.DictReader(arquivo, fieldnames=nomes, delimiter=delimitador):
+        yield _montar_transacao(
+            _parse_data(linha.get(coluna_data)),
+            linha.get(coluna_descricao),
+            _parse_valor_com_sinal(linha.get(coluna_valor)),
+            _tipo_pela_coluna(linha.get(coluna_tipo)) if coluna_tipo else None,
+            (linha.get(coluna_categoria) or "").strip().lower() if coluna_categoria else None,
+        )
+
+def _transacao_ofx(bloco: dict) -> dict | None:
+    data_hora = None
+    if re.match(r"\d{8}", bloco.get("DTPOSTED", "")):
+        data_hora = datetime.strptime(bloco["DTPOSTED"][:8], "%Y%m%d").replace(hour=12, tzinfo=timezone.utc)
+    try:
+        valor = float(bloco.get("TRNAMT", "").replace(",", "."))
+    except ValueError:
+        valor = None
+    return _montar_transacao(data_hora, bloco.get("MEMO") or bloco.get("NAME"), valor)
+
+def iter_transacoes_ofx(arquivo):
+    """
+    Lê um OFX (SGML ou XML) tag a tag, gerando uma transação a cada </STMTTRN>, esteja o arquivo
+    quebrado em linhas ou todo numa linha só. Usa DTPOSTED, TRNAMT e MEMO (ou NAME). Blocos inválidos geram None.
+    """
+    bloco = None
+    for linha in arquivo:
+        for fechamento, tag, valor in _OFX_TAG_RE.findall(linha):
+            tag = tag.upper()
+            if tag == "STMTTRN":
+                if bloco is not None:
+                    # Um bloco sem </STMTTRN> antes do próximo <STMTTRN> ainda é contado, não descartado.
+                    yield _transacao_ofx(bloco)
+                bloco = None if fechamento else {}
+            elif bloco is not None and not fechamento:
+                bloco.setdefault(tag, valor.strip())
+    if bloco is not None:
+        yield _transacao_ofx(bloco)
+
+
+def _proximo_bloco(transacoes, resumo: dict) -> list[dict]:
+    """Lê do iterador até IMPORT_CHUNK_SIZE transações válidas, contando as inválidas em resumo["ignoradas"]."""
+    bloco = []
+    for transacao in transacoes:
+        if transacao is None:
+            resumo["ignoradas"] += 1
+            continue
+        bloco.append(transacao)
+        if len(bloco) >= IMPORT_CHUNK_SIZE:
+            break
+    return bloco
+
+def _parece_utf8(amostra: bytes) -> bool:
+    try:
+        amostra.decode("utf-8")
+        return True
+    except UnicodeDecodeError as e:
+        # Um caractere multibyte cortado no fim da amostra não conta como erro.
+        return e.start >= len(amostra) - 3
+
+async def _classificar_lote(lote: list[str], usuario_id: str) -> list[str] | None:
+    try:
+        return await classify_categories_async(lote, usuario_id)
+    except (FilaCheiaError, LLMIndisponivelError):
+        return None
+
+async def _classificar_categorias(transacoes: list[dict], cache: dict, usuario_id: str) -> None:
+    """
+    Preenche a categoria das transações do lote: primeiro pelas regras locais do fast_parser,
+    depois com chamadas em lote ao LLM para as descrições distintas que sobraram.
+    `cache` guarda descrição -> categoria entre lotes, já que extratos repetem muito as mesmas descrições.
+    """
+    pendentes = []
+    for transacao in transacoes:
+        if transacao["categoria"]:
+            continue
+        descricao = transacao["descricao"] or ""
+        if descricao not in cache:
+            categoria = categorizar_descricao(descricao)
+            cache[descricao] = categoria
+            if categoria is None:
+                pendentes.append(descricao)
+
+    if pendentes and IMPORT_LLM_CATEGORIZATION and not await is_token_budget_exhausted_async(usuario_id):
+        lotes = [pendentes[i:i + IMPORT_LLM_BATCH_SIZE] for i in range(0, len(pendentes), IMPORT_LLM_BATCH_SIZE)]
+        resultados = []
+        for i in range(0, len(lotes), IMPORT_LLM_PARALLEL_BATCHES):
+            janela = lotes[i:i + IMPORT_LLM_PARALLEL_BATCHES]
+            resultados += await asyncio.gather(*(_classificar_lote(lote, usuario_id) for lote in janela))
+        for lote, categorias in zip(lotes, resultados):
+            if categorias is None:
+                logger.warning(f"Falha ao classificar lote de {len(lote)} descrições; usando 'outros'.")
+                continue
+            cache.update(zip(lote, categorias))
+
+    for transacao in transacoes:
+        if not transacao["categoria"]:
+            transacao["categoria"] = cache.get(transacao["descricao"] or "") or "outros"
+
+async def importar_extrato(caminho_arquivo: str, nome_arquivo: str, usuario_id: str) -> dict:
+    """
+    Importa um extrato CSV ou OFX para o usuário, em blocos de IMPORT_CHUNK_SIZE linhas.
+    Cada bloco é classificado e gravado com um único INSERT executemany e um único commit.
+    Retorna {"importadas": n, "ignoradas": n, "total_saidas": x, "total_entradas": y}.
+    """
+    extensao = os.path.splitext(nome_arquivo or "")[1].lower()
+    if extensao in EXTENSOES_OFX:
+        leitor = iter_transacoes_ofx
+    elif extensao in EXTENSOES_CSV:
+        leitor = iter_transacoes_csv
+    else:
+        raise ErroImportacao("Formato não suportado. Envie um arquivo .csv ou .ofx.")
+
+    resumo = {"importadas": 0, "ignoradas": 0, "total_saidas": 0.0, "total_entradas": 0.0}
+    cache_categorias = {}
+
+    async def gravar(bloco: list[dict]):
+        await _classificar_categorias(bloco, cache_categorias, usuario_id)
+        resumo["importadas"] += await add_transactions_bulk_async(AsyncSessionLocal(), usuario_id, bloco)
+        for transacao in bloco:
+            chave = "total_saidas" if transacao["tipo"] == "saída" else "total_entradas"
+            resumo[chave] += transacao["valor"]
+
+    # Bancos exportam em UTF-8 ou Latin-1/CP1252; errors="replace" evita abortar por um caractere perdido.
+    with open(caminho_arquivo, "rb") as arquivo_binario:
+        encoding = "utf-8-sig" if _parece_utf8(arquivo_binario.read(64 * 1024)) else "cp1252"
+    with open(caminho_arquivo, encoding=encoding, errors="replace", newline="") as arquivo:
+        transacoes = leitor(arquivo)
+        # A leitura e o parsing de cada bloco rodam numa thread; no event loop ficam só a classificação e a gravação.
+        while bloco := await asyncio.to_thread(_proximo_bloco, transacoes, resumo):
+            await gravar(bloco)
+
+    return resumo
@@ -0,0 +1,253 @@
+import os
+import re
+import json
+import time
+import random
+import asyncio
+import logging
+from abc import ABC, abstractmethod
+from datetime import datetime, timezone
+
+from dotenv import load_dotenv
+
+from fast_parser import analisar_mensagem_multipla, categorizar_descricao
+from query_cache import normalize_query
+from utils import parse_periodo_descricao
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+LLM_BACKEND = os.getenv("LLM_BACKEND", "gemini")  # "gemini" ou "local"
+GEMINI_API_KEY = os.getenv("GEMINI_API_KEY")
+LLM_MODEL_NAME = os.getenv("LLM_MODEL_NAME", "gemini-1.5-flash-latest") # Modelo Gemini
+# Modelo mais barato/rápido usado quando o principal responde com sobrecarga (429/503). Vazio desliga.
+LLM_FALLBACK_MODEL_NAME = os.getenv("LLM_FALLBACK_MODEL_NAME")
+
+# Backend local: latência simulada (média e variação, em ms), taxa de erros injetados (0 a 1) e semente.
+LOCAL_LLM_LATENCY_MS = float(os.getenv("LOCAL_LLM_LATENCY_MS", "300"))
+LOCAL_LLM_LATENCY_JITTER_MS = float(os.getenv("LOCAL_LLM_LATENCY_JITTER_MS", "100"))
+LOCAL_LLM_ERROR_RATE = float(os.getenv("LOCAL_LLM_ERROR_RATE", "0"))
+LOCAL_LLM_SEED = os.getenv("LOCAL_LLM_SEED")
+
+# Tarefas atendidas pelos backends. Cada uma tem sua instrução de sistema e formato de resposta.
+TAREFA_FINANCIAL_DETAILS = "financial_details"
+TAREFA_QUERY_PARAMS = "query_params"
+TAREFA_CONVERSATIONAL = "conversational"
+TAREFA_CATEGORIZATION = "categorization"
+
+
+class LLMBackendError(Exception):
+    """Falha ao obter resposta do backend de LLM (inclui os erros injetados pelo backend local)."""
+
+    def __init__(self, mensagem: str, code: int | None = None):
+        super().__init__(mensagem)
+        self.code = code  # status HTTP equivalente, como nas exceções de google.api_core
+
+
+class UsageMetadata:
+    """Mesmos campos de usage_metadata das respostas do Gemini."""
+
+    def __init__(self, prompt_token_count: int = 0, candidates_token_count: int = 0, cached_content_token_count: int = 0):
+        self.prompt_token_count = prompt_token_count
+        self.candidates_token_count = candidates_token_count
+        self.cached_content_token_count = cached_content_token_count
+
+
+class LLMResponse:
+    """Resposta mínima de um backend: `text` e `usage_metadata`, como nas respostas do Gemini."""
+
+    def __init__(self, text: str, usage_metadata: UsageMetadata | None = None):
+        self.text = text
+        self.usage_metadata = usage_metadata
+
+
+class LLMBackend(ABC):
+    """
+    Interface dos backends de LLM usados por llm_client.
+    `instrucoes` mapeia cada tarefa para (instrução de sistema, resposta_json).
+    `usar_fallback` pede o modelo reserva (LLM_FALLBACK_MODEL_NAME) e `timeout` é o limite em segundos da chamada.
+    """
+
+    nome = "base"
+
+    def __init__(self, instrucoes: dict):
+        self.instrucoes = instrucoes
+
+    @abstractmethod
+    def generate(self, tarefa: str, prompt: str, usar_fallback: bool = False, timeout: float | None = None):
+        ...
+
+    @abstractmethod
+    async def generate_async(self, tarefa: str, prompt: str, usar_fallback: bool = False, timeout: float | None = None):
+        ...
+
+
+class GeminiBackend(LLMBackend):
+    """Backend de produção: um GenerativeModel por tarefa, criado uma única vez com sua system_instruction."""
+
+    nome = "gemini"
+
+    def __init__(self, instrucoes: dict, api_key: str | None = GEMINI_API_KEY, model_name: str = LLM_MODEL_NAME,
+                 fallback_model_name: str | None = LLM_FALLBACK_MODEL_NAME):
+        super().__init__(instrucoes)
+        if not api_key:
+            raise ValueError("API Key do Gemini não configurada. Verifique seu arquivo .env.")
+        import google.generativeai as genai
+
+        genai.configure(api_key=api_key)
+        generation_config_json = genai.GenerationConfig(response_mime_type="application/json")
+        generation_config_text = genai.GenerationConfig(response_mime_type="text/plain")
+
+        def criar_modelos(nome_modelo: str) -> dict:
+            return {
+                tarefa: genai.GenerativeModel(
+                    nome_modelo,
+                    generation_config=generation_config_json if resposta_json else generation_config_text,
+                    system_instruction=instrucao,
+                )
+                for tarefa, (instrucao, resposta_json) in instrucoes.items()
+            }
+
+        self.models = criar_modelos(model_name)
+        self.fallback_models = criar_modelos(fallback_model_name) if fallback_model_name else self.models
+
+    def _modelo(self, tarefa: str, usar_fallback: bool):
+        return (self.fallback_models if usar_fallback else self.models)[tarefa]
+
+    def generate(self, tarefa: str, prompt: str, usar_fallback: bool = False, timeout: float | None = None):
+        request_options = {"timeout": timeout} if timeout else None
+        return self._modelo(tarefa, usar_fallback).generate_content(prompt, request_options=request_options)
+
+    async def generate_async(self, tarefa: str, prompt: str, usar_fallback: bool = False, timeout: float | None = None):
+        request_options = {"timeout": timeout} if timeout else None
+        return await self._modelo(tarefa, usar_fallback).generate_content_async(prompt, request_options=request_options)
+
+
+class LocalBackend(LLMBackend):
+    """
+    Substituto determinístico do Gemini para testes de carga sem rede.
+    Responde com regras locais (fast_parser para transações e categorias, heurísticas simples para
+    perguntas de estatísticas), simulando latência e, opcionalmente, falhas.
+    """
+
+    nome = "local"
+
+    def __init__(self, instrucoes: dict, latency_ms: float = LOCAL_LLM_LATENCY_MS, jitter_ms: float = LOCAL_LLM_LATENCY_JITTER_MS,
+                 error_rate: float = LOCAL_LLM_ERROR_RATE, seed: int | None = None):
+        super().__init__(instrucoes)
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+        self.error_rate = error_rate
+        self._random = random.Random(seed)
+
+    def _latencia_s(self) -> float:
+        return max(0.0, self.latency_ms + self._random.uniform(-self.jitter_ms, self.jitter_ms)) / 1000
+
+    def _talvez_falhar(self, tarefa: str):
+        if self.error_rate and self._random.random() < self.error_rate:
+            # 503, como uma sobrecarga do Gemini: exercita as novas tentativas e o modelo reserva.
+            raise LLMBackendError(f"Erro simulado pelo backend local ({tarefa}).", code=503)
+
+    def generate(self, tarefa: str, prompt: str, usar_fallback: bool = False, timeout: float | None = None):
+        time.sleep(self._latencia_s())
+        self._talvez_falhar(tarefa)
+        return self._responder(tarefa, prompt)
+
+    async def generate_async(self, tarefa: str, prompt: str, usar_fallback: bool = False, timeout: float | None = None):
+        await asyncio.sleep(self._latencia_s())
+        self._talvez_falhar(tarefa)
+        return self._responder(tarefa, prompt)
+
+    def _responder(self, tarefa: str, prompt: str) -> LLMResponse:
+        current_time_utc = _extrair_data_atual(prompt)
+        if tarefa == TAREFA_FINANCIAL_DETAILS:
+            transacoes, _ = analisar_mensagem_multipla(_extrair_entre_aspas(prompt, "Mensagem"), current_time_utc)
+            texto = json.dumps({"transacoes": transacoes or []}, ensure_ascii=False)
+        elif tarefa == TAREFA_QUERY_PARAMS:
+            texto = json.dumps(interpretar_pergunta(_extrair_entre_aspas(prompt, "Pergunta"), current_time_utc), ensure_ascii=False)
+        elif tarefa == TAREFA_CATEGORIZATION:
+            descricoes = [re.sub(r"^\d+\.\s*", "", linha) for linha in prompt.splitlines() if linha.strip()]
+            texto = json.dumps({"categorias": [categorizar_descricao(d) or "outros" for d in descricoes]}, ensure_ascii=False)
+        elif tarefa == TAREFA_CONVERSATIONAL:
+            texto = f"Aqui está o que encontrei: {_extrair_entre_aspas(prompt, 'Dados')}"
+        else:
+            raise LLMBackendError(f"Tarefa desconhecida: {tarefa}", code=400)
+
+        # Contagem aproximada (4 caracteres por token) para que a contabilidade de tokens funcione igual.
+        instrucao = self.instrucoes.get(tarefa, ("", False))[0]
+        usage = UsageMetadata(prompt_token_count=(len(instrucao) + len(prompt)) // 4, candidates_token_count=len(texto) // 4)
+        return LLMResponse(texto, usage)
+
+
+def _extrair_data_atual(prompt: str) -> datetime:
+    match = re.search(r"Data atual \(UTC\): (\S+)", prompt)
+    try:
+        return datetime.fromisoformat(match.group(1)) if match else datetime.now(timezone.utc)
+    except ValueError:
+        return datetime.now(timezone.utc)
+
+def _extrair_entre_aspas(prompt: str, rotulo: str) -> str:
+    match = re.search(rf'{rotulo}: "(.*?)"(?:\s*\||\s*$)', prompt, re.DOTALL | re.MULTILINE)
+    return match.group(1) if match else ""
+
+_PERIODOS_CONHECIDOS = ("hoje", "ontem", "este mes", "esse mes", "mes atual", "mes passado", "este ano", "esse ano", "ano atual", "ano passado")
+
+def interpretar_pergunta(pergunta: str, current_time_utc: datetime) -> dict:
+    """Heurística simples que devolve os mesmos parâmetros que o Gemini devolveria para perguntas comuns."""
+    texto = normalize_query(pergunta)
+    if re.search(r"\bmedia\b", texto):
+        operacao = "media_valor"
+    elif re.search(r"\b(?:por|cada) categoria", texto):
+        operacao = "agrupar_por_categoria"
+    elif re.search(r"\bmes a mes\b|\bpor mes\b|\bmensa(?:l|is)\b", texto):
+        operacao = "serie_mensal"
+    elif re.search(r"\bdia a dia\b|\bpor dia\b|\bdiari[oa]s?\b", texto):
+        operacao = "serie_diaria"
+    elif re.search(r"\bquant[oa]s\b", texto):
+        operacao = "contar_transacoes"
+    elif re.search(r"\bquanto\b|\btotal\b|\bsoma\b", texto):
+        operacao = "soma_valor"
+    else:
+        operacao = "listar_transacoes"
+
+    tipo_transacao = None
+    if re.search(r"gast|despesa|paguei|saida", texto):
+        tipo_transacao = "saída"
+    elif re.search(r"recebi|ganhei|entrada|receita", texto):
+        tipo_transacao = "entrada"
+
+    categoria = categorizar_descricao(pergunta)
+    data_inicio = data_fim = None
+    for periodo in _PERIODOS_CONHECIDOS:
+        if periodo in texto:
+            # parse_periodo_descricao espera a grafia com acento ("este mês").
+            inicio, fim = parse_periodo_descricao(periodo.replace("mes", "mês").replace("esse", "este"), current_time_utc)
+            data_inicio = inicio.replace(tzinfo=None).isoformat(timespec="seconds") if inicio else None
+            data_fim = fim.replace(tzinfo=None, microsecond=0).isoformat(timespec="seconds") if fim else None
+            break
+
+    limite = re.search(r"\b(?:top|ultim[oa]s|maiores|menores)\s+(\d+)", texto)
+    return {
+        "operacao": operacao,
+        "tipo_transacao": tipo_transacao,
+        "categorias": [categoria] if categoria else None,
+        "descricao_contem": None,
+        "data_inicio": data_inicio,
+        "data_fim": data_fim,
+        "ordenar_por": "valor" if re.search(r"maior|menor", texto) else "data_hora",
+        "ordem": "asc" if re.search(r"menor", texto) else "desc",
+        "limite_resultados": int(limite.group(1)) if limite else None,
+    }
+
+
+def create_llm_backend_from_env(instrucoes: dict) -> LLMBackend:
+    """Cria o backend configurado em LLM_BACKEND ("gemini" por padrão, ou "local")."""
+    backend = LLM_BACKEND.lower()
+    if backend == "local":
+        seed = int(LOCAL_LLM_SEED) if LOCAL_LLM_SEED else None
+        logger.info(f"Usando backend de LLM local (latência {LOCAL_LLM_LATENCY_MS}±{LOCAL_LLM_LATENCY_JITTER_MS} ms, erros {LOCAL_LLM_ERROR_RATE:.0%}).")
+        return LocalBackend(instrucoes, seed=seed)
+    if backend != "gemini":
+        raise ValueError(f"LLM_BACKEND inválido: '{LLM_BACKEND}'. Use 'gemini' ou 'local'.")
+    return GeminiBackend(instrucoes)
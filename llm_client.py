@@ -1,321 +1,432 @@
 
 import os
 import json
-from datetime import datetime, timezone, timedelta
+import asyncio
+import logging
+from datetime import datetime, timezone
 
-import google.generativeai as genai
 from dotenv import load_dotenv
 
-load_dotenv()
+import metrics
+from database import AsyncSessionLocal, registrar_uso_tokens_async, get_tokens_do_dia_async
+from query_cache import create_query_cache_from_env, make_cache_key
+from llm_scheduler import EscalonadorJusto, FilaCheiaError
+from llm_resiliencia import LLMIndisponivelError, chamar_com_resiliencia, chamar_com_resiliencia_async
+from llm_backends import (
+    LLMBackend, create_llm_backend_from_env, TAREFA_FINANCIAL_DETAILS, TAREFA_QUERY_PARAMS, TAREFA_CONVERSATIONAL, TAREFA_CATEGORIZATION,
+)
 
-GEMINI_API_KEY = os.getenv("GEMINI_API_KEY")
-LLM_MODEL_NAME = os.getenv("LLM_MODEL_NAME", "gemini-1.5-flash-latest") # Modelo Gemini
+load_dotenv()
 
-if not GEMINI_API_KEY:
-    raise ValueError("API Key do Gemini não configurada. Verifique seu arquivo .env.")
+logger = logging.getLogger(__name__)
+
+# --- Instruções estáticas ---
+# Instruções e exemplos fixos vão como system_instruction de modelos criados uma única vez pelo backend.
+# Cada chamada envia só a data atual e a mensagem; como o prefixo é sempre idêntico,
+# ele também é elegível ao cache implícito de contexto do Gemini.
+
+FINANCIAL_DETAILS_INSTRUCTION = """Você é um assistente especialista em finanças pessoais e processamento de linguagem natural.
+Analise a mensagem do usuário (pode ser informal, com erros de digitação ou ordem livre) e extraia as transações financeiras, incluindo a data e hora inferidas.
+Uma mensagem pode descrever várias transações (ex: "almoço 35, uber 18 e café 9"): retorne um item para cada uma.
+
+Retorne um objeto JSON {"transacoes": [...]} em que cada item tem as chaves:
+- "tipo": "entrada" ou "saída".
+- "valor": float positivo (ex: 15.0, 100.75).
+- "categoria": uma de "alimentação", "transporte", "lazer", "moradia", "saúde", "educação", "salário", "presente", "investimentos", "compras", "contas", "outros". Use "outros" se não conseguir inferir.
+- "descricao": descrição concisa (ex: "mc donalds", "gasolina", "poker com amigos").
+- "data_hora_inferida": string ISO 8601 (YYYY-MM-DDTHH:MM:SS) ou null. Só preencha se o usuário mencionar uma data ou hora (ex: "hoje de manhã", "ontem 10pm", "25/12/2023", "dia 5 às 14h"), interpretando-a a partir da "Data atual (UTC)" informada junto com a mensagem. Use o ano atual se só dia e mês forem dados; 12:00:00 se só a data for dada; a data atual se só a hora for dada. Sem menção de data/hora, retorne null.
+
+Exemplos (considerando Data atual (UTC) 2024-06-10T15:00:00+00:00; siga este formato RIGOROSAMENTE):
+Mensagem: "Paguei 15 reais no Mc Donalds"
+{"transacoes": [{"tipo": "saída", "valor": 15.0, "categoria": "alimentação", "descricao": "Mc Donalds", "data_hora_inferida": null}]}
+Mensagem: "Recebi 50 reais no poker com amigos ontem à noite"
+{"transacoes": [{"tipo": "entrada", "valor": 50.0, "categoria": "lazer", "descricao": "poker com amigos", "data_hora_inferida": "2024-06-09T20:00:00"}]}
+Mensagem: "Gastei R$ 33,50 em um lanche na padaria"
+{"transacoes": [{"tipo": "saída", "valor": 33.50, "categoria": "alimentação", "descricao": "lanche na padaria", "data_hora_inferida": null}]}
+Mensagem: "Paguei a conta de luz do dia 5 às 14h"
+{"transacoes": [{"tipo": "saída", "valor": 100.0, "categoria": "contas", "descricao": "conta de luz", "data_hora_inferida": "2024-06-05T14:00:00"}]}
+Mensagem: "almoço 35, uber 18 e café 9 ontem"
+{"transacoes": [{"tipo": "saída", "valor": 35.0, "categoria": "alimentação", "descricao": "almoço", "data_hora_inferida": "2024-06-09T12:00:00"}, {"tipo": "saída", "valor": 18.0, "categoria": "transporte", "descricao": "uber", "data_hora_inferida": "2024-06-09T12:00:00"}, {"tipo": "saída", "valor": 9.0, "categoria": "alimentação", "descricao": "café", "data_hora_inferida": "2024-06-09T12:00:00"}]}"""
+
+QUERY_PARAMS_INSTRUCTION = """Você é um especialista em traduzir perguntas de usuários sobre suas finanças em parâmetros de consulta estruturados.
+Retorne um objeto JSON com os parâmetros abaixo. Use null (ou omita) os que não forem mencionados nem puderem ser inferidos; data_inicio e data_fim devem ser null se não houver período.
+
+- "operacao": "soma_valor", "listar_transacoes", "contar_transacoes", "media_valor", "agrupar_por_categoria" (totais por categoria), "serie_mensal" (totais mês a mês) ou "serie_diaria" (totais dia a dia). Padrão: "listar_transacoes".
+- "tipo_transacao": "entrada", "saída" ou null (ambos).
+- "categorias": lista de categorias mencionadas (ex: ["alimentação", "transporte"]).
+- "descricao_contem": lista de palavras-chave da descrição (ex: ["uber", "ifood"]) ou null.
+- "data_inicio": início do período em ISO 8601 (YYYY-MM-DDTHH:MM:SS, hora 00:00:00) ou null. Interprete períodos como "este mês", "ano passado", "últimos 7 dias", "de 10/01 a 15/01" a partir da "Data atual (UTC)" informada junto com a pergunta.
+- "data_fim": fim do período em ISO 8601 (hora 23:59:59) ou null.
+- "ordenar_por": "data_hora" ou "valor". Padrão: "data_hora".
+- "ordem": "asc" ou "desc". Padrão: "desc" para listas.
+- "limite_resultados": inteiro (ex: "top 5", "últimos 10", "3 categorias em que mais gastei") ou null.
+
+Exemplos (considerando Data atual (UTC) 2024-06-10T15:00:00+00:00; siga este formato RIGOROSAMENTE):
+Pergunta: "quanto gastei com uber esse ultimo mês 04"
+{"operacao": "soma_valor", "tipo_transacao": "saída", "categorias": null, "descricao_contem": ["uber"], "data_inicio": "2024-04-01T00:00:00", "data_fim": "2024-04-30T23:59:59"}
+Pergunta: "Minhas 5 maiores receitas no ano passado"
+{"operacao": "listar_transacoes", "tipo_transacao": "entrada", "categorias": null, "descricao_contem": null, "data_inicio": "2023-01-01T00:00:00", "data_fim": "2023-12-31T23:59:59", "ordenar_por": "valor", "ordem": "desc", "limite_resultados": 5}
+Pergunta: "entradas de 10/01/2024 a 15/01/2024"
+{"operacao": "listar_transacoes", "tipo_transacao": "entrada", "categorias": null, "descricao_contem": null, "data_inicio": "2024-01-10T00:00:00", "data_fim": "2024-01-15T23:59:59"}
+Pergunta: "total gasto em alimentação"
+{"operacao": "soma_valor", "tipo_transacao": "saída", "categorias": ["alimentação"], "descricao_contem": null, "data_inicio": null, "data_fim": null}
+Pergunta: "quanto gastei por categoria este mês"
+{"operacao": "agrupar_por_categoria", "tipo_transacao": "saída", "categorias": null, "descricao_contem": null, "data_inicio": "2024-06-01T00:00:00", "data_fim": "2024-06-30T23:59:59"}
+Pergunta: "meus gastos mês a mês em 2023"
+{"operacao": "serie_mensal", "tipo_transacao": "saída", "categorias": null, "descricao_contem": null, "data_inicio": "2023-01-01T00:00:00", "data_fim": "2023-12-31T23:59:59"}
+Pergunta: "entradas e saídas por dia na última semana"
+{"operacao": "serie_diaria", "tipo_transacao": null, "categorias": null, "descricao_contem": null, "data_inicio": "2024-06-03T00:00:00", "data_fim": "2024-06-10T23:59:59"}"""
+
+CONVERSATIONAL_INSTRUCTION = """Você é um assistente financeiro gente boa e que adora ajudar!
+Você recebe a pergunta do usuário e o que foi encontrado nos dados dele. Responda de forma natural, curta e amigável, como numa conversa.
+Se não encontrou nada, diga isso de forma leve. Não invente dados!
+
+Exemplos:
+Pergunta: "quanto gastei com uber mês passado?" | Dados: "A soma total encontrada foi de R$ 75,50."
+Resposta: Olha só, no mês passado seus gastos com Uber foram de R$ 75,50. Anotado! 😉
+Pergunta: "gastos com cinema este mês" | Dados: "Nenhuma transação encontrada para esses critérios."
+Resposta: Dei uma olhada aqui e parece que você não teve gastos com cinema este mês. Que tal um filminho no próximo? 🍿
+Pergunta: "o que comi em maio?" | Dados: "Encontrei 2 transação(ões). 1. Saída de R$ 20,00 em 'alimentação' (Lanche) no dia 01/05. 2. Saída de R$ 30,00 em 'alimentação' (Café) no dia 02/05."
+Resposta: Em maio, vi que você mandou ver num lanche de R$ 20,00 no dia 01 e um café de R$ 30,00 no dia 02. Bom apetite! 😋
+Pergunta: "qual o total de entradas este mes?" | Dados: "A soma total encontrada foi de R$ 0,00."
+Resposta: Pelo que vi, este mês ainda não pintou nenhuma entrada por aqui. Bora fazer acontecer! 💪
+Pergunta: "gastos por categoria em maio" | Dados: "Totais por categoria: alimentação: R$ 450,00 (12 registros); transporte: R$ 120,00 (8 registros). Total: R$ 570,00."
+Resposta: Em maio, a maior parte foi com alimentação (R$ 450,00 em 12 compras), seguida de transporte (R$ 120,00). No total, R$ 570,00. 🍽️🚗"""
+
+
+CATEGORIZATION_INSTRUCTION = """Você classifica descrições de lançamentos de extratos bancários brasileiros em categorias de finanças pessoais.
+Categorias permitidas: "alimentação", "transporte", "lazer", "moradia", "saúde", "educação", "salário", "presente", "investimentos", "compras", "contas", "outros".
+Você recebe uma lista numerada de descrições. Retorne um objeto JSON {"categorias": [...]} com exatamente uma categoria por descrição, na mesma ordem. Use "outros" quando não souber.
+
+Exemplo:
+1. PAG*IFOOD SAO PAULO
+2. PIX RECEBIDO EMPRESA LTDA
+3. DROGASIL 1234
+{"categorias": ["alimentação", "salário", "saúde"]}"""
+
+CATEGORIAS_VALIDAS = (
+    "alimentação", "transporte", "lazer", "moradia", "saúde", "educação",
+    "salário", "presente", "investimentos", "compras", "contas", "outros",
+)
+
+# Tarefa -> (instrução de sistema, resposta em JSON?)
+INSTRUCOES_POR_TAREFA = {
+    TAREFA_FINANCIAL_DETAILS: (FINANCIAL_DETAILS_INSTRUCTION, True),
+    TAREFA_QUERY_PARAMS: (QUERY_PARAMS_INSTRUCTION, True),
+    TAREFA_CONVERSATIONAL: (CONVERSATIONAL_INSTRUCTION, False),
+    TAREFA_CATEGORIZATION: (CATEGORIZATION_INSTRUCTION, True),
+}
+
+# Backend escolhido por LLM_BACKEND: Gemini em produção ou o substituto local para testes de carga.
+# É criado na primeira chamada, então importar este módulo não exige GEMINI_API_KEY nem rede.
+_llm_backend = None
+
+def get_llm_backend() -> LLMBackend:
+    global _llm_backend
+    if _llm_backend is None:
+        _llm_backend = create_llm_backend_from_env(INSTRUCOES_POR_TAREFA)
+    return _llm_backend
+
+def set_llm_backend(backend: LLMBackend) -> None:
+    """Troca o backend em uso (ex: um LocalBackend com outra latência/taxa de erro em testes de carga)."""
+    global _llm_backend
+    _llm_backend = backend
+
+# Cache dos parâmetros de consulta: a resposta depende só da pergunta normalizada e da data atual.
+query_params_cache = create_query_cache_from_env()
+
+async def _query_params_cache_get_async(cache_key: str) -> dict | None:
+    if query_params_cache.bloqueante:
+        return await asyncio.to_thread(query_params_cache.get, cache_key)
+    return query_params_cache.get(cache_key)
+
+async def _query_params_cache_set_async(cache_key: str, params: dict) -> None:
+    if query_params_cache.bloqueante:
+        await asyncio.to_thread(query_params_cache.set, cache_key, params)
+    else:
+        query_params_cache.set(cache_key, params)
+
+# Fila justa por usuário na frente das chamadas assíncronas (limite global em LLM_MAX_CONCURRENCY).
+escalonador_llm = EscalonadorJusto()
+
+# Orçamento diário de tokens (prompt + completion) por usuário. 0 = sem limite.
+LLM_DAILY_TOKEN_BUDGET = int(os.getenv("LLM_DAILY_TOKEN_BUDGET", "0"))
+
+# Tokens consumidos por função desde o início do processo.
+_token_usage = {}
+
+def _record_token_usage(funcao: str, response) -> tuple[int, int]:
+    """Acumula e loga os tokens de entrada/saída informados em response.usage_metadata. Retorna (prompt, completion)."""
+    usage = getattr(response, "usage_metadata", None)
+    if usage is None:
+        return 0, 0
+    prompt_tokens = getattr(usage, "prompt_token_count", 0) or 0
+    completion_tokens = getattr(usage, "candidates_token_count", 0) or 0
+    cached_tokens = getattr(usage, "cached_content_token_count", 0) or 0
+
+    totais = _token_usage.setdefault(funcao, {"chamadas": 0, "prompt_tokens": 0, "completion_tokens": 0, "cached_tokens": 0})
+    totais["chamadas"] += 1
+    totais["prompt_tokens"] += prompt_tokens
+    totais["completion_tokens"] += completion_tokens
+    totais["cached_tokens"] += cached_tokens
+    logger.info(f"Tokens ({funcao}): prompt={prompt_tokens} (cache={cached_tokens}) completion={completion_tokens}")
+    return prompt_tokens, completion_tokens
+
+def get_token_usage_stats() -> dict:
+    """Totais de tokens por função (chamadas, prompt_tokens, completion_tokens, cached_tokens)."""
+    return {funcao: dict(totais) for funcao, totais in _token_usage.items()}
+
+def _generate_content(tarefa: str, prompt: str, funcao: str):
+    backend = get_llm_backend()
+    response = chamar_com_resiliencia(
+        lambda usar_fallback, timeout: backend.generate(tarefa, prompt, usar_fallback, timeout), funcao
+    )
+    _record_token_usage(funcao, response)
+    return response
+
+async def _record_user_token_usage_async(usuario_id: str, funcao: str, prompt_tokens: int, completion_tokens: int) -> None:
+    """Grava os tokens da chamada na tabela uso_tokens. Uma falha aqui não derruba a resposta ao usuário."""
+    try:
+        await registrar_uso_tokens_async(AsyncSessionLocal(), usuario_id, funcao, prompt_tokens, completion_tokens)
+    except Exception as e:
+        print(f"Erro ao registrar tokens do usuário {usuario_id}: {e}")
 
-genai.configure(api_key=GEMINI_API_KEY)
+async def is_token_budget_exhausted_async(usuario_id: str) -> bool:
+    """True se o usuário já consumiu hoje (UTC) LLM_DAILY_TOKEN_BUDGET tokens ou mais."""
+    if LLM_DAILY_TOKEN_BUDGET <= 0:
+        return False
+    try:
+        return await get_tokens_do_dia_async(AsyncSessionLocal(), usuario_id) >= LLM_DAILY_TOKEN_BUDGET
+    except Exception as e:
+        print(f"Erro ao verificar orçamento de tokens do usuário {usuario_id}: {e}")
+        return False
 
-generation_config_json = genai.GenerationConfig(response_mime_type="application/json")
-generation_config_text = genai.GenerationConfig(response_mime_type="text/plain")
+async def _generate_content_async(tarefa: str, prompt: str, funcao: str, usuario_id: str | None = None):
+    """
+    Chama o LLM sem bloquear o event loop, passando pela fila justa do escalonador_llm.
+    Com `usuario_id`, os tokens da chamada também são atribuídos ao usuário em uso_tokens.
+    Levanta FilaCheiaError se o usuário já tiver chamadas demais aguardando e LLMIndisponivelError
+    se o provedor não responder (tentativas esgotadas ou circuito aberto).
+    """
+    backend = get_llm_backend()
+
+    async def chamar():
+        # Latência medida por tentativa, depois de obter a vaga: a espera na fila vai para gastaai_llm_fila_espera_seconds.
+        return await chamar_com_resiliencia_async(
+            lambda usar_fallback, timeout: backend.generate_async(tarefa, prompt, usar_fallback, timeout), funcao
+        )
+
+    response = await escalonador_llm.executar(usuario_id, chamar)
+    prompt_tokens, completion_tokens = _record_token_usage(funcao, response)
+    if usuario_id is not None:
+        await _record_user_token_usage_async(usuario_id, funcao, prompt_tokens, completion_tokens)
+    return response
+
+def _build_financial_details_prompt(text_message: str) -> str:
+    current_utc_iso = datetime.now(timezone.utc).isoformat()
+    return f'Data atual (UTC): {current_utc_iso}\nMensagem: "{text_message}"'
+
+def _parse_financial_details_response(response) -> list[dict] | None:
+    cleaned_response_text = response.text.strip().removeprefix("```json").removesuffix("```").strip()
+    parsed_json = json.loads(cleaned_response_text)
+
+    # Aceita {"transacoes": [...]}, uma lista solta ou um único objeto (formato antigo).
+    if isinstance(parsed_json, dict):
+        transacoes = parsed_json["transacoes"] if isinstance(parsed_json.get("transacoes"), list) else [parsed_json]
+    elif isinstance(parsed_json, list):
+        transacoes = parsed_json
+    else:
+        raise json.JSONDecodeError("Formato inesperado para a lista de transações", cleaned_response_text, 0)
+    transacoes = [t for t in transacoes if isinstance(t, dict)]
+
+    # Validação básica do formato ISO 8601 se data_hora_inferida não for null
+    for transacao in transacoes:
+        if transacao.get("data_hora_inferida") is not None:
+            try:
+                datetime.fromisoformat(transacao["data_hora_inferida"])
+            except ValueError:
+                print(f"AVISO: LLM retornou data_hora_inferida em formato inválido: {transacao.get('data_hora_inferida')}. Definindo como null.")
+                transacao["data_hora_inferida"] = None
 
-model_json = genai.GenerativeModel(LLM_MODEL_NAME, generation_config=generation_config_json)
-model_text = genai.GenerativeModel(LLM_MODEL_NAME, generation_config=generation_config_text)
+    return transacoes or None
 
-def get_financial_details_from_llm(text_message: str) -> dict | None:
+def get_financial_details_from_llm(text_message: str) -> list[dict] | None:
     """
     Envia a mensagem para a API Gemini e tenta extrair detalhes financeiros.
     Inclui a lógica para interpretar a data/hora diretamente no LLM.
-    Retorna um dicionário estruturado ou None em caso de falha.
+    Retorna a lista de transações encontradas na mensagem (uma ou mais) ou None em caso de falha.
     """
-    current_utc_time_for_llm_context = datetime.now(timezone.utc)
-    current_date_for_llm_context_str = current_utc_time_for_llm_context.strftime("%Y-%m-%d")
-    current_utc_iso = current_utc_time_for_llm_context.isoformat()
-
+    prompt = _build_financial_details_prompt(text_message)
     try:
-        yesterday_utc_date = (current_utc_time_for_llm_context.date() - timedelta(days=1)).strftime('%Y-%m-%d')
+        response = _generate_content(TAREFA_FINANCIAL_DETAILS, prompt, "get_financial_details_from_llm")
+        return _parse_financial_details_response(response)
+    except json.JSONDecodeError as e:
+        print(f"Erro ao decodificar JSON do Gemini (detalhes financeiros): {e}")
+        metrics.inc("gastaai_llm_falhas_total", funcao="get_financial_details_from_llm", motivo="json_invalido")
+        response_text = response.text if 'response' in locals() and hasattr(response, 'text') else 'N/A'
+        print(f"Resposta recebida: {response_text}")
+        return None
     except Exception as e:
-        print(f"Erro calculando data para exemplo (yesterday): {e}")
-        yesterday_utc_date = "YYYY-MM-DD"
+        print(f"Erro na chamada da API Gemini (detalhes financeiros): {e}")
+        return None
 
-    try:
-         current_month_day_5_utc_date = current_utc_time_for_llm_context.replace(day=5).strftime('%Y-%m-%d')
-    except ValueError:
-         print("Erro calculando data para exemplo (dia 5 do mês).")
-         current_month_day_5_utc_date = "YYYY-MM-05"
-    except Exception as e:
-        print(f"Erro inesperado calculando data para exemplo (dia 5): {e}")
-        current_month_day_5_utc_date = "YYYY-MM-05"
-
-
-    prompt = f"""
-    Você é um assistente especialista em finanças pessoais e processamento de linguagem natural.
-    Sua tarefa é analisar a mensagem do usuário e extrair informações financeiras de forma estruturada, incluindo a data e hora inferidas.
-    A mensagem pode ser informal, conter erros de digitação ou ter a ordem das palavras livre.
-
-    Retorne a informação como um objeto JSON com as seguintes chaves:
-    - "tipo": string, deve ser "entrada" ou "saída".
-    - "valor": float, o valor numérico da transação (ex: 15.0, 50.0, 100.75). Deve ser sempre positivo.
-    - "categoria": string, uma categoria para a transação (ex: "alimentação", "transporte", "lazer", "moradia", "saúde", "educação", "salário", "presente", "investimentos", "compras", "contas", "outros"). Se não conseguir inferir, use "outros".
-    - "descricao": string, uma descrição concisa da transação (ex: "mc donalds", "gasolina", "poker com amigos", "presente de aniversário").
-    - "data_hora_inferida": string ou null. Se o usuário mencionar explicitamente uma data ou hora (ex: "hoje de manhã", "ontem 10pm", "25/12/2023", "dia 5 às 14h", "amanhã 8 da manhã"), interprete essa menção baseando-se na data e hora atuais UTC ({current_utc_iso}) e retorne a data e hora inferidas no formato ISO 8601 (YYYY-MM-DDTHH:MM:SS). Use o ano atual se apenas dia e mês forem dados e fizer sentido no contexto. Se apenas a data for dada, use 12:00:00 como hora padrão. Se apenas a hora for dada, use a data atual UTC. Se nenhuma data/hora específica for mencionada, retorne null.
-
-    Contexto da data atual (UTC) para sua referência ao interpretar "hoje", "ontem", etc.: {current_date_for_llm_context_str}
-
-    Exemplos de extração (siga este formato RIGOROSAMENTE):
-
-    1. Mensagem do usuário: "Paguei 15 reais no Mc Donalds"
-       Data atual (UTC) para contexto: {current_date_for_llm_context_str}
-       JSON Output:
-       {{
-         "tipo": "saída",
-         "valor": 15.0,
-         "categoria": "alimentação",
-         "descricao": "Mc Donalds",
-         "data_hora_inferida": null
-       }}
-
-    2. Mensagem do usuário: "Recebi 50 reais no poker com amigos ontem à noite"
-       Data atual (UTC) para contexto: {current_utc_iso}
-       JSON Output (assumindo ontem foi {yesterday_utc_date} e "noite" é 20:00:00):
-       {{
-         "tipo": "entrada",
-         "valor": 50.0,
-         "categoria": "lazer",
-         "descricao": "poker com amigos",
-         "data_hora_inferida": "{yesterday_utc_date}T20:00:00"
-       }}
-
-    3. Mensagem do usuário: "Gastei R$ 33,50 em um lanche na padaria"
-       Data atual (UTC) para contexto: {current_date_for_llm_context_str}
-       JSON Output:
-       {{
-         "tipo": "saída",
-         "valor": 33.50,
-         "categoria": "alimentação",
-         "descricao": "lanche na padaria",
-         "data_hora_inferida": null
-       }}
-
-    4. Mensagem do usuário: "Paguei a conta de luz do dia 5 às 14h"
-       Data atual (UTC) para contexto: {current_utc_iso}
-       JSON Output (assumindo o dia 5 do mês atual):
-       {{
-         "tipo": "saída",
-         "valor": 100.0,
-         "categoria": "contas",
-         "descricao": "conta de luz",
-         "data_hora_inferida": "{current_month_day_5_utc_date}T14:00:00"
-       }}
-    
-    Agora, analise a seguinte mensagem do usuário:
-    Mensagem do usuário: "{text_message}"
-    Data atual (UTC) para contexto: {current_utc_iso}
-    JSON Output:
+async def get_financial_details_from_llm_async(text_message: str, usuario_id: str | None = None) -> list[dict] | None:
     """
-
-
+    Versão assíncrona de get_financial_details_from_llm, para uso nos handlers do bot.
+    """
+    prompt = _build_financial_details_prompt(text_message)
     try:
-        response = model_json.generate_content(prompt)
-        cleaned_response_text = response.text.strip().removeprefix("```json").removesuffix("```").strip()
-        parsed_json = json.loads(cleaned_response_text)
-        
-        # Validação básica do formato ISO 8601 se data_hora_inferida não for null
-        if parsed_json.get("data_hora_inferida") is not None:
-            try:
-                datetime.fromisoformat(parsed_json["data_hora_inferida"])
-            except ValueError:
-                print(f"AVISO: LLM retornou data_hora_inferida em formato inválido: {parsed_json.get('data_hora_inferida')}. Definindo como null.")
-                parsed_json["data_hora_inferida"] = None
-
-        return parsed_json
+        response = await _generate_content_async(TAREFA_FINANCIAL_DETAILS, prompt, "get_financial_details_from_llm", usuario_id)
+        return _parse_financial_details_response(response)
     except json.JSONDecodeError as e:
         print(f"Erro ao decodificar JSON do Gemini (detalhes financeiros): {e}")
+        metrics.inc("gastaai_llm_falhas_total", funcao="get_financial_details_from_llm", motivo="json_invalido")
         response_text = response.text if 'response' in locals() and hasattr(response, 'text') else 'N/A'
         print(f"Resposta recebida: {response_text}")
         return None
+    except (FilaCheiaError, LLMIndisponivelError):
+        raise  # o handler responde pelo caminho local
     except Exception as e:
         print(f"Erro na chamada da API Gemini (detalhes financeiros): {e}")
         return None
 
+def _build_query_params_prompt(user_query: str) -> str:
+    current_utc_iso = datetime.now(timezone.utc).isoformat()
+    return f'Data atual (UTC): {current_utc_iso}\nPergunta: "{user_query}"'
+
+def _parse_query_params_response(response) -> dict:
+    cleaned_response_text = response.text.strip().removeprefix("```json").removesuffix("```").strip()
+    parsed_json = json.loads(cleaned_response_text)
+
+    # Validação básica do formato ISO 8601 para data_inicio e data_fim
+    for key in ["data_inicio", "data_fim"]:
+        if key in parsed_json and parsed_json.get(key) is not None:
+            try:
+                datetime.fromisoformat(parsed_json[key])
+            except ValueError:
+                print(f"AVISO: LLM retornou '{key}' em formato inválido: {parsed_json.get(key)}. Definindo como null.")
+                parsed_json[key] = None
+
+    return parsed_json
+
 def get_query_params_from_natural_language(user_query: str) -> dict | None:
     """
     Envia a pergunta do usuário para a API Gemini para extrair parâmetros de consulta,
     incluindo a interpretação do período diretamente no LLM.
     """
+    cache_key = make_cache_key(user_query)
+    if query_params_cache is not None:
+        cached_params = query_params_cache.get(cache_key)
+        if cached_params is not None:
+            return cached_params
 
-    current_utc_time_for_llm_context = datetime.now(timezone.utc)
-    current_date_for_llm_context_str = current_utc_time_for_llm_context.strftime("%Y-%m-%d")
-    current_utc_iso = current_utc_time_for_llm_context.isoformat()
-
+    prompt = _build_query_params_prompt(user_query)
     try:
-        april_of_current_year_start_date = current_utc_time_for_llm_context.replace(month=4, day=1).strftime('%Y-%m-%d')
-        try:
-             next_month = current_utc_time_for_llm_context.replace(month=4).date().replace(day=28) + timedelta(days=4)
-             april_of_current_year_end_date = (next_month - timedelta(days=next_month.day)).strftime('%Y-%m-%d')
-        except ValueError: 
-             print("Erro calculando fim do mês para exemplo (Abril).")
-             april_of_current_year_end_date = "YYYY-04-30" 
-        except Exception as e:
-             print(f"Erro inesperado calculando fim do mês para exemplo (Abril): {e}")
-             april_of_current_year_end_date = "YYYY-04-30"
-
-
-
-        last_year_start_date = current_utc_time_for_llm_context.replace(year=current_utc_time_for_llm_context.year - 1, month=1, day=1).strftime('%Y-%m-%d')
-        last_year_end_date = current_utc_time_for_llm_context.replace(year=current_utc_time_for_llm_context.year - 1, month=12, day=31).strftime('%Y-%m-%d')
-
+        response = _generate_content(TAREFA_QUERY_PARAMS, prompt, "get_query_params_from_natural_language")
+        parsed_json = _parse_query_params_response(response)
+        if query_params_cache is not None:
+            query_params_cache.set(cache_key, parsed_json)
+        return parsed_json
+    except json.JSONDecodeError as e:
+        print(f"Erro ao decodificar JSON do Gemini (parâmetros de query): {e}")
+        metrics.inc("gastaai_llm_falhas_total", funcao="get_query_params_from_natural_language", motivo="json_invalido")
+        response_text = response.text if 'response' in locals() and hasattr(response, 'text') else 'N/A'
+        print(f"Resposta recebida: {response_text}")
+        return None
     except Exception as e:
-        print(f"Erro calculando datas para exemplos de query: {e}")
-        april_of_current_year_start_date = "YYYY-04-01"
-        april_of_current_year_end_date = "YYYY-04-30"
-        last_year_start_date = "YYYY-01-01"
-        last_year_end_date = "YYYY-12-31"
-
-
-    prompt = f"""
-    Você é um especialista em analisar perguntas de usuários sobre dados financeiros e traduzi-las em parâmetros de consulta estruturados.
-    Analise a pergunta do usuário e extraia os seguintes parâmetros em formato JSON.
-    Se um parâmetro não for mencionado ou não puder ser inferido, use `null` para seu valor ou omita-o (exceto para data_inicio e data_fim que devem ser null se não houver período).
-
-    Parâmetros a extrair:
-    - "operacao": string - Qual é o objetivo principal? Valores possíveis: "soma_valor", "listar_transacoes", "contar_transacoes", "media_valor". Se não especificado, assuma "listar_transacoes".
-    - "tipo_transacao": string - "entrada", "saída", ou null se não especificado (significando ambos os tipos).
-    - "categorias": array de strings - Lista de categorias mencionadas (ex: ["alimentação", "transporte"]).
-    - "descricao_contem": array de strings - Lista de palavras-chave que devem estar na descrição da transação (ex: ["uber", "cinema", "ifood"]). Null se não houver.
-    - "data_inicio": string ou null. Se o usuário especificar um período (ex: "este mês", "ano passado", "últimos 7 dias", "de 10/01 a 15/01"), interprete o *início* desse período com base na data e hora atuais UTC ({current_utc_iso}) e retorne no formato ISO 8601 (YYYY-MM-DDTHH:MM:SS). Para início de períodos, use 00:00:00 como hora padrão. Retorne null se nenhum período for especificado.
-    - "data_fim": string ou null. Se o usuário especificar um período, interprete o *fim* desse período com base na data e hora atuais UTC ({current_utc_iso}) e retorne no formato ISO 8601 (YYYY-MM-DDTHH:MM:SS). Para fim de períodos, use 23:59:59 como hora padrão. Retorne null se nenhum período for especificado.
-    - "ordenar_por": string - Campo para ordenação (ex: "data_hora", "valor"). Default: "data_hora".
-    - "ordem": string - "asc" para ascendente, "desc" para descendente. Default: "desc" para listas, irrelevante para somas/contagens.
-    - "limite_resultados": integer - Número máximo de resultados a serem retornados (ex: para "top 5", "ultimos 10"). Null se não especificado.
-
-    Contexto da data atual (UTC) para sua referência ao interpretar "este mês", "mês passado", etc.: {current_date_for_llm_context_str}
-
-    Exemplos de Pergunta e Output (siga este formato RIGOROSAMENTE):
-
-    1. Pergunta: "quanto gastei com uber esse ultimo mês 04"
-       Data atual (UTC): {current_utc_iso}
-       JSON Output (assumindo último mês 04 foi Abril do ano atual):
-       {{
-           "operacao": "soma_valor",
-           "tipo_transacao": "saída",
-           "categorias": null,
-           "descricao_contem": ["uber"],
-           "data_inicio": "{april_of_current_year_start_date}T00:00:00",
-           "data_fim": "{april_of_current_year_end_date}T23:59:59"
-       }}
-
-    2. Pergunta: "Minhas 5 maiores receitas no ano passado"
-       Data atual (UTC): {current_utc_iso}
-       JSON Output (assumindo ano passado foi {current_utc_time_for_llm_context.year - 1}):
-       {{
-           "operacao": "listar_transacoes",
-           "tipo_transacao": "entrada",
-           "categorias": null,
-           "descricao_contem": null,
-           "data_inicio": "{last_year_start_date}T00:00:00",
-           "data_fim": "{last_year_end_date}T23:59:59",
-           "ordenar_por": "valor",
-           "ordem": "desc",
-           "limite_resultados": 5
-       }}
-
-    3. Pergunta: "entradas de 10/01/2024 a 15/01/2024"
-       Data atual (UTC): {current_utc_iso}
-       JSON Output:
-       {{
-           "operacao": "listar_transacoes",
-           "tipo_transacao": "entrada",
-           "categorias": null,
-           "descricao_contem": null,
-           "data_inicio": "2024-01-10T00:00:00",
-           "data_fim": "2024-01-15T23:59:59"
-       }}
-
-    4. Pergunta: "total gasto em alimentação"
-       Data atual (UTC): {current_utc_iso}
-       JSON Output:
-       {{
-           "operacao": "soma_valor",
-           "tipo_transacao": "saída",
-           "categorias": ["alimentação"],
-           "descricao_contem": null,
-           "data_inicio": null,
-           "data_fim": null
-       }}
-
-    Agora, analise a seguinte pergunta do usuário:
-    Pergunta: "{user_query}"
-    Data atual (UTC) para contexto: {current_utc_iso}
-    JSON Output:
-    """
+        print(f"Erro na chamada da API Gemini (parâmetros de query): {e}")
+        return None
 
+async def get_query_params_from_natural_language_async(user_query: str, usuario_id: str | None = None) -> dict | None:
+    """
+    Versão assíncrona de get_query_params_from_natural_language, para uso nos handlers do bot.
+    """
+    cache_key = make_cache_key(user_query)
+    if query_params_cache is not None:
+        cached_params = await _query_params_cache_get_async(cache_key)
+        if cached_params is not None:
+            return cached_params
 
+    prompt = _build_query_params_prompt(user_query)
     try:
-        response = model_json.generate_content(prompt)
-        cleaned_response_text = response.text.strip().removeprefix("```json").removesuffix("```").strip()
-        parsed_json = json.loads(cleaned_response_text)
-
-        # Validação básica do formato ISO 8601 para data_inicio e data_fim
-        for key in ["data_inicio", "data_fim"]:
-            if key in parsed_json and parsed_json.get(key) is not None:
-                try:
-                    datetime.fromisoformat(parsed_json[key])
-                except ValueError:
-                    print(f"AVISO: LLM retornou '{key}' em formato inválido: {parsed_json.get(key)}. Definindo como null.")
-                    parsed_json[key] = None
-
-
+        response = await _generate_content_async(TAREFA_QUERY_PARAMS, prompt, "get_query_params_from_natural_language", usuario_id)
+        parsed_json = _parse_query_params_response(response)
+        if query_params_cache is not None:
+            await _query_params_cache_set_async(cache_key, parsed_json)
         return parsed_json
     except json.JSONDecodeError as e:
         print(f"Erro ao decodificar JSON do Gemini (parâmetros de query): {e}")
+        metrics.inc("gastaai_llm_falhas_total", funcao="get_query_params_from_natural_language", motivo="json_invalido")
         response_text = response.text if 'response' in locals() and hasattr(response, 'text') else 'N/A'
         print(f"Resposta recebida: {response_text}")
         return None
+    except (FilaCheiaError, LLMIndisponivelError):
+        raise
     except Exception as e:
         print(f"Erro na chamada da API Gemini (parâmetros de query): {e}")
         return None
 
+def _build_conversational_prompt(original_query: str, data_summary: str) -> str:
+    return f'Pergunta: "{original_query}" | Dados: "{data_summary}"\nResposta:'
+
 def generate_conversational_response(original_query: str, data_summary: str) -> str:
     """
     Gera uma resposta conversacional baseada na pergunta original e nos dados sumarizados.
     """
-    prompt = f"""
-    Você é um assistente financeiro gente boa e que adora ajudar!
-    O usuário te perguntou: "{original_query}"
-
-    E você descobriu o seguinte nos dados dele: "{data_summary}"
-
-    Agora, crie uma resposta bem natural e amigável para ele, como se estivesse conversando.
-    Se não encontrou nada, diga isso de forma leve. Não invente dados!
-
-    Exemplos de como você poderia responder:
+    prompt = _build_conversational_prompt(original_query, data_summary)
+    try:
+        response = _generate_content(TAREFA_CONVERSATIONAL, prompt, "generate_conversational_response")
+        return response.text.strip()
+    except Exception as e:
+        print(f"Erro na chamada da API Gemini (resposta conversacional): {e}")
+        return "Puxa, não consegui pensar numa resposta legal agora. Mas os dados são: " + data_summary
 
-    1. Pergunta: "quanto gastei com uber mês passado?"
-       Dados: "A soma total encontrada foi de R$ 75,50."
-       Resposta: "Olha só, no mês passado seus gastos com Uber foram de R$ 75,50. Anotado! 😉"
+async def generate_conversational_response_async(original_query: str, data_summary: str, usuario_id: str | None = None) -> str:
+    """
+    Versão assíncrona de generate_conversational_response, para uso nos handlers do bot.
+    """
+    prompt = _build_conversational_prompt(original_query, data_summary)
+    try:
+        response = await _generate_content_async(TAREFA_CONVERSATIONAL, prompt, "generate_conversational_response", usuario_id)
+        return response.text.strip()
+    except (FilaCheiaError, LLMIndisponivelError):
+        raise
+    except Exception as e:
+        print(f"Erro na chamada da API Gemini (resposta conversacional): {e}")
+        return "Puxa, não consegui pensar numa resposta legal agora. Mas os dados são: " + data_summary
 
-    2. Pergunta: "gastos com cinema este mês"
-       Dados: "Nenhuma transação encontrada para esses critérios."
-       Resposta: "Dei uma olhada aqui e parece que você não teve gastos com cinema este mês. Que tal um filminho no próximo? 🍿"
 
-    3. Pergunta: "o que comi em maio?"
-       Dados: "Encontrei 2 transação(ões). 1. Saída de R$ 20,00 em 'alimentação' (Lanche) no dia 01/05. 2. Saída de R$ 30,00 em 'alimentação' (Café) no dia 02/05."
-       Resposta: "Em maio, vi que você mandou ver num lanche de R$ 20,00 no dia 01 e um café de R$ 30,00 no dia 02. Bom apetite! 😋"
-    
-    4. Pergunta: "qual o total de entradas este mes?"
-       Dados: "A soma total encontrada foi de R$ 0,00." (Implica que não houve entradas)
-       Resposta: "Pelo que vi, este mês ainda não pintou nenhuma entrada por aqui. Bora fazer acontecer! 💪"
+def _build_categorization_prompt(descricoes: list[str]) -> str:
+    return "\n".join(f"{i}. {descricao}" for i, descricao in enumerate(descricoes, start=1))
 
+def _parse_categorization_response(response, quantidade: int) -> list[str]:
+    cleaned_response_text = response.text.strip().removeprefix("```json").removesuffix("```").strip()
+    parsed_json = json.loads(cleaned_response_text)
+    categorias = parsed_json.get("categorias") if isinstance(parsed_json, dict) else parsed_json
+    if not isinstance(categorias, list) or len(categorias) != quantidade:
+        raise json.JSONDecodeError(f"Esperadas {quantidade} categorias", cleaned_response_text, 0)
+    return [c if c in CATEGORIAS_VALIDAS else "outros" for c in categorias]
 
-    Agora, crie a resposta para a situação atual:
+async def classify_categories_async(descricoes: list[str], usuario_id: str | None = None) -> list[str] | None:
+    """
+    Classifica um lote de descrições de extrato em uma única chamada ao Gemini.
+    Retorna as categorias na mesma ordem das descrições, ou None em caso de falha.
     """
+    if not descricoes:
+        return []
+    prompt = _build_categorization_prompt(descricoes)
     try:
-        response = model_text.generate_content(prompt) # Usando o modelo para texto puro
-        return response.text.strip()
+        response = await _generate_content_async(TAREFA_CATEGORIZATION, prompt, "classify_categories", usuario_id)
+        return _parse_categorization_response(response, len(descricoes))
+    except json.JSONDecodeError as e:
+        print(f"Erro ao decodificar JSON do Gemini (categorias em lote): {e}")
+        metrics.inc("gastaai_llm_falhas_total", funcao="classify_categories", motivo="json_invalido")
+        return None
+    except (FilaCheiaError, LLMIndisponivelError):
+        raise
     except Exception as e:
-        print(f"Erro na chamada da API Gemini (resposta conversacional): {e}")
-        return "Puxa, não consegui pensar numa resposta legal agora. Mas os dados são: " + data_summary
+        print(f"Erro na chamada da API Gemini (categorias em lote): {e}")
+        return None
 
 
 if __name__ == '__main__':
@@ -340,4 +451,7 @@ if __name__ == '__main__':
     query_orig_2 = "viagem para a praia em janeiro"
     data_simples_2 = "Nenhuma transação encontrada para esses critérios."
     convo_resp_2 = generate_conversational_response(query_orig_2, data_simples_2)
-    print(f"Resposta Gerada 2: {convo_resp_2}")
\ No newline at end of file
+    print(f"Resposta Gerada 2: {convo_resp_2}")
+
+    print("\n--- Uso de tokens ---")
+    print(json.dumps(get_token_usage_stats(), indent=2, ensure_ascii=False))
@@ -0,0 +1,182 @@
+import os
+import time
+import random
+import asyncio
+import logging
+import threading
+
+from dotenv import load_dotenv
+
+import metrics
+from llm_backends import LLM_FALLBACK_MODEL_NAME
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+# Tempo máximo de cada tentativa de chamada ao LLM.
+LLM_TIMEOUT_SECONDS = float(os.getenv("LLM_TIMEOUT_SECONDS", "20"))
+# Novas tentativas para erros transitórios (timeout, 429, 5xx), com espera exponencial e jitter.
+LLM_MAX_RETRIES = int(os.getenv("LLM_MAX_RETRIES", "2"))
+LLM_RETRY_BASE_DELAY_SECONDS = float(os.getenv("LLM_RETRY_BASE_DELAY_SECONDS", "0.5"))
+LLM_RETRY_MAX_DELAY_SECONDS = float(os.getenv("LLM_RETRY_MAX_DELAY_SECONDS", "8"))
+# Circuit breaker: falhas transitórias seguidas que abrem o circuito e quanto tempo ele fica aberto.
+LLM_BREAKER_FAILURE_THRESHOLD = int(os.getenv("LLM_BREAKER_FAILURE_THRESHOLD", "5"))
+LLM_BREAKER_RESET_SECONDS = float(os.getenv("LLM_BREAKER_RESET_SECONDS", "30"))
+
+# Códigos HTTP tratados como transitórios; 429 e 503 indicam sobrecarga e ativam o modelo reserva.
+CODIGOS_RETENTAVEIS = {429, 500, 502, 503, 504}
+CODIGOS_SOBRECARGA = {429, 503}
+
+FECHADO = "fechado"
+MEIO_ABERTO = "meio_aberto"
+ABERTO = "aberto"
+_VALOR_ESTADO = {FECHADO: 0, MEIO_ABERTO: 1, ABERTO: 2}
+
+
+class LLMIndisponivelError(Exception):
+    """O provedor de LLM não respondeu: tentativas esgotadas com erros transitórios ou circuito aberto."""
+
+
+class CircuitoAbertoError(LLMIndisponivelError):
+    """Chamada recusada sem tentar, porque o circuito do LLM está aberto."""
+
+
+def _codigo_http(erro: Exception) -> int | None:
+    # As exceções de google.api_core trazem o status HTTP em `code`; o LLMBackendError local também.
+    codigo = getattr(erro, "code", None)
+    return codigo if isinstance(codigo, int) else None
+
+def erro_retentavel(erro: Exception) -> bool:
+    return isinstance(erro, (TimeoutError, asyncio.TimeoutError)) or _codigo_http(erro) in CODIGOS_RETENTAVEIS
+
+def erro_de_sobrecarga(erro: Exception) -> bool:
+    return _codigo_http(erro) in CODIGOS_SOBRECARGA
+
+def atraso_backoff(tentativa: int) -> float:
+    """Espera antes da tentativa seguinte: exponencial com jitter completo (0 até base * 2^tentativa)."""
+    return random.uniform(0, min(LLM_RETRY_MAX_DELAY_SECONDS, LLM_RETRY_BASE_DELAY_SECONDS * 2 ** tentativa))
+
+
+class CircuitBreaker:
+    """
+    Circuito fechado: as chamadas passam normalmente. Após `limite_falhas` falhas transitórias seguidas
+    ele abre e recusa chamadas por `tempo_reabertura` segundos; depois disso fica meio aberto e deixa
+    passar uma única chamada de teste, que fecha o circuito se der certo ou o reabre se falhar.
+    """
+
+    def __init__(self, limite_falhas: int = LLM_BREAKER_FAILURE_THRESHOLD, tempo_reabertura: float = LLM_BREAKER_RESET_SECONDS):
+        self.limite_falhas = limite_falhas
+        self.tempo_reabertura = tempo_reabertura
+        self.estado = FECHADO
+        self.falhas_seguidas = 0
+        self._aberto_em = 0.0
+        self._teste_em_andamento = False
+        self._lock = threading.Lock()
+        metrics.set_gauge("gastaai_llm_circuito_estado", _VALOR_ESTADO[FECHADO])
+
+    def _mudar_estado(self, novo_estado: str):
+        if novo_estado == self.estado:
+            return
+        log = logger.info if novo_estado == FECHADO else logger.warning
+        log(f"Circuito do LLM: {self.estado} -> {novo_estado} ({self.falhas_seguidas} falhas seguidas).")
+        self.estado = novo_estado
+        metrics.set_gauge("gastaai_llm_circuito_estado", _VALOR_ESTADO[novo_estado])
+        metrics.inc("gastaai_llm_circuito_transicoes_total", estado=novo_estado)
+
+    def permitir(self) -> bool:
+        """True se a chamada pode seguir para o provedor."""
+        with self._lock:
+            if self.estado == ABERTO and time.monotonic() - self._aberto_em >= self.tempo_reabertura:
+                self._mudar_estado(MEIO_ABERTO)
+            if self.estado == FECHADO:
+                return True
+            if self.estado == MEIO_ABERTO and not self._teste_em_andamento:
+                self._teste_em_andamento = True
+                return True
+            return False
+
+    def registrar_sucesso(self):
+        with self._lock:
+            self.falhas_seguidas = 0
+            self._teste_em_andamento = False
+            self._mudar_estado(FECHADO)
+
+    def registrar_falha(self):
+        with self._lock:
+            self.falhas_seguidas += 1
+            if self.estado == MEIO_ABERTO or self.falhas_seguidas >= self.limite_falhas:
+                self._aberto_em = time.monotonic()
+                self._teste_em_andamento = False
+                self._mudar_estado(ABERTO)
+
+    def liberar_teste(self):
+        """Encerra uma chamada de teste que terminou sem dizer nada sobre o provedor (ex: erro não transitório)."""
+        with self._lock:
+            self._teste_em_andamento = False
+
+
+circuito_llm = CircuitBreaker()
+
+
+def _tratar_falha(erro: Exception, tentativa: int, funcao: str) -> bool:
+    """Registra a falha da tentativa. Retorna True se deve tentar de novo com o modelo reserva."""
+    if not erro_retentavel(erro):
+        circuito_llm.liberar_teste()
+        metrics.inc("gastaai_llm_falhas_total", funcao=funcao, motivo="erro_api")
+        raise erro
+    circuito_llm.registrar_falha()
+    motivo = "timeout" if isinstance(erro, (TimeoutError, asyncio.TimeoutError)) else "erro_transitorio"
+    metrics.inc("gastaai_llm_falhas_total", funcao=funcao, motivo=motivo)
+    if tentativa >= LLM_MAX_RETRIES or circuito_llm.estado == ABERTO:
+        raise LLMIndisponivelError(f"LLM indisponível após {tentativa + 1} tentativa(s) ({funcao}): {erro!r}") from erro
+    logger.warning(f"Tentativa {tentativa + 1} de {funcao} falhou ({erro!r}); tentando de novo.")
+    metrics.inc("gastaai_llm_retentativas_total", funcao=funcao)
+    return bool(LLM_FALLBACK_MODEL_NAME) and erro_de_sobrecarga(erro)
+
+def _verificar_circuito(funcao: str):
+    if not circuito_llm.permitir():
+        metrics.inc("gastaai_llm_falhas_total", funcao=funcao, motivo="circuito_aberto")
+        raise CircuitoAbertoError(f"Circuito do LLM aberto; chamada de {funcao} recusada.")
+
+def chamar_com_resiliencia(chamada, funcao: str):
+    """
+    Executa `chamada(usar_fallback, timeout)` com timeout, novas tentativas e circuit breaker.
+    Depois de um erro de sobrecarga (429/503), as tentativas seguintes usam LLM_FALLBACK_MODEL_NAME.
+    """
+    _verificar_circuito(funcao)
+    usar_fallback = False
+    for tentativa in range(LLM_MAX_RETRIES + 1):
+        try:
+            with metrics.medir("gastaai_llm_request_seconds", funcao=funcao):
+                resposta = chamada(usar_fallback, LLM_TIMEOUT_SECONDS)
+        except Exception as e:
+            trocar_modelo = _tratar_falha(e, tentativa, funcao)
+            usar_fallback = usar_fallback or trocar_modelo
+            time.sleep(atraso_backoff(tentativa))
+            continue
+        circuito_llm.registrar_sucesso()
+        if usar_fallback:
+            metrics.inc("gastaai_llm_fallback_total", funcao=funcao)
+        return resposta
+
+async def chamar_com_resiliencia_async(chamada, funcao: str):
+    """Versão assíncrona de chamar_com_resiliencia: `chamada(usar_fallback, timeout)` retorna uma corrotina."""
+    _verificar_circuito(funcao)
+    usar_fallback = False
+    for tentativa in range(LLM_MAX_RETRIES + 1):
+        try:
+            with metrics.medir("gastaai_llm_request_seconds", funcao=funcao):
+                resposta = await asyncio.wait_for(chamada(usar_fallback, LLM_TIMEOUT_SECONDS), LLM_TIMEOUT_SECONDS)
+        except asyncio.CancelledError:
+            circuito_llm.liberar_teste()
+            raise
+        except Exception as e:
+            trocar_modelo = _tratar_falha(e, tentativa, funcao)
+            usar_fallback = usar_fallback or trocar_modelo
+            await asyncio.sleep(atraso_backoff(tentativa))
+            continue
+        circuito_llm.registrar_sucesso()
+        if usar_fallback:
+            metrics.inc("gastaai_llm_fallback_total", funcao=funcao)
+        return resposta
@@ -0,0 +1,120 @@
+import os
+import time
+import asyncio
+import logging
+from collections import OrderedDict, deque
+
+from dotenv import load_dotenv
+
+import metrics
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+# Máximo de chamadas ao LLM em andamento ao mesmo tempo, somando todos os usuários (ajuste à cota do Gemini).
+LLM_MAX_CONCURRENCY = int(os.getenv("LLM_MAX_CONCURRENCY", "4"))
+# Máximo de chamadas de um mesmo usuário aguardando vaga; acima disso a chamada é recusada.
+LLM_MAX_FILA_POR_USUARIO = int(os.getenv("LLM_MAX_FILA_POR_USUARIO", "20"))
+
+_ANONIMO = "_anonimo"
+
+
+class FilaCheiaError(Exception):
+    """O usuário já tem LLM_MAX_FILA_POR_USUARIO chamadas aguardando na fila."""
+
+
+class EscalonadorJusto:
+    """
+    Fila justa na frente das chamadas ao LLM: cada usuário tem sua própria fila e as vagas
+    (até `max_em_voo` chamadas simultâneas) são distribuídas em rodízio entre os usuários com
+    chamadas pendentes. Assim, quem dispara muitas chamadas de uma vez não atrasa os demais.
+    Deve ser usado sempre a partir do mesmo event loop.
+    """
+
+    def __init__(self, max_em_voo: int = LLM_MAX_CONCURRENCY, max_fila_por_usuario: int = LLM_MAX_FILA_POR_USUARIO):
+        self.max_em_voo = max_em_voo
+        self.max_fila_por_usuario = max_fila_por_usuario
+        self._filas = OrderedDict()  # usuario_id -> deque de futures; a ordem é a do rodízio
+        self._em_voo = 0
+        self.rejeitadas = 0
+        self.atendidas = 0
+        self.espera_total_s = 0.0
+        self.espera_maxima_s = 0.0
+
+    def profundidade(self, usuario_id: str | None = None) -> int:
+        """Chamadas aguardando vaga: de um usuário ou de todos."""
+        if usuario_id is not None:
+            return len(self._filas.get(usuario_id, ()))
+        return sum(len(fila) for fila in self._filas.values())
+
+    async def executar(self, usuario_id: str | None, funcao_async):
+        """
+        Aguarda a vez do usuário e executa `funcao_async()` (uma função sem argumentos que retorna uma corrotina).
+        Levanta FilaCheiaError se a fila do usuário estiver cheia.
+        """
+        usuario_id = usuario_id or _ANONIMO
+        fila = self._filas.get(usuario_id)
+        if fila is not None and len(fila) >= self.max_fila_por_usuario:
+            self.rejeitadas += 1
+            metrics.inc("gastaai_llm_fila_rejeicoes_total")
+            raise FilaCheiaError(f"Fila do usuário {usuario_id} cheia ({len(fila)} chamadas aguardando).")
+
+        vez = asyncio.get_running_loop().create_future()
+        enfileirada_em = time.perf_counter()
+        if fila is None:
+            fila = self._filas[usuario_id] = deque()
+        fila.append(vez)
+        self._despachar()
+
+        try:
+            await vez
+        except asyncio.CancelledError:
+            if vez.done() and not vez.cancelled():
+                self._liberar()  # a vaga foi concedida, mas quem esperava desistiu
+            else:
+                vez.cancel()  # continua na fila e é descartada pelo _despachar
+            raise
+
+        espera = time.perf_counter() - enfileirada_em
+        self.atendidas += 1
+        self.espera_total_s += espera
+        self.espera_maxima_s = max(self.espera_maxima_s, espera)
+        metrics.observe("gastaai_llm_fila_espera_seconds", espera)
+        try:
+            return await funcao_async()
+        finally:
+            self._liberar()
+
+    def _liberar(self):
+        self._em_voo -= 1
+        self._despachar()
+
+    def _despachar(self):
+        """Concede vagas livres em rodízio: o primeiro usuário da ordem é atendido e vai para o fim."""
+        while self._em_voo < self.max_em_voo and self._filas:
+            usuario_id, fila = next(iter(self._filas.items()))
+            vez = fila.popleft()
+            if fila:
+                self._filas.move_to_end(usuario_id)
+            else:
+                del self._filas[usuario_id]
+            if vez.cancelled():
+                continue
+            self._em_voo += 1
+            vez.set_result(None)
+        metrics.set_gauge("gastaai_llm_fila_profundidade", self.profundidade())
+        metrics.set_gauge("gastaai_llm_em_voo", self._em_voo)
+
+    def stats(self) -> dict:
+        return {
+            "em_voo": self._em_voo,
+            "max_em_voo": self.max_em_voo,
+            "profundidade_fila": self.profundidade(),
+            "usuarios_na_fila": len(self._filas),
+            "maior_fila": max((len(f) for f in self._filas.values()), default=0),
+            "atendidas": self.atendidas,
+            "rejeitadas": self.rejeitadas,
+            "espera_media_ms": self.espera_total_s / self.atendidas * 1000 if self.atendidas else 0.0,
+            "espera_maxima_ms": self.espera_maxima_s * 1000,
+        }
@@ -1,22 +1,79 @@
 import os
+import asyncio
 import logging
+import weakref
+import functools
+import tempfile
 from datetime import datetime, timezone
 from dotenv import load_dotenv
-from datetime import datetime, timezone
+from datetime import datetime, timedelta, timezone
 
-from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup 
+from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup, InputFile
+from telegram.request import HTTPXRequest
 from telegram.ext import Application, CommandHandler, MessageHandler, filters, ContextTypes, ConversationHandler, CallbackQueryHandler
 
-from llm_client import get_financial_details_from_llm, get_query_params_from_natural_language, generate_conversational_response
-from database import SessionLocal, init_db, add_transaction, get_saldo, get_transacoes_por_tipo, query_dynamic_transactions
-from utils import format_currency
-
-ASK_STAT_QUERY, PROCESS_STAT_QUERY = range(2)
+from llm_client import get_financial_details_from_llm_async, get_query_params_from_natural_language_async, generate_conversational_response_async, is_token_budget_exhausted_async, escalonador_llm, query_params_cache
+from llm_scheduler import FilaCheiaError
+from llm_resiliencia import LLMIndisponivelError, circuito_llm
+from llm_backends import LLM_BACKEND, interpretar_pergunta
+from fast_parser import parse_transaction_message, analisar_mensagem_multipla, get_fast_path_stats
+from response_templates import render_stat_response
+from importador import importar_extrato, ErroImportacao
+from database import AsyncSessionLocal, init_db, add_transactions_bulk_async, get_saldo_async, save_pending_confirmation_async, pop_pending_confirmation_async, purge_expired_confirmations_async, get_transacoes_por_tipo_async, query_dynamic_transactions_async, OPERACOES_AGRUPADAS, export_transactions_async, get_maiores_consumidores_async, get_versao_dados_async
+from graficos import TIPOS_GRAFICO, CacheGraficos, parametros_grafico, chave_grafico, renderizar_grafico_async, aquecer_processos, encerrar_processos
+from utils import format_currency, parse_periodo_descricao
+import metrics
+from metrics import medir_latencia, iniciar_servidor_metricas, METRICS_DUMP_INTERVAL_SECONDS
+
+# Exportações até esse tamanho ficam em memória; acima disso vão para um arquivo temporário em disco.
+EXPORT_SPOOL_MAX_BYTES = int(os.getenv("EXPORT_SPOOL_MAX_BYTES", str(5 * 1024 * 1024)))
+FORMATOS_EXPORTACAO = {"csv": "csv", "jsonl": "jsonl", "json": "jsonl"}
+
+ASK_STAT_QUERY, PROCESS_STAT_QUERY, PROCESS_IMPORT_FILE = range(3)
 
 TRANSACTION_CALLBACK_PREFIX = "trxconfirm"
+PAGINACAO_CALLBACK_PREFIX = "pag"
+TIPOS_PAGINACAO = {"saída": "s", "entrada": "e"}
+EPOCH_UTC = datetime(1970, 1, 1, tzinfo=timezone.utc)
 
 load_dotenv()
 TELEGRAM_BOT_TOKEN = os.getenv("TELEGRAM_BOT_TOKEN")
+PENDING_SWEEP_INTERVAL_SECONDS = int(os.getenv("PENDING_SWEEP_INTERVAL_SECONDS", "600"))
+# Transações por página no /gastos e /entradas.
+TRANSACOES_POR_PAGINA = int(os.getenv("TRANSACOES_POR_PAGINA", "5"))
+# Transações de uma lista do /estatisticas incluídas no resumo enviado ao LLM (as demais entram só na contagem).
+STATS_PREVIEW_LIMIT = 3
+# Grupos (categorias, meses ou dias) incluídos no resumo enviado ao LLM.
+STATS_MAX_GRUPOS_RESUMO = 31
+
+# Modo de execução: "polling" (padrão) ou "webhook" (servidor HTTP embutido do python-telegram-bot).
+BOT_MODE = os.getenv("BOT_MODE", "polling").lower()
+WEBHOOK_URL = os.getenv("WEBHOOK_URL")  # URL pública (https) que o Telegram vai chamar, sem o caminho
+WEBHOOK_PATH = os.getenv("WEBHOOK_PATH", "telegram")
+WEBHOOK_LISTEN = os.getenv("WEBHOOK_LISTEN", "0.0.0.0")
+WEBHOOK_PORT = int(os.getenv("WEBHOOK_PORT", "8443"))
+WEBHOOK_SECRET = os.getenv("WEBHOOK_SECRET")
+# Máximo de updates processados ao mesmo tempo (1 = sequencial).
+CONCURRENT_UPDATES = int(os.getenv("CONCURRENT_UPDATES", "16"))
+# Máximo de updates de um mesmo usuário em andamento ou aguardando o anterior terminar; os excedentes são recusados.
+# Cada update aguardando ocupa uma das CONCURRENT_UPDATES vagas do PTB, então o limite fica bem abaixo dele
+# (padrão: um quarto das vagas) para que um único usuário não trave os demais.
+MAX_UPDATES_PENDENTES_POR_USUARIO = int(os.getenv("MAX_UPDATES_PENDENTES_POR_USUARIO", str(max(1, CONCURRENT_UPDATES // 4))))
+# IDs do Telegram (separados por vírgula) que podem usar os comandos administrativos, como /consumo.
+ADMIN_USER_IDS = {u.strip() for u in os.getenv("ADMIN_USER_IDS", "").split(",") if u.strip()}
+# Preço em dólares por milhão de tokens, usado só para estimar custo no /consumo.
+LLM_PRICE_PROMPT_PER_MILLION = float(os.getenv("LLM_PRICE_PROMPT_PER_MILLION", "0.075"))
+LLM_PRICE_COMPLETION_PER_MILLION = float(os.getenv("LLM_PRICE_COMPLETION_PER_MILLION", "0.30"))
+
+MENSAGEM_ORCAMENTO_ESGOTADO = (
+    "Você atingiu o limite diário de uso da inteligência artificial. 😅\n"
+    "Até amanhã, consigo entender mensagens simples como 'gastei 20 no mercado' ou 'uber 18'."
+)
+MENSAGEM_FILA_CHEIA = "Calma! ⏳ Ainda estou processando suas mensagens anteriores. Aguarde um pouco e envie de novo."
+MENSAGEM_LLM_INDISPONIVEL = (
+    "A inteligência artificial está instável no momento. 😕\n"
+    "Enquanto isso, consigo entender mensagens simples como 'gastei 20 no mercado' ou 'uber 18'."
+)
 
 logging.basicConfig(
     format="%(asctime)s - %(name)s - %(levelname)s - %(message)s", level=logging.INFO
@@ -25,6 +82,57 @@ logger = logging.getLogger(__name__)
 
 init_db()
 
+# Um lock por usuário: com concurrent_updates, updates de usuários diferentes rodam em paralelo,
+# mas os de um mesmo usuário são processados em ordem (evita corrida na confirmação pendente).
+_user_locks = weakref.WeakValueDictionary()
+# Updates de cada usuário esperando pelo lock (ou em execução).
+_updates_pendentes = {}
+# Imagens do /grafico já desenhadas, por usuário, tipo, período e versão dos dados.
+cache_graficos = CacheGraficos()
+
+async def _responder_fila_cheia(update: Update) -> None:
+    if update.callback_query:
+        await update.callback_query.answer(MENSAGEM_FILA_CHEIA)
+    elif update.effective_message:
+        await update.effective_message.reply_text(MENSAGEM_FILA_CHEIA)
+
+def serializar_por_usuario(handler):
+    """
+    Decorator que executa o handler com o lock do usuário do update.
+    Se o usuário já tiver MAX_UPDATES_PENDENTES_POR_USUARIO updates na fila, o novo é recusado com um aviso.
+    """
+    @functools.wraps(handler)
+    async def wrapper(update: Update, context: ContextTypes.DEFAULT_TYPE):
+        user = update.effective_user
+        if user is None:
+            return await handler(update, context)
+        if _updates_pendentes.get(user.id, 0) >= MAX_UPDATES_PENDENTES_POR_USUARIO:
+            logger.warning(f"Usuário {user.id} com {_updates_pendentes[user.id]} updates pendentes; update recusado.")
+            metrics.inc("gastaai_updates_rejeitados_total")
+            await _responder_fila_cheia(update)
+            return None
+        lock = _user_locks.get(user.id)
+        if lock is None:
+            lock = asyncio.Lock()
+            _user_locks[user.id] = lock
+        _updates_pendentes[user.id] = _updates_pendentes.get(user.id, 0) + 1
+        try:
+            async with lock:
+                return await handler(update, context)
+        finally:
+            _updates_pendentes[user.id] -= 1
+            if not _updates_pendentes[user.id]:
+                del _updates_pendentes[user.id]
+    return wrapper
+
+class HTTPXRequestComMetricas(HTTPXRequest):
+    """HTTPXRequest que registra a latência de cada chamada à API do Telegram (sendMessage, editMessageText...)."""
+
+    async def do_request(self, url, method, request_data=None, **kwargs):
+        with metrics.medir("gastaai_telegram_api_seconds", metodo=url.rsplit("/", 1)[-1]):
+            return await super().do_request(url, method, request_data, **kwargs)
+
+@medir_latencia("gastaai_handler_seconds", label="handler")
 async def start(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     user = update.effective_user
     start_message = (
@@ -40,14 +148,61 @@ async def start(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
         "/gastos - Lista suas últimas despesas\n"
         "/entradas - Lista suas últimas receitas\n"
         "/estatisticas - Faça perguntas mais detalhadas sobre suas finanças\n"
+        "/importar - Importa um extrato bancário (CSV ou OFX)\n"
+        "/exportar - Exporta todas as suas transações (CSV ou JSON Lines)\n"
+        "/grafico - Gráfico dos seus gastos (categorias, mensal ou diario)\n"
         "/ajuda - Relembra os comandos e como usar o bot\n\n"
         "Quando quiser, é só me mandar uma transação ou usar um dos comandos acima. Vamos juntos cuidar bem do seu dinheiro! 💰"
     )   
     await update.message.reply_text(start_message)
 
+@medir_latencia("gastaai_handler_seconds", label="handler")
 async def help_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     await start(update, context)
 
+def _data_hora_local_display(data_hora: datetime, formato: str) -> str:
+    """Formata a data/hora no fuso de São Paulo, ou em UTC se o fuso não estiver disponível."""
+    try:
+        from zoneinfo import ZoneInfo
+        return data_hora.astimezone(ZoneInfo("America/Sao_Paulo")).strftime(formato)
+    except Exception:
+        return data_hora.strftime(formato + " (UTC)")
+
+def _formatar_lista_transacoes(transacoes: list[dict]) -> str:
+    """Lista numerada usada nas confirmações com mais de uma transação."""
+    linhas = [
+        f"{i}. {t['tipo'].capitalize()} de **{format_currency(t['valor'])}** - {t['categoria'].capitalize()} ({t['descricao']}) - {_data_hora_local_display(t['data_hora'], '%d/%m às %H:%M')}"
+        for i, t in enumerate(transacoes, start=1)
+    ]
+    linhas.append("")
+    for tipo, rotulo in (("saída", "Total de saídas"), ("entrada", "Total de entradas")):
+        valores = [t["valor"] for t in transacoes if t["tipo"] == tipo]
+        if valores:
+            linhas.append(f"{rotulo}: {format_currency(sum(valores))}")
+    return "\n".join(linhas)
+
+def _resumir_grupos(operacao: str, grupos: list[dict]) -> str:
+    """Resumo em texto de agrupar_por_categoria, serie_mensal e serie_diaria para o LLM redigir a resposta."""
+    separar_tipos = len({g["tipo"] for g in grupos}) > 1
+    titulo = {"agrupar_por_categoria": "Totais por categoria", "serie_mensal": "Totais por mês", "serie_diaria": "Totais por dia"}[operacao]
+    itens = []
+    for grupo in grupos[:STATS_MAX_GRUPOS_RESUMO]:
+        chave = grupo["chave"] or "sem categoria"
+        if operacao != "agrupar_por_categoria":
+            chave = "/".join(reversed(chave.split("-")))  # "2024-05" -> "05/2024", "2024-05-03" -> "03/05/2024"
+        tipo = f" ({'saídas' if grupo['tipo'] == 'saída' else 'entradas'})" if separar_tipos else ""
+        itens.append(f"{chave}{tipo}: {format_currency(grupo['total'])} ({grupo['contagem']} registros)")
+    resumo = f"{titulo}: " + "; ".join(itens) + "."
+    if len(grupos) > STATS_MAX_GRUPOS_RESUMO:
+        resumo += f" E mais {len(grupos) - STATS_MAX_GRUPOS_RESUMO} grupos."
+    for tipo, rotulo in (("saída", "Total de saídas"), ("entrada", "Total de entradas")):
+        totais = [g["total"] for g in grupos if g["tipo"] == tipo]
+        if totais:
+            resumo += f" {rotulo}: {format_currency(sum(totais))}."
+    return resumo
+
+@medir_latencia("gastaai_handler_seconds", label="handler")
+@serializar_por_usuario
 async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     message_text = update.message.text
     user_id = str(update.effective_user.id)
@@ -57,85 +212,99 @@ async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
     logger.info(f"Recebida mensagem de {user_id} (Msg ID: {original_message_id}): '{message_text}'")
     await context.bot.send_chat_action(chat_id=chat_id, action="typing")
 
-    extracted_data = get_financial_details_from_llm(message_text)
-
-    if not extracted_data:
+    extracted_list = parse_transaction_message(message_text)
+    if extracted_list is None:
+        if await is_token_budget_exhausted_async(user_id):
+            # Sem orçamento para o LLM: aceita o interpretador local mesmo com confiança baixa,
+            # já que o usuário ainda confirma os dados antes de salvar.
+            extracted_list, _ = analisar_mensagem_multipla(message_text)
+            if not extracted_list:
+                await update.message.reply_text(MENSAGEM_ORCAMENTO_ESGOTADO)
+                return
+        else:
+            try:
+                extracted_list = await get_financial_details_from_llm_async(message_text, user_id)
+            except (FilaCheiaError, LLMIndisponivelError) as e:
+                # Fila do LLM cheia para este usuário ou Gemini fora do ar: mesma saída do orçamento esgotado.
+                logger.warning(f"LLM indisponível para {user_id} ({e}); usando o interpretador local.")
+                extracted_list, _ = analisar_mensagem_multipla(message_text)
+                if not extracted_list:
+                    await update.message.reply_text(MENSAGEM_FILA_CHEIA if isinstance(e, FilaCheiaError) else MENSAGEM_LLM_INDISPONIVEL)
+                    return
+    fast_path_stats = get_fast_path_stats()
+    logger.info(f"Caminho rápido: {fast_path_stats['hits']} hits / {fast_path_stats['misses']} misses (taxa {fast_path_stats['hit_rate']:.0%}).")
+
+    if not extracted_list:
         await update.message.reply_text(
             "Não foi possível processar sua mensagem. Por favor, tente descrever a transação de outra forma. Exemplo: 'Gastei 50 em alimentação'."
         )
         return
 
     try:
-        tipo = extracted_data.get("tipo")
-        valor_str = extracted_data.get("valor")
-        categoria = extracted_data.get("categoria", "outros")
-        descricao = extracted_data.get("descricao", "N/A")
-        data_hora_inferida_str = extracted_data.get("data_hora_inferida")
-
-        if not tipo or tipo not in ["entrada", "saída"]:
-            await update.message.reply_text(f"Não consegui identificar se a transação é uma entrada ou saída. 🤔\nDados recebidos: {extracted_data}")
-            return
-        if valor_str is None:
-            await update.message.reply_text(f"O valor da transação não foi compreendido. Por favor, informe o valor. 😕\nDados: {extracted_data}")
-            return
-        
-        try:
-            valor = float(valor_str)
-            if valor <= 0:
-                raise ValueError("O valor da transação deve ser positivo.")
-        except ValueError as e:
-            await update.message.reply_text(f"O valor informado '{valor_str}' não é válido. Por favor, verifique. ({e})")
-            return
+        transacoes = []
+        for indice, extracted_data in enumerate(extracted_list, start=1):
+            prefixo_item = f"Transação {indice}: " if len(extracted_list) > 1 else ""
+            tipo = extracted_data.get("tipo")
+            valor_str = extracted_data.get("valor")
+            categoria = extracted_data.get("categoria") or "outros"
+            descricao = extracted_data.get("descricao") or "N/A"
+            data_hora_inferida_str = extracted_data.get("data_hora_inferida")
+
+            if not tipo or tipo not in ["entrada", "saída"]:
+                await update.message.reply_text(f"{prefixo_item}Não consegui identificar se a transação é uma entrada ou saída. 🤔\nDados recebidos: {extracted_data}")
+                return
+            if valor_str is None:
+                await update.message.reply_text(f"{prefixo_item}O valor da transação não foi compreendido. Por favor, informe o valor. 😕\nDados: {extracted_data}")
+                return
 
-        data_hora_transacao = None
-        if data_hora_inferida_str:
             try:
-                data_hora_transacao = datetime.fromisoformat(data_hora_inferida_str)
-                if data_hora_transacao.tzinfo is None:
-                    data_hora_transacao = data_hora_transacao.replace(tzinfo=timezone.utc)
-                else:
-                     data_hora_transacao = data_hora_transacao.astimezone(timezone.utc)
-
+                valor = float(valor_str)
+                if valor <= 0:
+                    raise ValueError("O valor da transação deve ser positivo.")
             except ValueError as e:
-                logger.error(f"Erro ao parsear data_hora_inferida_str '{data_hora_inferida_str}': {e}")
-        
-        if data_hora_transacao is None:
-             data_hora_transacao = datetime.now(timezone.utc)
-
-        data_hora_local_display = None
-        try:
-            from zoneinfo import ZoneInfo
-            try:
-                sao_paulo_tz = ZoneInfo("America/Sao_Paulo")
-                data_hora_local_display = data_hora_transacao.astimezone(sao_paulo_tz).strftime("%d/%m/%Y às %H:%M")
-            except Exception:
-                 logger.warning("zoneinfo.ZoneInfo não disponível ou timezone inválida, usando UTC para exibição na confirmação.")
-                 data_hora_local_display = data_hora_transacao.strftime("%d/%m/%Y às %H:%M (UTC)")
-        except ImportError:
-            logger.warning("Módulo 'zoneinfo' não encontrado, usando UTC para exibição na confirmação.")
-            data_hora_local_display = data_hora_transacao.strftime("%d/%m/%Y às %H:%M (UTC)")
-
-
-        confirmation_message_text = (
-            f"Por favor, confirme os detalhes da transação: 🤔\n\n"
-            f"Tipo: **{tipo.capitalize()}**\n"
-            f"Valor: **{format_currency(valor)}**\n"
-            f"Categoria: **{categoria.capitalize()}** ({descricao})\n"
-            f"Data/Hora: {data_hora_local_display}"
-        )
+                await update.message.reply_text(f"{prefixo_item}O valor informado '{valor_str}' não é válido. Por favor, verifique. ({e})")
+                return
 
-        stored_data_key = f"{TRANSACTION_CALLBACK_PREFIX}_data_{original_message_id}"
-        context.user_data.pop(stored_data_key, None) 
+            data_hora_transacao = None
+            if data_hora_inferida_str:
+                try:
+                    data_hora_transacao = datetime.fromisoformat(data_hora_inferida_str)
+                    if data_hora_transacao.tzinfo is None:
+                        data_hora_transacao = data_hora_transacao.replace(tzinfo=timezone.utc)
+                    else:
+                         data_hora_transacao = data_hora_transacao.astimezone(timezone.utc)
+
+                except ValueError as e:
+                    logger.error(f"Erro ao parsear data_hora_inferida_str '{data_hora_inferida_str}': {e}")
+
+            if data_hora_transacao is None:
+                 data_hora_transacao = datetime.now(timezone.utc)
+
+            transacoes.append({
+                "tipo": tipo,
+                "valor": valor,
+                "categoria": categoria,
+                "descricao": descricao,
+                "data_hora": data_hora_transacao
+            })
+
+        if len(transacoes) == 1:
+            transacao = transacoes[0]
+            confirmation_message_text = (
+                f"Por favor, confirme os detalhes da transação: 🤔\n\n"
+                f"Tipo: **{transacao['tipo'].capitalize()}**\n"
+                f"Valor: **{format_currency(transacao['valor'])}**\n"
+                f"Categoria: **{transacao['categoria'].capitalize()}** ({transacao['descricao']})\n"
+                f"Data/Hora: {_data_hora_local_display(transacao['data_hora'], '%d/%m/%Y às %H:%M')}"
+            )
+        else:
+            confirmation_message_text = (
+                f"Por favor, confirme as {len(transacoes)} transações: 🤔\n\n"
+                + _formatar_lista_transacoes(transacoes)
+            )
 
-        context.user_data[stored_data_key] = {
-            "user_id": user_id,
-            "tipo": tipo,
-            "valor": valor,
-            "categoria": categoria,
-            "descricao": descricao,
-            "data_hora": data_hora_transacao
-        }
-        logger.info(f"Dados da transação armazenados temporariamente para confirmação (key: {stored_data_key})")
+        await save_pending_confirmation_async(AsyncSessionLocal(), user_id, original_message_id, transacoes)
+        logger.info(f"{len(transacoes)} transação(ões) armazenada(s) para confirmação (usuário {user_id}, msg {original_message_id})")
 
         keyboard = [
             [
@@ -159,6 +328,8 @@ async def handle_message(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
     finally:
         pass
 
+@medir_latencia("gastaai_handler_seconds", label="handler")
+@serializar_por_usuario
 async def handle_transaction_confirmation(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """Processa o callback dos botões de confirmação da transação."""
     query = update.callback_query
@@ -193,12 +364,12 @@ async def handle_transaction_confirmation(update: Update, context: ContextTypes.
               logger.error(f"Erro ao enviar mensagem de erro para callback data com ID inválido: {e_send}")
          return
 
-    stored_data_key = f"{TRANSACTION_CALLBACK_PREFIX}_data_{original_message_id}"
-    transaction_data = context.user_data.pop(stored_data_key, None)
+    transacoes = await pop_pending_confirmation_async(AsyncSessionLocal(), user_id, original_message_id)
 
 
-    if transaction_data is None:
-        logger.warning(f"Dados da transação não encontrados para a chave {stored_data_key}. Possivelmente expirou ou bot reiniciou.")
+    if transacoes is None:
+        logger.warning(f"Confirmação pendente não encontrada para usuário {user_id}, msg {original_message_id}. Expirou ou já foi respondida.")
+        metrics.inc("gastaai_confirmacoes_expiradas_total", origem="clique")
 
         try:
              await query.edit_message_text(
@@ -212,51 +383,32 @@ async def handle_transaction_confirmation(update: Update, context: ContextTypes.
         return
 
 
-    tipo = transaction_data["tipo"]
-    valor = transaction_data["valor"]
-    categoria = transaction_data["categoria"]
-    descricao = transaction_data["descricao"]
-    data_hora = transaction_data["data_hora"]
-
     if action == "save":
 
-        db_session = SessionLocal()
+        db_session = AsyncSessionLocal()
         try:
-            add_transaction(
-                db_session=db_session,
-                usuario_id=user_id,
-                tipo=tipo,
-                valor=valor,
-                categoria=categoria,
-                descricao=descricao,
-                data_hora=data_hora
-            )
+            # Todas as transações da mensagem são gravadas com um único INSERT e um único commit.
+            await add_transactions_bulk_async(db_session, user_id, transacoes)
 
             try:
-                data_hora_local_display = None
-                try:
-                    from zoneinfo import ZoneInfo
-                    try:
-                        sao_paulo_tz = ZoneInfo("America/Sao_Paulo")
-                        data_hora_local_display = data_hora.astimezone(sao_paulo_tz).strftime("%d/%m/%Y às %H:%M")
-                    except Exception:
-                         data_hora_local_display = data_hora.strftime("%d/%m/%Y às %H:%M (UTC)")
-                except ImportError:
-                     data_hora_local_display = data_hora.strftime("%d/%m/%Y às %H:%M (UTC)")
-
+                if len(transacoes) == 1:
+                    transacao = transacoes[0]
+                    texto_salvo = (
+                        f"✅ Transação Salva! ✅\n\n"
+                        f"Tipo: {transacao['tipo'].capitalize()}\n"
+                        f"Valor: {format_currency(transacao['valor'])}\n"
+                        f"Categoria: {transacao['categoria'].capitalize()} ({transacao['descricao']})\n"
+                        f"Data/Hora: {_data_hora_local_display(transacao['data_hora'], '%d/%m/%Y às %H:%M')}"
+                    )
+                else:
+                    texto_salvo = f"✅ {len(transacoes)} Transações Salvas! ✅\n\n" + _formatar_lista_transacoes(transacoes)
 
                 await query.edit_message_text(
-                    text=(
-                        f"✅ Transação Salva! ✅\n\n"
-                        f"Tipo: {tipo.capitalize()}\n"
-                        f"Valor: {format_currency(valor)}\n"
-                        f"Categoria: {categoria.capitalize()} ({descricao})\n"
-                        f"Data/Hora: {data_hora_local_display}"
-                    ),
+                    text=texto_salvo,
                     parse_mode='Markdown',
                     reply_markup=None
                 )
-                logger.info(f"Transação salva para usuário {user_id}.")
+                logger.info(f"{len(transacoes)} transação(ões) salva(s) para usuário {user_id}.")
             except Exception as e:
                  logger.error(f"Erro ao editar mensagem de confirmação salva: {e}")
                  await context.bot.send_message(chat_id=chat_id, text="✅ Transação Salva!")
@@ -273,8 +425,7 @@ async def handle_transaction_confirmation(update: Update, context: ContextTypes.
                  await context.bot.send_message(chat_id=chat_id, text=f"❌ Ocorreu um erro ao tentar salvar a transação: {str(e)}")
 
         finally:
-            if db_session.is_active:
-                db_session.close()
+            await db_session.close()
 
     elif action == "retry":
         try:
@@ -288,67 +439,109 @@ async def handle_transaction_confirmation(update: Update, context: ContextTypes.
              await context.bot.send_message(chat_id=chat_id, text="❌ Transação Cancelada. Por favor, descreva a transação novamente.")
 
 
+@medir_latencia("gastaai_handler_seconds", label="handler")
 async def saldo_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     user_id = str(update.effective_user.id)
-    db_session = SessionLocal()
+    db_session = AsyncSessionLocal()
     try:
-        saldo_atual = get_saldo(db_session, user_id)
+        saldo_atual = await get_saldo_async(db_session, user_id)
         await update.message.reply_text(f"Seu saldo atual é: **{format_currency(saldo_atual)}**", parse_mode='Markdown')
     except Exception as e:
         logger.error(f"Erro ao buscar saldo para {user_id}: {e}")
         await update.message.reply_text("Não foi possível consultar seu saldo no momento. Por favor, tente novamente mais tarde.")
 
+def _cursor_callback_data(tipo_transacao: str, transacao, mais_recentes: bool) -> str:
+    """callback_data dos botões de página: tipo, direção e o cursor (data_hora em microssegundos UTC, id). Cabe nos 64 bytes do Telegram."""
+    data_hora = transacao.data_hora if transacao.data_hora.tzinfo else transacao.data_hora.replace(tzinfo=timezone.utc)
+    micros = (data_hora - EPOCH_UTC) // timedelta(microseconds=1)
+    return f"{PAGINACAO_CALLBACK_PREFIX}_{TIPOS_PAGINACAO[tipo_transacao]}_{'r' if mais_recentes else 'a'}_{micros}_{transacao.id}"
+
+async def _montar_pagina_transacoes(user_id: str, tipo_transacao: str, cursor: tuple | None = None, mais_recentes: bool = False):
+    """
+    Texto e teclado de uma página do /gastos ou /entradas. Busca uma transação a mais que a página
+    para saber se existe página seguinte. Retorna (None, None) se não houver transações.
+    """
+    transacoes = await get_transacoes_por_tipo_async(
+        AsyncSessionLocal(), user_id, tipo_transacao, limit=TRANSACOES_POR_PAGINA + 1, cursor=cursor, mais_recentes=mais_recentes
+    )
+    if mais_recentes:
+        tem_mais_recentes = len(transacoes) > TRANSACOES_POR_PAGINA
+        tem_mais_antigas = True
+        transacoes = transacoes[-TRANSACOES_POR_PAGINA:]
+    else:
+        tem_mais_recentes = cursor is not None
+        tem_mais_antigas = len(transacoes) > TRANSACOES_POR_PAGINA
+        transacoes = transacoes[:TRANSACOES_POR_PAGINA]
+    if not transacoes:
+        return None, None
+
+    nome_plural = "despesas" if tipo_transacao == "saída" else "receitas"
+    if cursor is None:
+        resposta = f"Suas últimas {len(transacoes)} {nome_plural} recentes:\n\n"
+    else:
+        resposta = (
+            f"Suas {nome_plural} de {_data_hora_local_display(transacoes[-1].data_hora.replace(tzinfo=timezone.utc), '%d/%m/%Y')}"
+            f" a {_data_hora_local_display(transacoes[0].data_hora.replace(tzinfo=timezone.utc), '%d/%m/%Y')}:\n\n"
+        )
+    for t in transacoes:
+        data_hora_local_display = _data_hora_local_display(t.data_hora.replace(tzinfo=timezone.utc), "%d/%m às %H:%M")
+        resposta += f"- {t.categoria.capitalize()}: {t.descricao} - {format_currency(t.valor)} - {data_hora_local_display}\n"
+
+    botoes = []
+    if tem_mais_recentes:
+        botoes.append(InlineKeyboardButton("◀ Mais recentes", callback_data=_cursor_callback_data(tipo_transacao, transacoes[0], True)))
+    if tem_mais_antigas:
+        botoes.append(InlineKeyboardButton("Mais antigas ▶", callback_data=_cursor_callback_data(tipo_transacao, transacoes[-1], False)))
+    return resposta, InlineKeyboardMarkup([botoes]) if botoes else None
+
 async def listar_transacoes(update: Update, context: ContextTypes.DEFAULT_TYPE, tipo_transacao: str) -> None:
     user_id = str(update.effective_user.id)
-    db_session = SessionLocal()
+    tipo_str_plural = "despesas recentes" if tipo_transacao == "saída" else "receitas recentes"
     try:
-        transacoes = get_transacoes_por_tipo(db_session, user_id, tipo_transacao, limit=5)
-
-        tipo_str_plural = "transações"
-        emoji = "🧐"
-        if tipo_transacao == "saída":
-            tipo_str_plural = "despesas recentes"
-            emoji = "💸"
-        elif tipo_transacao == "entrada":
-            tipo_str_plural = "receitas recentes"
-            emoji = "🤑"
-
-        if not transacoes:
+        resposta, reply_markup = await _montar_pagina_transacoes(user_id, tipo_transacao)
+        if resposta is None:
+            emoji = "💸" if tipo_transacao == "saída" else "🤑"
             await update.message.reply_text(f"Nenhuma {tipo_str_plural} encontrada para seu usuário. {emoji}")
             return
-
-        resposta = f"Suas últimas {len(transacoes)} {tipo_str_plural}:\n\n"
-
-        for t in transacoes:
-            try:
-                from zoneinfo import ZoneInfo
-                try:
-                    sao_paulo_tz = ZoneInfo("America/Sao_Paulo")
-                    data_hora_local_display = t.data_hora.astimezone(sao_paulo_tz).strftime("%d/%m às %H:%M")
-                except Exception:
-                    logger.warning("zoneinfo.ZoneInfo não disponível ou timezone inválida para exibição de lista, usando UTC.")
-                    data_hora_local_display = t.data_hora.strftime("%d/%m às %H:%M (UTC)")
-            except ImportError:
-                 logger.warning("Módulo 'zoneinfo' não encontrado para exibição de lista, usando UTC.")
-                 data_hora_local_display = t.data_hora.strftime("%d/%m às %H:%M (UTC)")
-
-            resposta += f"- {t.categoria.capitalize()}: {t.descricao} - {format_currency(t.valor)} - {data_hora_local_display}\n"
-
-        await update.message.reply_text(resposta)
+        await update.message.reply_text(resposta, reply_markup=reply_markup)
 
     except Exception as e:
         logger.error(f"Erro ao listar {tipo_transacao}s para {user_id}: {e}")
         await update.message.reply_text(f"Não foi possível listar suas {tipo_str_plural} no momento.")
-    finally:
-        pass
+
+@medir_latencia("gastaai_handler_seconds", label="handler")
+async def handle_paginacao_transacoes(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Callback dos botões ◀ / ▶ do /gastos e /entradas: edita a mensagem com a página vizinha."""
+    query = update.callback_query
+    user_id = str(query.from_user.id)
+    _, tipo_codigo, direcao, micros, transacao_id = query.data.split("_")
+    tipo_transacao = next(tipo for tipo, codigo in TIPOS_PAGINACAO.items() if codigo == tipo_codigo)
+    # As datas são gravadas em UTC sem fuso, então o cursor também vai sem fuso.
+    cursor = ((EPOCH_UTC + timedelta(microseconds=int(micros))).replace(tzinfo=None), int(transacao_id))
+
+    try:
+        resposta, reply_markup = await _montar_pagina_transacoes(user_id, tipo_transacao, cursor, mais_recentes=direcao == "r")
+    except Exception as e:
+        logger.error(f"Erro ao paginar {tipo_transacao}s para {user_id}: {e}")
+        await query.answer("Não foi possível carregar a página agora.")
+        return
+    if resposta is None:
+        await query.answer("Não há mais transações nessa direção.")
+        return
+    await query.answer()
+    await query.edit_message_text(resposta, reply_markup=reply_markup)
 
 
+@medir_latencia("gastaai_handler_seconds", label="handler")
 async def gastos_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     await listar_transacoes(update, context, "saída")
 
+@medir_latencia("gastaai_handler_seconds", label="handler")
 async def entradas_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     await listar_transacoes(update, context, "entrada")
 
+@medir_latencia("gastaai_handler_seconds", label="handler")
+@serializar_por_usuario
 async def estatisticas_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     await update.message.reply_text(
         "Você pode me perguntar sobre as suas entradas e gastos de forma bem natural! Aqui vão alguns exemplos do que você pode escrever:\n\n"
@@ -358,6 +551,8 @@ async def estatisticas_command(update: Update, context: ContextTypes.DEFAULT_TYP
     )
     return PROCESS_STAT_QUERY
 
+@medir_latencia("gastaai_handler_seconds", label="handler")
+@serializar_por_usuario
 async def handle_stat_query(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     user_query = update.message.text
     user_id = str(update.effective_user.id)
@@ -366,7 +561,16 @@ async def handle_stat_query(update: Update, context: ContextTypes.DEFAULT_TYPE)
     logger.info(f"Recebida query de estatísticas de {user_id}: '{user_query}'")
     await context.bot.send_chat_action(chat_id=chat_id, action="typing")
 
-    params_from_llm = get_query_params_from_natural_language(user_query)
+    sem_llm = await is_token_budget_exhausted_async(user_id)
+    if not sem_llm:
+        try:
+            params_from_llm = await get_query_params_from_natural_language_async(user_query, user_id)
+        except (FilaCheiaError, LLMIndisponivelError) as e:
+            logger.warning(f"LLM indisponível para {user_id} ({e}); usando as heurísticas locais.")
+            sem_llm = True
+    if sem_llm:
+        # Sem orçamento, fila do LLM cheia ou Gemini fora do ar: a pergunta é interpretada pelas heurísticas locais.
+        params_from_llm = interpretar_pergunta(user_query, datetime.now(timezone.utc))
 
     if not params_from_llm:
         await update.message.reply_text(
@@ -374,10 +578,10 @@ async def handle_stat_query(update: Update, context: ContextTypes.DEFAULT_TYPE)
         )
         return PROCESS_STAT_QUERY 
 
-    db_session = SessionLocal()
+    db_session = AsyncSessionLocal()
     data_summary_for_llm = "Nenhuma informação encontrada."
     try:
-        results = query_dynamic_transactions(db_session, user_id, params_from_llm)
+        results = await query_dynamic_transactions_async(db_session, user_id, params_from_llm, preview_limit=STATS_PREVIEW_LIMIT)
         
         operacao = params_from_llm.get("operacao", "listar_transacoes")
 
@@ -407,12 +611,12 @@ async def handle_stat_query(update: Update, context: ContextTypes.DEFAULT_TYPE)
         
         elif operacao == "listar_transacoes":
             transacoes = results.get("transacoes", [])
+            contagem = results.get("contagem", len(transacoes))
             if not transacoes:
                 data_summary_for_llm = "Nenhuma transação encontrada para os critérios informados."
             else:
-                data_summary_for_llm = f"Encontrei {len(transacoes)} transação(ões). "
-                preview_limit = 3 
-                for i, t in enumerate(transacoes[:preview_limit]):
+                data_summary_for_llm = f"Encontrei {contagem} transação(ões). "
+                for i, t in enumerate(transacoes):
                     try:
                         from zoneinfo import ZoneInfo
                         try:
@@ -425,28 +629,235 @@ async def handle_stat_query(update: Update, context: ContextTypes.DEFAULT_TYPE)
 
 
                     data_summary_for_llm += f"{i+1}. {t.tipo.capitalize()} de {format_currency(t.valor)} em '{t.categoria}': {t.descricao} ({data_hora_local_display}). "
-                if len(transacoes) > preview_limit:
-                    data_summary_for_llm += f"E mais {len(transacoes) - preview_limit} outras."
+                if contagem > len(transacoes):
+                    data_summary_for_llm += f"E mais {contagem - len(transacoes)} outras."
+
+        elif operacao in OPERACOES_AGRUPADAS:
+            grupos = results.get("grupos", [])
+            if not grupos:
+                data_summary_for_llm = "Nenhuma transação encontrada para os critérios informados."
+            else:
+                data_summary_for_llm = _resumir_grupos(operacao, grupos)
         
-        await context.bot.send_chat_action(chat_id=chat_id, action="typing")
-        conversational_reply = generate_conversational_response(user_query, data_summary_for_llm)
+        # Resultados simples (um número ou nada encontrado) são respondidos por template, sem segunda chamada ao LLM.
+        conversational_reply = render_stat_response(operacao, results, params_from_llm)
+        if conversational_reply is None and sem_llm:
+            conversational_reply = data_summary_for_llm
+        elif conversational_reply is None:
+            await context.bot.send_chat_action(chat_id=chat_id, action="typing")
+            try:
+                conversational_reply = await generate_conversational_response_async(user_query, data_summary_for_llm, user_id)
+            except (FilaCheiaError, LLMIndisponivelError):
+                conversational_reply = data_summary_for_llm
         await update.message.reply_text(conversational_reply)
 
     except Exception as e:
         logger.error(f"Erro ao executar consulta dinâmica ou gerar resposta: {e}", exc_info=True)
         await update.message.reply_text("Ocorreu um erro ao processar sua solicitação de estatística. Por favor, tente novamente mais tarde.")
     finally:
-        if db_session.is_active:
-            db_session.close()
+        await db_session.close()
     
     return ConversationHandler.END
 
+@medir_latencia("gastaai_handler_seconds", label="handler")
+@serializar_por_usuario
 async def cancelar_estatisticas(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
     """Cancela a conversa de estatísticas."""
     await update.message.reply_text("Consulta de estatísticas cancelada.")
     return ConversationHandler.END
 
 
+@medir_latencia("gastaai_handler_seconds", label="handler")
+@serializar_por_usuario
+async def exportar_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    user_id = str(update.effective_user.id)
+    formato = FORMATOS_EXPORTACAO.get((context.args[0] if context.args else "csv").lower())
+    if formato is None:
+        await update.message.reply_text("Formato inválido. Use /exportar csv ou /exportar jsonl.")
+        return
+
+    await context.bot.send_chat_action(chat_id=update.effective_chat.id, action="upload_document")
+    with tempfile.SpooledTemporaryFile(max_size=EXPORT_SPOOL_MAX_BYTES) as arquivo:
+        try:
+            total = await export_transactions_async(AsyncSessionLocal(), user_id, arquivo, formato)
+        except Exception as e:
+            logger.error(f"Erro ao exportar transações de {user_id}: {e}", exc_info=True)
+            await update.message.reply_text("Não foi possível exportar suas transações no momento. Por favor, tente novamente mais tarde.")
+            return
+
+        if total == 0:
+            await update.message.reply_text("Você ainda não tem transações registradas para exportar. 📭")
+            return
+
+        arquivo.seek(0)
+        nome_arquivo = f"gasta_ai_{datetime.now(timezone.utc).strftime('%Y%m%d')}.{formato}"
+        # read_file_handle=False faz o PTB enviar o próprio arquivo no upload, sem carregá-lo inteiro na memória.
+        await update.message.reply_document(
+            document=InputFile(arquivo, filename=nome_arquivo, read_file_handle=False),
+            caption=f"📤 {total} transação(ões) exportada(s).",
+        )
+
+@medir_latencia("gastaai_handler_seconds", label="handler")
+@serializar_por_usuario
+async def importar_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
+    await update.message.reply_text(
+        "Me envie o extrato do seu banco como arquivo CSV ou OFX. 📄\n\n"
+        "No CSV, preciso de colunas de data, descrição (ou histórico) e valor. "
+        "Valores negativos viram gastos e positivos viram entradas.\n\n"
+        "Para desistir, utilize /cancelar_importacao."
+    )
+    return PROCESS_IMPORT_FILE
+
+@medir_latencia("gastaai_handler_seconds", label="handler")
+@serializar_por_usuario
+async def handle_import_file(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
+    user_id = str(update.effective_user.id)
+    documento = update.message.document
+    logger.info(f"Recebido extrato de {user_id}: '{documento.file_name}' ({documento.file_size} bytes)")
+    await context.bot.send_chat_action(chat_id=update.effective_chat.id, action="upload_document")
+
+    with tempfile.TemporaryDirectory() as diretorio:
+        caminho = os.path.join(diretorio, "extrato")
+        try:
+            arquivo = await documento.get_file()
+            await arquivo.download_to_drive(caminho)
+            await update.message.reply_text("Arquivo recebido! Importando suas transações, isso pode levar alguns segundos... ⏳")
+            resumo = await importar_extrato(caminho, documento.file_name, user_id)
+        except ErroImportacao as e:
+            await update.message.reply_text(f"Não consegui ler esse arquivo: {e}\nEnvie outro arquivo ou utilize /cancelar_importacao.")
+            return PROCESS_IMPORT_FILE
+        except Exception as e:
+            logger.error(f"Erro ao importar extrato de {user_id}: {e}", exc_info=True)
+            await update.message.reply_text("Ocorreu um erro ao importar o extrato. Por favor, tente novamente mais tarde.")
+            return ConversationHandler.END
+
+    mensagem = (
+        f"✅ Importação concluída: {resumo['importadas']} transação(ões) salva(s).\n"
+        f"Total de saídas: {format_currency(resumo['total_saidas'])}\n"
+        f"Total de entradas: {format_currency(resumo['total_entradas'])}"
+    )
+    if resumo["ignoradas"]:
+        mensagem += f"\n⚠️ {resumo['ignoradas']} linha(s) ignorada(s) por falta de data ou valor válido."
+    await update.message.reply_text(mensagem)
+    return ConversationHandler.END
+
+@medir_latencia("gastaai_handler_seconds", label="handler")
+@serializar_por_usuario
+async def cancelar_importacao(update: Update, context: ContextTypes.DEFAULT_TYPE) -> int:
+    """Cancela a conversa de importação de extrato."""
+    await update.message.reply_text("Importação cancelada.")
+    return ConversationHandler.END
+
+
+@medir_latencia("gastaai_handler_seconds", label="handler")
+async def grafico_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """
+    Uso: /grafico [categorias|mensal|diario] [período]. A agregação é feita no banco e o desenho num
+    processo separado; a imagem fica em cache até o usuário registrar uma nova transação.
+    """
+    user_id = str(update.effective_user.id)
+    tipo = (context.args[0] if context.args else "categorias").lower()
+    if tipo not in TIPOS_GRAFICO:
+        await update.message.reply_text("Tipo de gráfico inválido. Use /grafico categorias, /grafico mensal ou /grafico diario, seguido do período (ex: /grafico categorias mês passado).")
+        return
+    texto_periodo = " ".join(context.args[1:]) or TIPOS_GRAFICO[tipo]["periodo_padrao"]
+    inicio, fim = parse_periodo_descricao(texto_periodo, datetime.now(timezone.utc))
+    if inicio is None or fim is None:
+        await update.message.reply_text(f"Não entendi o período '{texto_periodo}'. Tente, por exemplo, 'este mês', 'mês passado' ou 'este ano'.")
+        return
+
+    legenda = f"{TIPOS_GRAFICO[tipo]['titulo']} ({inicio.strftime('%d/%m/%Y')} a {fim.strftime('%d/%m/%Y')})"
+    await context.bot.send_chat_action(chat_id=update.effective_chat.id, action="upload_photo")
+    try:
+        versao = await get_versao_dados_async(AsyncSessionLocal(), user_id)
+        chave = chave_grafico(user_id, tipo, inicio, fim, versao)
+        imagem = await asyncio.to_thread(cache_graficos.get, chave)
+        if imagem is None:
+            results = await query_dynamic_transactions_async(AsyncSessionLocal(), user_id, parametros_grafico(tipo, inicio, fim))
+            grupos = results.get("grupos", [])
+            if not grupos:
+                await update.message.reply_text(f"Nenhuma transação encontrada para o período de {inicio.strftime('%d/%m/%Y')} a {fim.strftime('%d/%m/%Y')}. 📭")
+                return
+            imagem = await renderizar_grafico_async(tipo, grupos, legenda)
+            await asyncio.to_thread(cache_graficos.set, chave, imagem)
+    except Exception as e:
+        logger.error(f"Erro ao gerar gráfico '{tipo}' de {user_id}: {e}", exc_info=True)
+        await update.message.reply_text("Não foi possível gerar o gráfico no momento. Por favor, tente novamente mais tarde.")
+        return
+
+    await update.message.reply_photo(photo=imagem, caption=f"📊 {legenda}")
+
+
+@medir_latencia("gastaai_handler_seconds", label="handler")
+async def consumo_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Comando administrativo: usuários que mais consumiram tokens do LLM e custo estimado. Uso: /consumo [dias]."""
+    if str(update.effective_user.id) not in ADMIN_USER_IDS:
+        await update.message.reply_text("Este comando é restrito aos administradores do bot.")
+        return
+
+    try:
+        dias = max(1, int(context.args[0])) if context.args else 1
+    except ValueError:
+        await update.message.reply_text("Uso: /consumo [dias]. Exemplo: /consumo 7")
+        return
+
+    try:
+        consumidores = await get_maiores_consumidores_async(AsyncSessionLocal(), dias=dias, limite=10)
+    except Exception as e:
+        logger.error(f"Erro ao consultar consumo de tokens: {e}")
+        await update.message.reply_text("Não foi possível consultar o consumo de tokens no momento.")
+        return
+
+    periodo = "hoje (UTC)" if dias == 1 else f"nos últimos {dias} dias"
+    if not consumidores:
+        await update.message.reply_text(f"Nenhum uso de tokens registrado {periodo}.")
+        return
+
+    linhas = [f"📊 Maiores consumidores de tokens {periodo}:\n"]
+    custo_total = 0.0
+    for i, c in enumerate(consumidores, start=1):
+        custo = (c["prompt_tokens"] * LLM_PRICE_PROMPT_PER_MILLION + c["completion_tokens"] * LLM_PRICE_COMPLETION_PER_MILLION) / 1_000_000
+        custo_total += custo
+        linhas.append(
+            f"{i}. {c['usuario_id']}: {c['prompt_tokens'] + c['completion_tokens']:,} tokens "
+            f"({c['prompt_tokens']:,} prompt / {c['completion_tokens']:,} resposta) em {c['chamadas']} chamadas, ~US$ {custo:.4f}"
+        )
+    linhas.append(f"\nCusto estimado dos listados: ~US$ {custo_total:.4f}")
+    await update.message.reply_text("\n".join(linhas))
+
+
+async def limpar_confirmacoes_expiradas(context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Job periódico que apaga confirmações pendentes que o usuário nunca respondeu."""
+    try:
+        removidas = await purge_expired_confirmations_async(AsyncSessionLocal())
+        if removidas:
+            logger.info(f"{removidas} confirmação(ões) pendente(s) expirada(s) removida(s).")
+            metrics.inc("gastaai_confirmacoes_expiradas_total", removidas, origem="limpeza")
+    except Exception as e:
+        logger.error(f"Erro ao limpar confirmações expiradas: {e}")
+
+
+async def registrar_metricas(context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Job periódico que escreve no log o resumo das métricas (latências e contadores)."""
+    logger.info(f"Métricas: {metrics.resumo_metricas()}")
+    logger.info(f"Fila do LLM: {escalonador_llm.stats()} | circuito: {circuito_llm.estado}")
+    if query_params_cache is not None:
+        logger.info(f"Cache de parâmetros de consulta: {query_params_cache.stats()}")
+    logger.info(f"Cache de gráficos: {cache_graficos.stats()}")
+
+async def iniciar_servicos(application: Application) -> None:
+    """
+    post_init: sobe o endpoint /metrics no mesmo event loop do bot, se METRICS_PORT estiver definido,
+    e os processos que desenham os gráficos do /grafico.
+    """
+    application.bot_data["servidor_metricas"] = await iniciar_servidor_metricas()
+    aquecer_processos()
+
+async def encerrar_servicos(application: Application) -> None:
+    """post_shutdown: encerra os processos de desenho dos gráficos."""
+    encerrar_processos()
+
+
 async def error_handler(update: object, context: ContextTypes.DEFAULT_TYPE) -> None:
     """Loga os erros causados por Updates."""
     logger.error(f"Update {update} causou erro {context.error}", exc_info=context.error)
@@ -462,11 +873,28 @@ def main() -> None:
     if not TELEGRAM_BOT_TOKEN:
         logger.error("Token do Telegram não configurado. Por favor, verifique o arquivo .env.")
         return
-    if not os.getenv("GEMINI_API_KEY"):
+    if LLM_BACKEND == "gemini" and not os.getenv("GEMINI_API_KEY"):
         logger.error("API Key do Gemini não configurada. Por favor, verifique o arquivo .env.")
         return
 
-    application = Application.builder().token(TELEGRAM_BOT_TOKEN).build()
+    if BOT_MODE == "webhook" and not WEBHOOK_URL:
+        logger.error("BOT_MODE=webhook exige WEBHOOK_URL. Por favor, verifique o arquivo .env.")
+        return
+    if CONCURRENT_UPDATES > 1 and MAX_UPDATES_PENDENTES_POR_USUARIO > CONCURRENT_UPDATES // 2:
+        logger.warning(
+            f"MAX_UPDATES_PENDENTES_POR_USUARIO={MAX_UPDATES_PENDENTES_POR_USUARIO} ocupa mais da metade das "
+            f"{CONCURRENT_UPDATES} vagas de CONCURRENT_UPDATES; um único usuário pode atrasar os demais."
+        )
+
+    application = (
+        Application.builder()
+        .token(TELEGRAM_BOT_TOKEN)
+        .concurrent_updates(CONCURRENT_UPDATES if CONCURRENT_UPDATES > 1 else False)
+        .request(HTTPXRequestComMetricas(connection_pool_size=256))
+        .post_init(iniciar_servicos)
+        .post_shutdown(encerrar_servicos)
+        .build()
+    )
 
 
     stats_conv_handler = ConversationHandler(
@@ -478,20 +906,50 @@ def main() -> None:
     )
     application.add_handler(stats_conv_handler)
 
+    import_conv_handler = ConversationHandler(
+        entry_points=[CommandHandler("importar", importar_command)],
+        states={
+            PROCESS_IMPORT_FILE: [MessageHandler(filters.Document.ALL, handle_import_file)],
+        },
+        fallbacks=[CommandHandler("cancelar_importacao", cancelar_importacao)],
+    )
+    application.add_handler(import_conv_handler)
+
     application.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, handle_message))
 
     application.add_handler(CallbackQueryHandler(handle_transaction_confirmation, pattern=f"^{TRANSACTION_CALLBACK_PREFIX}_(save|retry)_\\d+$"))
+    application.add_handler(CallbackQueryHandler(handle_paginacao_transacoes, pattern=f"^{PAGINACAO_CALLBACK_PREFIX}_(s|e)_(a|r)_\\d+_\\d+$"))
 
     application.add_handler(CommandHandler("start", start))
     application.add_handler(CommandHandler("ajuda", help_command))
     application.add_handler(CommandHandler("saldo", saldo_command))
     application.add_handler(CommandHandler("gastos", gastos_command))
     application.add_handler(CommandHandler("entradas", entradas_command))
+    application.add_handler(CommandHandler("exportar", exportar_command))
+    application.add_handler(CommandHandler("consumo", consumo_command))
+    application.add_handler(CommandHandler("grafico", grafico_command))
 
     application.add_error_handler(error_handler)
 
-    logger.info("Bot iniciado com sucesso e pronto para receber comandos.")
-    application.run_polling()
+    if application.job_queue is not None:
+        application.job_queue.run_repeating(limpar_confirmacoes_expiradas, interval=PENDING_SWEEP_INTERVAL_SECONDS, first=PENDING_SWEEP_INTERVAL_SECONDS)
+        if METRICS_DUMP_INTERVAL_SECONDS > 0:
+            application.job_queue.run_repeating(registrar_metricas, interval=METRICS_DUMP_INTERVAL_SECONDS, first=METRICS_DUMP_INTERVAL_SECONDS)
+    else:
+        logger.warning("JobQueue indisponível (instale python-telegram-bot[job-queue]); confirmações expiradas não serão limpas periodicamente.")
+
+    if BOT_MODE == "webhook":
+        logger.info(f"Bot iniciado em modo webhook na porta {WEBHOOK_PORT} (até {CONCURRENT_UPDATES} updates simultâneos).")
+        application.run_webhook(
+            listen=WEBHOOK_LISTEN,
+            port=WEBHOOK_PORT,
+            url_path=WEBHOOK_PATH,
+            webhook_url=f"{WEBHOOK_URL.rstrip('/')}/{WEBHOOK_PATH}",
+            secret_token=WEBHOOK_SECRET or None,
+        )
+    else:
+        logger.info("Bot iniciado com sucesso e pronto para receber comandos.")
+        application.run_polling()
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
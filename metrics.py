@@ -0,0 +1,222 @@
+import os
+import time
+import asyncio
+import logging
+import threading
+import functools
+from contextlib import contextmanager
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+logger = logging.getLogger(__name__)
+
+# Porta do endpoint HTTP no formato texto do Prometheus (GET /metrics). Vazio desliga o endpoint.
+METRICS_PORT = os.getenv("METRICS_PORT")
+METRICS_HOST = os.getenv("METRICS_HOST", "127.0.0.1")
+# Intervalo do resumo periódico das métricas no log. 0 desliga.
+METRICS_DUMP_INTERVAL_SECONDS = int(os.getenv("METRICS_DUMP_INTERVAL_SECONDS", "0"))
+
+# Limites (em segundos) dos buckets dos histogramas de latência.
+BUCKETS_LATENCIA = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+# Nome da métrica -> texto de ajuda do Prometheus.
+DESCRICOES = {
+    "gastaai_llm_request_seconds": "Latência das chamadas ao LLM, por função de llm_client.",
+    "gastaai_llm_falhas_total": "Falhas nas chamadas ao LLM, por função e motivo (erro_api, timeout, erro_transitorio, circuito_aberto, json_invalido).",
+    "gastaai_llm_retentativas_total": "Novas tentativas de chamadas ao LLM após erros transitórios, por função.",
+    "gastaai_llm_fallback_total": "Chamadas ao LLM atendidas pelo modelo reserva (LLM_FALLBACK_MODEL_NAME), por função.",
+    "gastaai_llm_circuito_estado": "Estado do circuit breaker do LLM (0 fechado, 1 meio aberto, 2 aberto).",
+    "gastaai_llm_circuito_transicoes_total": "Mudanças de estado do circuit breaker do LLM, por estado de destino.",
+    "gastaai_db_seconds": "Latência das funções públicas de database.py.",
+    "gastaai_telegram_api_seconds": "Latência das chamadas à API do Telegram, por método.",
+    "gastaai_handler_seconds": "Latência total dos handlers do bot, por handler.",
+    "gastaai_confirmacoes_expiradas_total": "Confirmações pendentes expiradas, por origem (clique ou limpeza).",
+    "gastaai_llm_fila_espera_seconds": "Tempo de espera na fila do escalonador antes da chamada ao LLM.",
+    "gastaai_llm_fila_profundidade": "Chamadas ao LLM aguardando na fila do escalonador.",
+    "gastaai_llm_em_voo": "Chamadas ao LLM em andamento.",
+    "gastaai_llm_fila_rejeicoes_total": "Chamadas ao LLM recusadas porque a fila do usuário estava cheia.",
+    "gastaai_updates_rejeitados_total": "Updates recusados porque o usuário já tinha muitos updates aguardando.",
+    "gastaai_query_cache_total": "Consultas ao cache de parâmetros do /estatisticas por resultado (hit ou miss).",
+    "gastaai_grafico_cache_total": "Pedidos do /grafico por resultado no cache de imagens (hit ou miss).",
+    "gastaai_grafico_cache_bytes": "Bytes ocupados pelas imagens no cache do /grafico.",
+    "gastaai_grafico_render_seconds": "Tempo para desenhar um gráfico no pool de processos, incluindo a espera por um processo livre, por tipo.",
+}
+
+
+class Histogram:
+    def __init__(self, buckets: tuple = BUCKETS_LATENCIA):
+        self.buckets = buckets
+        self.contagens = [0] * len(buckets)
+        self.soma = 0.0
+        self.total = 0
+
+    def observe(self, valor: float):
+        for i, limite in enumerate(self.buckets):
+            if valor <= limite:
+                self.contagens[i] += 1
+                break
+        self.soma += valor
+        self.total += 1
+
+    def percentil(self, p: float) -> float | None:
+        """Estimativa pelo limite do bucket (mesma aproximação do histogram_quantile do Prometheus, sem interpolação)."""
+        if not self.total:
+            return None
+        alvo = p / 100 * self.total
+        acumulado = 0
+        for limite, contagem in zip(self.buckets, self.contagens):
+            acumulado += contagem
+            if acumulado >= alvo:
+                return limite
+        return float("inf")
+
+
+_lock = threading.Lock()
+_histogramas = {}  # (nome, labels ordenados) -> Histogram
+_contadores = {}  # (nome, labels ordenados) -> float
+_gauges = {}  # (nome, labels ordenados) -> float
+
+
+def _chave(nome: str, labels: dict) -> tuple:
+    return nome, tuple(sorted(labels.items()))
+
+def observe(nome: str, valor: float, **labels) -> None:
+    """Registra uma observação (ex: latência em segundos) no histograma `nome`."""
+    with _lock:
+        chave = _chave(nome, labels)
+        if chave not in _histogramas:
+            _histogramas[chave] = Histogram()
+        _histogramas[chave].observe(valor)
+
+def inc(nome: str, valor: float = 1, **labels) -> None:
+    """Incrementa o contador `nome`."""
+    with _lock:
+        chave = _chave(nome, labels)
+        _contadores[chave] = _contadores.get(chave, 0) + valor
+
+def set_gauge(nome: str, valor: float, **labels) -> None:
+    """Define o valor atual do gauge `nome` (ex: profundidade de uma fila)."""
+    with _lock:
+        _gauges[_chave(nome, labels)] = valor
+
+@contextmanager
+def medir(nome: str, **labels):
+    """Mede o tempo do bloco `with` e registra no histograma `nome`."""
+    inicio = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe(nome, time.perf_counter() - inicio, **labels)
+
+def medir_latencia(nome: str, label: str = "funcao"):
+    """
+    Decorator que registra a latência de cada chamada no histograma `nome`, com o nome da função
+    no label `label`. Funciona com funções síncronas e assíncronas.
+    """
+    def decorator(funcao):
+        if asyncio.iscoroutinefunction(funcao):
+            @functools.wraps(funcao)
+            async def wrapper_async(*args, **kwargs):
+                with medir(nome, **{label: funcao.__name__}):
+                    return await funcao(*args, **kwargs)
+            return wrapper_async
+
+        @functools.wraps(funcao)
+        def wrapper(*args, **kwargs):
+            with medir(nome, **{label: funcao.__name__}):
+                return funcao(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def _formatar_labels(labels: tuple, extra: tuple = ()) -> str:
+    pares = [f'{k}="{str(v)}"' for k, v in labels + extra]
+    return "{" + ",".join(pares) + "}" if pares else ""
+
+def render_prometheus() -> str:
+    """Todas as métricas no formato texto de exposição do Prometheus."""
+    with _lock:
+        histogramas = {chave: (list(h.contagens), h.soma, h.total, h.buckets) for chave, h in _histogramas.items()}
+        contadores = dict(_contadores)
+        gauges = dict(_gauges)
+
+    linhas = []
+    nomes_vistos = set()
+    for (nome, labels), (contagens, soma, total, buckets) in sorted(histogramas.items()):
+        if nome not in nomes_vistos:
+            nomes_vistos.add(nome)
+            linhas.append(f"# HELP {nome} {DESCRICOES.get(nome, nome)}")
+            linhas.append(f"# TYPE {nome} histogram")
+        acumulado = 0
+        for limite, contagem in zip(buckets, contagens):
+            acumulado += contagem
+            linhas.append(f"{nome}_bucket{_formatar_labels(labels, (('le', limite),))} {acumulado}")
+        linhas.append(f"{nome}_bucket{_formatar_labels(labels, (('le', '+Inf'),))} {total}")
+        linhas.append(f"{nome}_sum{_formatar_labels(labels)} {soma}")
+        linhas.append(f"{nome}_count{_formatar_labels(labels)} {total}")
+    for (nome, labels), valor in sorted(contadores.items()):
+        if nome not in nomes_vistos:
+            nomes_vistos.add(nome)
+            linhas.append(f"# HELP {nome} {DESCRICOES.get(nome, nome)}")
+            linhas.append(f"# TYPE {nome} counter")
+        linhas.append(f"{nome}{_formatar_labels(labels)} {valor}")
+    for (nome, labels), valor in sorted(gauges.items()):
+        if nome not in nomes_vistos:
+            nomes_vistos.add(nome)
+            linhas.append(f"# HELP {nome} {DESCRICOES.get(nome, nome)}")
+            linhas.append(f"# TYPE {nome} gauge")
+        linhas.append(f"{nome}{_formatar_labels(labels)} {valor}")
+    return "\n".join(linhas) + "\n"
+
+def resumo_metricas() -> dict:
+    """Resumo legível (contagem, média, p50/p95/p99 aproximados em ms e contadores), usado no dump periódico."""
+    with _lock:
+        resumo = {}
+        for (nome, labels), h in sorted(_histogramas.items()):
+            rotulo = nome + _formatar_labels(labels)
+            resumo[rotulo] = {
+                "n": h.total,
+                "media_ms": round(h.soma / h.total * 1000, 1) if h.total else None,
+                **{f"p{p}_ms": (h.percentil(p) * 1000 if h.percentil(p) is not None else None) for p in (50, 95, 99)},
+            }
+        for (nome, labels), valor in sorted(list(_contadores.items()) + list(_gauges.items())):
+            resumo[nome + _formatar_labels(labels)] = valor
+        return resumo
+
+def reset() -> None:
+    with _lock:
+        _histogramas.clear()
+        _contadores.clear()
+        _gauges.clear()
+
+
+async def _responder_http(reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+    try:
+        linha_requisicao = await reader.readline()
+        while (await reader.readline()) not in (b"\r\n", b"\n", b""):
+            pass  # descarta os cabeçalhos
+        partes = linha_requisicao.decode("latin-1").split()
+        if len(partes) >= 2 and partes[0] == "GET" and partes[1].split("?")[0] == "/metrics":
+            status, corpo = "200 OK", render_prometheus().encode("utf-8")
+        else:
+            status, corpo = "404 Not Found", b"Not Found\n"
+        writer.write(
+            f"HTTP/1.1 {status}\r\nContent-Type: text/plain; version=0.0.4; charset=utf-8\r\n"
+            f"Content-Length: {len(corpo)}\r\nConnection: close\r\n\r\n".encode("latin-1") + corpo
+        )
+        await writer.drain()
+    except Exception as e:
+        logger.warning(f"Erro ao responder requisição de métricas: {e}")
+    finally:
+        writer.close()
+
+async def iniciar_servidor_metricas(host: str = METRICS_HOST, port: int | None = None):
+    """Sobe o endpoint GET /metrics no event loop atual. Retorna o asyncio.Server (ou None se desligado)."""
+    port = port if port is not None else (int(METRICS_PORT) if METRICS_PORT else None)
+    if port is None:
+        return None
+    servidor = await asyncio.start_server(_responder_http, host, port)
+    logger.info(f"Métricas disponíveis em http://{host}:{port}/metrics")
+    return servidor
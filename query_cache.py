@@ -0,0 +1,175 @@
+import os
+import re
+import json
+import time
+import sqlite3
+import threading
+import unicodedata
+from collections import OrderedDict
+from datetime import datetime, timezone
+
+from dotenv import load_dotenv
+
+import metrics
+
+load_dotenv()
+
+QUERY_CACHE_BACKEND = os.getenv("QUERY_CACHE_BACKEND", "memory")  # "memory", "sqlite" ou "off"
+QUERY_CACHE_MAX_ENTRIES = int(os.getenv("QUERY_CACHE_MAX_ENTRIES", "1000"))
+QUERY_CACHE_TTL_SECONDS = float(os.getenv("QUERY_CACHE_TTL_SECONDS", "21600"))
+QUERY_CACHE_PATH = os.getenv("QUERY_CACHE_PATH", "query_cache.db")
+
+
+def normalize_query(user_query: str) -> str:
+    """Minúsculas, sem acentos, sem pontuação e com espaços colapsados: "Quanto gastei este mês?" -> "quanto gastei este mes"."""
+    texto = unicodedata.normalize("NFKD", user_query.casefold())
+    texto = "".join(c for c in texto if not unicodedata.combining(c))
+    texto = re.sub(r"[^\w\s/$.,-]", " ", texto)
+    texto = re.sub(r"(?<!\d)[.,]|[.,](?!\d)", " ", texto)
+    return " ".join(texto.split())
+
+def make_cache_key(user_query: str, current_time_utc: datetime | None = None) -> str:
+    """
+    Chave do cache: data UTC + pergunta normalizada.
+    A data entra na chave porque o prompt resolve períodos relativos ("este mês") a partir dela.
+    """
+    current_time_utc = current_time_utc or datetime.now(timezone.utc)
+    return f"{current_time_utc.strftime('%Y-%m-%d')}|{normalize_query(user_query)}"
+
+
+class QueryCache:
+    """Cache LRU em memória com expiração por TTL para os parâmetros de consulta retornados pelo LLM."""
+
+    # True quando get/set fazem I/O (ex: SQLite) e devem rodar fora do event loop.
+    bloqueante = False
+
+    def __init__(self, max_entries: int = QUERY_CACHE_MAX_ENTRIES, ttl_seconds: float = QUERY_CACHE_TTL_SECONDS):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self._entries = OrderedDict()  # chave -> (expira_em, valor_json)
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def get(self, key: str) -> dict | None:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self._registrar_miss()
+                return None
+            expira_em, valor_json = entry
+            if expira_em <= time.time():
+                del self._entries[key]
+                self.expirations += 1
+                self._registrar_miss()
+                return None
+            self._entries.move_to_end(key)
+            self._registrar_hit()
+            return json.loads(valor_json)
+
+    def set(self, key: str, value: dict) -> None:
+        with self._lock:
+            self._entries[key] = (time.time() + self.ttl_seconds, json.dumps(value, ensure_ascii=False))
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def _registrar_hit(self) -> None:
+        self.hits += 1
+        metrics.inc("gastaai_query_cache_total", resultado="hit")
+
+    def _registrar_miss(self) -> None:
+        self.misses += 1
+        metrics.inc("gastaai_query_cache_total", resultado="miss")
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def stats(self) -> dict:
+        total = self.hits + self.misses
+        return {
+            "backend": "memory",
+            "entradas": len(self),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / total if total else 0.0,
+            "evictions": self.evictions,
+            "expirations": self.expirations,
+        }
+
+
+class SQLiteQueryCache(QueryCache):
+    """
+    Mesmo comportamento de QueryCache, mas guardado em um arquivo SQLite para sobreviver a reinícios.
+    A ordem LRU é mantida pela coluna acessado_em.
+    """
+
+    bloqueante = True
+
+    def __init__(self, path: str = QUERY_CACHE_PATH, max_entries: int = QUERY_CACHE_MAX_ENTRIES, ttl_seconds: float = QUERY_CACHE_TTL_SECONDS):
+        super().__init__(max_entries, ttl_seconds)
+        self.path = path
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS query_cache ("
+            " chave TEXT PRIMARY KEY, valor TEXT NOT NULL, expira_em REAL NOT NULL, acessado_em REAL NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS ix_query_cache_acessado_em ON query_cache (acessado_em)")
+        self._conn.commit()
+
+    def get(self, key: str) -> dict | None:
+        with self._lock:
+            agora = time.time()
+            row = self._conn.execute("SELECT valor, expira_em FROM query_cache WHERE chave = ?", (key,)).fetchone()
+            if row is None:
+                self._registrar_miss()
+                return None
+            valor_json, expira_em = row
+            if expira_em <= agora:
+                self._conn.execute("DELETE FROM query_cache WHERE chave = ?", (key,))
+                self._conn.commit()
+                self.expirations += 1
+                self._registrar_miss()
+                return None
+            self._conn.execute("UPDATE query_cache SET acessado_em = ? WHERE chave = ?", (agora, key))
+            self._conn.commit()
+            self._registrar_hit()
+            return json.loads(valor_json)
+
+    def set(self, key: str, value: dict) -> None:
+        with self._lock:
+            agora = time.time()
+            self._conn.execute(
+                "INSERT OR REPLACE INTO query_cache (chave, valor, expira_em, acessado_em) VALUES (?, ?, ?, ?)",
+                (key, json.dumps(value, ensure_ascii=False), agora + self.ttl_seconds, agora),
+            )
+            excedente = self._conn.execute("SELECT COUNT(*) FROM query_cache").fetchone()[0] - self.max_entries
+            if excedente > 0:
+                self._conn.execute(
+                    "DELETE FROM query_cache WHERE chave IN (SELECT chave FROM query_cache ORDER BY acessado_em LIMIT ?)",
+                    (excedente,),
+                )
+                self.evictions += excedente
+            self._conn.commit()
+
+    def __len__(self) -> int:
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM query_cache").fetchone()[0]
+
+    def stats(self) -> dict:
+        stats = super().stats()
+        stats["backend"] = "sqlite"
+        return stats
+
+
+def create_query_cache_from_env() -> QueryCache | None:
+    """Cria o cache configurado em QUERY_CACHE_BACKEND, ou None se o cache estiver desligado."""
+    backend = QUERY_CACHE_BACKEND.lower()
+    if backend == "off":
+        return None
+    if backend == "sqlite":
+        return SQLiteQueryCache(QUERY_CACHE_PATH)
+    return QueryCache()
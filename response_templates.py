@@ -0,0 +1,139 @@
+import os
+import random
+from datetime import datetime
+
+from dotenv import load_dotenv
+
+from utils import format_currency
+
+load_dotenv()
+
+# Quando ligado, todas as respostas do /estatisticas são redigidas pelo LLM (comportamento antigo).
+STATS_LLM_PHRASING = os.getenv("STATS_LLM_PHRASING", "false").lower() in ("1", "true", "yes", "sim")
+
+TEMPLATES = {
+    "soma_valor": {
+        "com_resultado": [
+            "Fiz as contas: {alvo}{filtro}{periodo} somam {valor}. 📊",
+            "O total de {alvo}{filtro}{periodo} foi de {valor}. 💰",
+            "Deu {valor} em {alvo}{filtro}{periodo}. Anotado! 😉",
+            "Somando tudo, {alvo}{filtro}{periodo} chegam a {valor}. 🧮",
+        ],
+        "vazio": [
+            "Dei uma olhada e não encontrei {alvo}{filtro}{periodo}. 🤷",
+            "Nada por aqui: nenhum registro de {alvo}{filtro}{periodo}. 👀",
+            "Pelo que vi, não teve {alvo}{filtro}{periodo}. O total é {valor}. ✨",
+        ],
+    },
+    "contar_transacoes": {
+        "com_resultado": [
+            "Encontrei {contagem} {itens}{filtro}{periodo}. 📋",
+            "Ao todo: {contagem} {itens}{filtro}{periodo}. 🔎",
+            "Contei aqui: {contagem} {itens}{filtro}{periodo}. ✅",
+        ],
+        "vazio": [
+            "Não encontrei nenhum registro de {alvo}{filtro}{periodo}. 🤷",
+            "Zero! Nenhum registro de {alvo}{filtro}{periodo}. 👀",
+        ],
+    },
+    "media_valor": {
+        "com_resultado": [
+            "Em média, cada registro de {alvo}{filtro}{periodo} foi de {valor}. 📊",
+            "A média de {alvo}{filtro}{periodo} ficou em {valor}. 🧮",
+            "Cada registro de {alvo}{filtro}{periodo} saiu, em média, por {valor}. 💡",
+        ],
+        "vazio": [
+            "Não consegui calcular uma média: não há {alvo}{filtro}{periodo}. 🤷",
+            "Sem registros de {alvo}{filtro}{periodo}, então não tem média pra mostrar. 👀",
+        ],
+    },
+    "listar_transacoes": {
+        "vazio": [
+            "Dei uma olhada e não encontrei {alvo}{filtro}{periodo}. 🤷",
+            "Nenhum registro de {alvo}{filtro}{periodo} por aqui. 👀",
+        ],
+    },
+}
+# Agrupamentos e séries: sem resultado, a mesma resposta das listas; com resultado, quem redige é o LLM.
+for _operacao in ("agrupar_por_categoria", "serie_mensal", "serie_diaria"):
+    TEMPLATES[_operacao] = {"vazio": TEMPLATES["listar_transacoes"]["vazio"]}
+
+_random = random.Random()
+
+
+def _descrever_alvo(tipo_transacao: str | None) -> str:
+    if tipo_transacao == "saída":
+        return "gastos"
+    if tipo_transacao == "entrada":
+        return "entradas"
+    return "transações"
+
+def _descrever_itens(tipo_transacao: str | None, contagem: int) -> str:
+    singular, plural = {"saída": ("gasto", "gastos"), "entrada": ("entrada", "entradas")}.get(tipo_transacao, ("transação", "transações"))
+    return singular if contagem == 1 else plural
+
+def _descrever_filtro(params: dict) -> str:
+    partes = []
+    categorias = params.get("categorias")
+    if isinstance(categorias, list) and categorias:
+        partes.append(" em " + ", ".join(categorias))
+    palavras = params.get("descricao_contem")
+    if isinstance(palavras, list) and palavras:
+        partes.append(" com " + ", ".join(palavras))
+    return "".join(partes)
+
+def _formatar_data(valor: str | None) -> str | None:
+    if not valor or not isinstance(valor, str):
+        return None
+    try:
+        return datetime.fromisoformat(valor).strftime("%d/%m/%Y")
+    except ValueError:
+        return None
+
+def _descrever_periodo(params: dict) -> str:
+    inicio = _formatar_data(params.get("data_inicio"))
+    fim = _formatar_data(params.get("data_fim"))
+    if inicio and fim:
+        return f" em {inicio}" if inicio == fim else f" entre {inicio} e {fim}"
+    if inicio:
+        return f" desde {inicio}"
+    if fim:
+        return f" até {fim}"
+    return ""
+
+def render_stat_response(operacao: str, results: dict, params: dict) -> str | None:
+    """
+    Monta localmente a resposta do /estatisticas para resultados simples (um número ou nenhum resultado).
+    Retorna None quando a resposta deve ser redigida pelo LLM: listas com resultados,
+    operações sem template ou STATS_LLM_PHRASING ligado.
+    """
+    if STATS_LLM_PHRASING or operacao not in TEMPLATES:
+        return None
+
+    tipo_transacao = params.get("tipo_transacao")
+    contexto = {
+        "alvo": _descrever_alvo(tipo_transacao),
+        "filtro": _descrever_filtro(params),
+        "periodo": _descrever_periodo(params),
+    }
+
+    if operacao == "soma_valor":
+        total = results.get("total", 0.0) or 0.0
+        contexto["valor"] = format_currency(total)
+        vazio = total == 0.0
+    elif operacao == "contar_transacoes":
+        contagem = results.get("contagem", 0) or 0
+        contexto["contagem"] = contagem
+        contexto["itens"] = _descrever_itens(tipo_transacao, contagem)
+        vazio = contagem == 0
+    elif operacao == "media_valor":
+        media = results.get("media", 0.0) or 0.0
+        contexto["valor"] = format_currency(media)
+        vazio = media == 0.0
+    else:
+        vazio = not (results.get("transacoes") or results.get("grupos"))
+
+    templates = TEMPLATES[operacao].get("vazio" if vazio else "com_resultado")
+    if not templates:
+        return None
+    return _random.choice(templates).format(**contexto)